@@ -4,31 +4,152 @@ This module contains the machine learning algorithms for detecting suspicious us
 """
 
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import DBSCAN
 from datetime import datetime, timedelta
 import logging
-from typing import Dict, List, Any, Tuple
+from pathlib import Path
+from typing import Dict, List, Any, Tuple, Optional, TYPE_CHECKING
 import asyncio
 
+# pandas and scikit-learn take over a second to import; they load on first training
+if TYPE_CHECKING:
+    import pandas as pd
+
+from models import ActivityRecord, ACTION_NAMES
+from geo_velocity import ImpossibleTravelDetector
+from rule_engine import RuleEngine, WindowFeatures
+from detectors import Detector, create_detector
+from metrics import STAGE_SECONDS, ERRORS_TOTAL
+from log_pipeline import sampled_event
+
 logger = logging.getLogger(__name__)
 
+# Feature encoding of each action code (enum order); actions the model was
+# never trained on share code 0 with login, as they always have
+_ACTION_FEATURE_MAPPING = {
+    'login': 0, 'logout': 1, 'view_data': 2, 'edit_data': 3,
+    'download': 4, 'upload': 5, 'privilege_escalation': 6,
+    'mass_data_access': 7, 'suspicious_download': 8
+}
+ACTION_FEATURE_CODES = [_ACTION_FEATURE_MAPPING.get(name, 0) for name in ACTION_NAMES]
+
+DEFAULT_RULES_PATH = Path(__file__).resolve().parent / "rules.json"
+
+# Columns of the model's feature vector
+FEATURE_NAMES = ['hour', 'latitude', 'longitude', 'action_type', 'privilege_level', 'success', 'failed_attempts']
+
+def activity_features(activity: ActivityRecord) -> List[float]:
+    """Model feature vector of one activity, in FEATURE_NAMES order"""
+    return [
+        activity.timestamp.hour,  # Time of day
+        activity.scoring_location.get('latitude', 0),  # Geographic location
+        activity.scoring_location.get('longitude', 0),
+        ACTION_FEATURE_CODES[activity.action_code],  # Action type
+        activity.role_code,  # User privilege
+        1 if activity.success else 0,  # Success status
+        activity.failed_attempts  # Failed attempts
+    ]
+
+def generate_training_data(seed: int = 42) -> 'pd.DataFrame':
+    """Generate synthetic training data for the model (label 1 = anomalous)"""
+    import pandas as pd
+
+    np.random.seed(seed)
+
+    # Normal user behavior patterns
+    normal_data = []
+    for _ in range(1000):
+        # Normal login times (9 AM - 6 PM)
+        hour = np.random.normal(12, 3)  # Peak around noon
+        hour = max(0, min(23, hour))
+
+        # Normal locations (within expected geographic area)
+        lat = np.random.normal(40.7128, 0.1)  # NYC area
+        lon = np.random.normal(-74.0060, 0.1)
+
+        # Normal action types
+        action_type = np.random.choice(['login', 'view_data', 'edit_data', 'logout'], 
+                                     p=[0.4, 0.3, 0.2, 0.1])
+
+        # Normal privilege levels
+        privilege = np.random.choice(['user', 'admin'], p=[0.8, 0.2])
+
+        normal_data.append({
+            'hour': hour,
+            'latitude': lat,
+            'longitude': lon,
+            'action_type': action_type,
+            'privilege_level': privilege,
+            'success': True,
+            'failed_attempts': 0,
+            'label': 0
+        })
+
+    # Some anomalous patterns
+    anomalous_data = []
+    for _ in range(100):
+        # Unusual login times (late night/early morning)
+        hour = np.random.choice([0, 1, 2, 3, 4, 22, 23])
+
+        # Unusual locations (far from normal area)
+        lat = np.random.uniform(20, 50)
+        lon = np.random.uniform(-120, -70)
+
+        # Suspicious action patterns
+        action_type = np.random.choice(['privilege_escalation', 'mass_data_access', 
+                                      'suspicious_download'])
+
+        anomalous_data.append({
+            'hour': hour,
+            'latitude': lat,
+            'longitude': lon,
+            'action_type': action_type,
+            'privilege_level': 'admin',
+            'success': False,
+            'failed_attempts': np.random.randint(3, 10),
+            'label': 1
+        })
+
+    # Combine data
+    all_data = normal_data + anomalous_data
+    df = pd.DataFrame(all_data)
+
+    # Convert categorical to numerical
+    df['action_type_encoded'] = pd.Categorical(df['action_type']).codes
+    df['privilege_level_encoded'] = pd.Categorical(df['privilege_level']).codes
+
+    return df
+
+def training_matrix(data: 'pd.DataFrame') -> np.ndarray:
+    """Feature matrix of generate_training_data() rows, in FEATURE_NAMES order"""
+    features = data[[
+        'hour', 'latitude', 'longitude', 'action_type_encoded',
+        'privilege_level_encoded', 'success', 'failed_attempts'
+    ]].values
+
+    return features
+
 class AnomalyDetector:
     """
     AI-powered anomaly detection system for user behavior analysis.
     Uses multiple ML algorithms to identify suspicious patterns.
     """
     
-    def __init__(self):
-        self.isolation_forest = IsolationForest(
-            contamination=0.1,  # 10% of data expected to be anomalies
-            random_state=42,
-            n_estimators=100
-        )
-        self.scaler = StandardScaler()
-        self.dbscan = DBSCAN(eps=0.5, min_samples=5)
+    def __init__(self, rules_path: str = str(DEFAULT_RULES_PATH), engine: str = "isolation_forest",
+                 tenant_engines: Optional[Dict[str, str]] = None):
+        # Scoring engine for the deployment, optionally overridden per tenant
+        self.engine = engine
+        self.tenant_engines = tenant_engines or {}
+        self.contamination = 0.1  # 10% of data expected to be anomalies
+        self.detectors: Dict[str, Detector] = {}
+        self.training_features: Optional[np.ndarray] = None  # what the current detectors were fit on
+        self.model_version = 0
+        self.dbscan_params = {'eps': 0.5, 'min_samples': 5}
+        self._dbscan = None
+        self._train_lock: Optional[asyncio.Lock] = None
+        self.travel_detector = ImpossibleTravelDetector()
+        self.novelty_tracker = None  # NoveltyTracker, attached by the application
+        self.peer_index = None  # PeerGroupIndex, refreshed after each clustering job
+        self.drift_monitor = None  # FeatureDriftMonitor, attached by the application
         self.is_trained = False
         
         # Behavioral patterns to monitor
@@ -48,21 +169,26 @@ class AnomalyDetector:
             'privilege_level': 0.15,
             'device_fingerprint': 0.15
         }
+        
+        # Behavioral rules: suspicious_patterns toggles rule groups, risk_weights feed rule weights
+        self.window_features = WindowFeatures()
+        self.rule_engine = RuleEngine(rules_path, self.risk_weights, self.suspicious_patterns)
+    
+    @property
+    def dbscan(self):
+        """DBSCAN model whose parameters drive peer grouping (built on first use)"""
+        if self._dbscan is None:
+            from sklearn.cluster import DBSCAN
+            self._dbscan = DBSCAN(**self.dbscan_params)
+        return self._dbscan
     
     async def train_model(self):
         """Train the anomaly detection model with historical data"""
         try:
-            # Generate synthetic training data for demonstration
-            training_data = self._generate_training_data()
-            
-            # Extract features
-            features = self._extract_features(training_data)
-            
-            # Scale features
-            features_scaled = self.scaler.fit_transform(features)
-            
-            # Train isolation forest
-            self.isolation_forest.fit(features_scaled)
+            # Imports, data generation and fitting are CPU-bound; keep them off the event loop
+            # The synthetic set's categorical codes differ from the live encoding, so it is no drift reference
+            self.swap_detectors(await asyncio.to_thread(self._fit_detectors), self.training_features,
+                                live_reference=False)
             
             self.is_trained = True
             logger.info("✅ Anomaly detection model trained successfully")
@@ -71,166 +197,209 @@ class AnomalyDetector:
             logger.error(f"Error training model: {e}")
             raise
     
-    def _generate_training_data(self) -> pd.DataFrame:
-        """Generate synthetic training data for the model"""
-        np.random.seed(42)
-        
-        # Normal user behavior patterns
-        normal_data = []
-        for _ in range(1000):
-            # Normal login times (9 AM - 6 PM)
-            hour = np.random.normal(12, 3)  # Peak around noon
-            hour = max(0, min(23, hour))
-            
-            # Normal locations (within expected geographic area)
-            lat = np.random.normal(40.7128, 0.1)  # NYC area
-            lon = np.random.normal(-74.0060, 0.1)
-            
-            # Normal action types
-            action_type = np.random.choice(['login', 'view_data', 'edit_data', 'logout'], 
-                                         p=[0.4, 0.3, 0.2, 0.1])
-            
-            # Normal privilege levels
-            privilege = np.random.choice(['user', 'admin'], p=[0.8, 0.2])
-            
-            normal_data.append({
-                'hour': hour,
-                'latitude': lat,
-                'longitude': lon,
-                'action_type': action_type,
-                'privilege_level': privilege,
-                'success': True,
-                'failed_attempts': 0
-            })
-        
-        # Some anomalous patterns
-        anomalous_data = []
-        for _ in range(100):
-            # Unusual login times (late night/early morning)
-            hour = np.random.choice([0, 1, 2, 3, 4, 22, 23])
-            
-            # Unusual locations (far from normal area)
-            lat = np.random.uniform(20, 50)
-            lon = np.random.uniform(-120, -70)
-            
-            # Suspicious action patterns
-            action_type = np.random.choice(['privilege_escalation', 'mass_data_access', 
-                                          'suspicious_download'])
-            
-            anomalous_data.append({
-                'hour': hour,
-                'latitude': lat,
-                'longitude': lon,
-                'action_type': action_type,
-                'privilege_level': 'admin',
-                'success': False,
-                'failed_attempts': np.random.randint(3, 10)
-            })
-        
-        # Combine data
-        all_data = normal_data + anomalous_data
-        df = pd.DataFrame(all_data)
-        
-        # Convert categorical to numerical
-        df['action_type_encoded'] = pd.Categorical(df['action_type']).codes
-        df['privilege_level_encoded'] = pd.Categorical(df['privilege_level']).codes
-        
-        return df
+    async def ensure_trained(self):
+        """Train once, however many callers are waiting for the model"""
+        if self._train_lock is None:
+            self._train_lock = asyncio.Lock()
+        async with self._train_lock:
+            if not self.is_trained:
+                await self.train_model()
     
-    def _extract_features(self, data: pd.DataFrame) -> np.ndarray:
-        """Extract features for anomaly detection"""
-        features = data[[
-            'hour', 'latitude', 'longitude', 'action_type_encoded',
-            'privilege_level_encoded', 'success', 'failed_attempts'
-        ]].values
+    def _fit_detectors(self) -> Dict[str, Detector]:
+        # Generate synthetic training data for demonstration
+        training_data = generate_training_data()
+        
+        # Extract features
+        features = training_matrix(training_data)
+        self.training_features = features.astype(np.float64)
         
-        return features
+        # Train every engine in use (deployment default plus tenant overrides)
+        return {
+            engine: create_detector(engine, contamination=self.contamination).fit(features)
+            for engine in {self.engine, *self.tenant_engines.values()}
+        }
     
-    async def detect_anomaly(self, activity: 'UserActivity') -> float:
+    async def detect_anomaly(self, activity: 'ActivityRecord') -> float:
         """
         Detect if a user activity is anomalous
         Returns anomaly score between 0 and 1 (1 = highly suspicious)
         """
         try:
             if not self.is_trained:
-                await self.train_model()
+                await self.ensure_trained()
+            if self.novelty_tracker is not None:
+                await self.novelty_tracker.prefetch([activity.user_id])
             
             # Extract features from the activity
-            features = self._extract_activity_features(activity)
-            
-            # Scale features
-            features_scaled = self.scaler.transform([features])
-            
-            # Get anomaly score from isolation forest
-            anomaly_score = self.isolation_forest.decision_function(features_scaled)[0]
+            with STAGE_SECONDS.time(stage='feature_extraction'):
+                features = self._extract_activity_features(activity)
+                if self.drift_monitor is not None:
+                    self.drift_monitor.observe(features)
             
-            # Convert to 0-1 scale (higher = more anomalous)
-            normalized_score = max(0, min(1, (1 - anomaly_score) / 2))
+            # Model score on a 0-1 scale (higher = more anomalous)
+            with STAGE_SECONDS.time(stage='model_score'):
+                normalized_score = self.detector_for(activity).score_batch(np.array([features]))[0]
             
             # Apply behavioral pattern analysis
-            behavioral_score = self._analyze_behavioral_patterns(activity)
+            with STAGE_SECONDS.time(stage='behavioral_rules'):
+                behavioral_score = self._analyze_behavioral_patterns(activity)
             
             # Combine scores
-            final_score = (normalized_score * 0.7) + (behavioral_score * 0.3)
+            final_score = float((normalized_score * 0.7) + (behavioral_score * 0.3))
             
-            logger.info(f"Anomaly detection: score={final_score:.3f} for user {activity.user_id}")
+            logger.info("Anomaly detection", extra=sampled_event(score=round(final_score, 3), user_id=activity.user_id))
             
             return final_score
             
         except Exception as e:
+            ERRORS_TOTAL.inc(stage='anomaly_detection')
             logger.error(f"Error in anomaly detection: {e}")
             return 0.0
     
-    def _extract_activity_features(self, activity: 'UserActivity') -> List[float]:
-        """Extract numerical features from user activity"""
-        # Convert action type to numerical
-        action_mapping = {
-            'login': 0, 'logout': 1, 'view_data': 2, 'edit_data': 3,
-            'download': 4, 'upload': 5, 'privilege_escalation': 6,
-            'mass_data_access': 7, 'suspicious_download': 8
+    async def detect_anomalies(self, activities: List['ActivityRecord']) -> np.ndarray:
+        """detect_anomaly for a batch in event order, with one model call per engine"""
+        try:
+            if not self.is_trained:
+                await self.ensure_trained()
+            if self.novelty_tracker is not None:
+                # One off-loop query for every user of the batch not in memory
+                await self.novelty_tracker.prefetch({activity.user_id for activity in activities})
+            if self.drift_monitor is not None:
+                for activity in activities:
+                    self.drift_monitor.observe(self._extract_activity_features(activity))
+            return self.score_activities(activities)
+            
+        except Exception as e:
+            ERRORS_TOTAL.inc(stage='anomaly_detection')
+            logger.error(f"Error in anomaly detection: {e}")
+            return np.zeros(len(activities))
+    
+    def score_activities(self, activities: List['ActivityRecord']) -> np.ndarray:
+        """
+        detect_anomaly for a batch: one model call per engine and one rule pass.
+        Activities must be in event order; the model must already be trained.
+        """
+        features = np.array([self._extract_activity_features(a) for a in activities], dtype=np.float64)
+        engines = np.array([self.tenant_engines.get((a.additional_data or {}).get('tenant_id'), self.engine)
+                            for a in activities])
+        model_scores = np.zeros(len(activities))
+        for engine in np.unique(engines):
+            mask = engines == engine
+            model_scores[mask] = self.detectors[engine].score_batch(features[mask])
+        return model_scores * 0.7 + self.behavioral_scores(activities) * 0.3
+
+    def swap_detectors(self, detectors: Dict[str, Detector], training_features: np.ndarray,
+                       live_reference: bool = True):
+        """
+        Put freshly fitted detectors into service. A single reference assignment,
+        so concurrent scoring sees either the old set or the new one, never a mix.
+        `live_reference` says the training matrix came from activity_features on
+        real traffic and can serve as the drift reference; otherwise the drift
+        monitor builds its reference from the first live events.
+        """
+        self.training_features = training_features
+        self.detectors = detectors
+        self.model_version += 1
+        if self.drift_monitor is not None:
+            if live_reference:
+                self.drift_monitor.set_reference(training_features)
+            else:
+                self.drift_monitor.reference_from_live()
+    
+    def detector_for(self, activity: 'ActivityRecord') -> Detector:
+        """The engine configured for the activity's tenant (additional_data.tenant_id)"""
+        tenant = (activity.additional_data or {}).get('tenant_id')
+        return self.detectors[self.tenant_engines.get(tenant, self.engine)]
+    
+    def get_detector_info(self) -> Dict[str, Any]:
+        """Configured engines and their parameters"""
+        return {
+            'default_engine': self.engine,
+            'tenant_engines': self.tenant_engines,
+            'detectors': {name: detector.get_params() for name, detector in self.detectors.items()}
         }
+    
+    def _extract_activity_features(self, activity: 'ActivityRecord') -> List[float]:
+        """Extract numerical features from user activity"""
+        if not isinstance(activity, ActivityRecord):
+            activity = ActivityRecord.from_activity(activity)
         
-        # Convert privilege level to numerical
-        privilege_mapping = {'user': 0, 'moderator': 1, 'admin': 2, 'super_admin': 3}
-        
-        features = [
-            activity.timestamp.hour,  # Time of day
-            activity.location.get('latitude', 0),  # Geographic location
-            activity.location.get('longitude', 0),
-            action_mapping.get(activity.action, 0),  # Action type
-            privilege_mapping.get(activity.user_role, 0),  # User privilege
-            1 if activity.success else 0,  # Success status
-            activity.failed_attempts  # Failed attempts
-        ]
-        
-        return features
+        return activity_features(activity)
     
-    def _analyze_behavioral_patterns(self, activity: 'UserActivity') -> float:
+    def _analyze_behavioral_patterns(self, activity: 'ActivityRecord') -> float:
         """Analyze behavioral patterns for additional anomaly detection"""
-        score = 0.0
-        
-        # Check for unusual login times
-        hour = activity.timestamp.hour
-        if hour < 6 or hour > 22:  # Very early morning or late night
-            score += 0.3
-        
-        # Check for rapid failed logins
-        if activity.failed_attempts > 3:
-            score += 0.4
+        return float(self.behavioral_scores([activity])[0])
+    
+    def behavioral_scores(self, activities: List['ActivityRecord']) -> np.ndarray:
+        """Rule-based behavioral scores for a batch of activities"""
+        activities = [a if isinstance(a, ActivityRecord) else ActivityRecord.from_activity(a) for a in activities]
+        return self.rule_engine.evaluate(self._behavioral_columns(activities))
+    
+    def _behavioral_columns(self, activities: List['ActivityRecord']) -> Dict[str, np.ndarray]:
+        """
+        Build the feature columns rules are evaluated on.
+        Updates the stateful detectors (travel, novelty, sliding windows) in event order.
+        """
+        size = len(activities)
+        locations = [a.scoring_location for a in activities]
+        latitude = np.array([location.get('latitude', 0) for location in locations], dtype=np.float64)
+        longitude = np.array([location.get('longitude', 0) for location in locations], dtype=np.float64)
+        timestamps = np.array([a.timestamp.timestamp() for a in activities], dtype=np.float64)
+        has_location = latitude != 0
         
-        # Check for geographic anomalies (simplified)
-        if activity.location.get('latitude', 0) == 0:  # No location data
-            score += 0.2
+        columns = {
+            'hour': np.array([a.timestamp.hour for a in activities], dtype=np.int8),
+            'action': np.array([a.action_code for a in activities], dtype=np.int8),
+            'user_role': np.array([a.role_code for a in activities], dtype=np.int8),
+            'success': np.array([bool(a.success) for a in activities], dtype=np.bool_),
+            'failed_attempts': np.array([a.failed_attempts for a in activities], dtype=np.int32),
+            'latitude': latitude,
+            'longitude': longitude,
+            'has_location': has_location,
+            'travel_score': np.zeros(size),
+            'impossible_travel': np.zeros(size, dtype=np.bool_),
+            'new_location': np.zeros(size, dtype=np.bool_),
+            'new_device': np.zeros(size, dtype=np.bool_),
+            'new_user_agent': np.zeros(size, dtype=np.bool_),
+            'new_ip': np.zeros(size, dtype=np.bool_),
+            'ip_risk': np.array([(a.ip_info or {}).get('risk', 0.0) for a in activities], dtype=np.float64),
+            'ip_trusted': np.array([(a.ip_info or {}).get('trusted', False) for a in activities], dtype=np.bool_),
+            'user_events_1m': np.zeros(size, dtype=np.int32),
+            'user_failures_10m': np.zeros(size, dtype=np.int32),
+            'peer_drift': np.array(
+                [self.peer_index.drift(a.user_id) for a in activities] if self.peer_index else np.zeros(size),
+                dtype=np.float64
+            )
+        }
         
-        # Check for privilege escalation attempts
-        if activity.action == 'privilege_escalation':
-            score += 0.6
+        # Impossible travel / new areas, vectorized across the batch
+        if self.suspicious_patterns['geographic_anomalies'] and has_location.any():
+            signals = self.travel_detector.observe_batch(
+                [a.user_id for a in activities],
+                np.where(has_location, latitude, np.nan),
+                np.where(has_location, longitude, np.nan),
+                timestamps
+            )
+            for i, signal in enumerate(signals):
+                columns['travel_score'][i] = signal['score']
+                columns['impossible_travel'][i] = signal['impossible_travel']
+                columns['new_location'][i] = signal['new_location']
         
-        # Check for suspicious data access patterns
-        if activity.action in ['mass_data_access', 'suspicious_download']:
-            score += 0.5
+        for i, activity in enumerate(activities):
+            # First-seen devices, user agents and IPs for this user
+            if self.novelty_tracker is not None:
+                novelty = self.novelty_tracker.observe(activity)
+                columns['new_device'][i] = novelty['new_device']
+                columns['new_user_agent'][i] = novelty['new_user_agent']
+                columns['new_ip'][i] = novelty['new_ip']
+            
+            events, failures = self.window_features.observe(
+                activity.user_id, timestamps[i], bool(activity.success)
+            )
+            columns['user_events_1m'][i] = events
+            columns['user_failures_10m'][i] = failures
         
-        return min(1.0, score)
+        return columns
     
     async def get_user_behavior_profile(self, user_id: str) -> Dict[str, Any]:
         """Get behavioral profile for a user"""
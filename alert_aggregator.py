@@ -0,0 +1,141 @@
+"""
+Alert Aggregation for Third Umpire - AI Guard Dog System
+Folds repeat triggers of the same rule for the same user and session (or IP)
+into one open alert, so incident bursts do not become alert storms.
+"""
+
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from models import Alert, SEVERITY_CODES, enum_value
+
+logger = logging.getLogger(__name__)
+
+
+class _OpenAlert:
+    """An alert still accepting repeat triggers"""
+
+    __slots__ = ('alert', 'last_seen')
+
+    def __init__(self, alert: Alert, last_seen: float):
+        self.alert = alert
+        self.last_seen = last_seen
+
+
+class AlertAggregator:
+    """
+    Correlation window keyed on (user_id, session_id or IP, rule).
+    The first trigger opens an alert that is stored and broadcast at once;
+    repeats within the window only update it in memory and are flushed in
+    batches by the caller. Windows run on event time: activity timestamps,
+    with the newest one offered as the current time for expiry.
+    """
+
+    def __init__(self, window_seconds: float = 300.0, max_related: int = 200, max_open: int = 10000):
+        self.window_seconds = window_seconds
+        self.max_related = max_related
+        self.max_open = max_open
+        self._open: Dict[Tuple[str, str, str], _OpenAlert] = {}
+        self._dirty: Dict[str, Alert] = {}
+        self.watermark = 0.0  # newest activity timestamp offered
+        self.folded = 0
+
+    def _key(self, activity: Any, rule: str) -> Tuple[str, str, str]:
+        return (activity.user_id, activity.session_id or activity.ip_address, rule)
+
+    def offer(self, activity: Any, anomaly_score: float, severity: str, rule: str,
+              description: str) -> Tuple[Alert, bool]:
+        """
+        Register a trigger and return (alert, is_new).
+        New alerts must be stored by the caller; folded ones are queued for flush.
+        """
+        now = activity.timestamp.timestamp()
+        self.watermark = max(self.watermark, now)
+        key = self._key(activity, rule)
+        open_alert = self._open.get(key)
+
+        if open_alert is not None and now - open_alert.last_seen <= self.window_seconds:
+            alert = open_alert.alert
+            open_alert.last_seen = now
+            if len(alert.related_activities) < self.max_related:
+                alert.related_activities.append(activity.id)
+            alert.occurrence_count += 1
+            alert.last_seen = activity.timestamp
+            alert.anomaly_score = max(alert.anomaly_score, anomaly_score)
+            if SEVERITY_CODES[severity] > SEVERITY_CODES[enum_value(alert.severity)]:
+                alert.severity = severity
+            self._dirty[alert.id] = alert
+            self.folded += 1
+            return alert, False
+
+        # Built from trusted internal values, so skip validation
+        alert = Alert.model_construct(
+            id=str(uuid.uuid4()),
+            activity_id=activity.id,
+            user_id=activity.user_id,
+            severity=severity,
+            anomaly_score=anomaly_score,
+            description=description,
+            timestamp=datetime.now(),
+            related_activities=[activity.id],
+            occurrence_count=1,
+            last_seen=activity.timestamp
+        )
+        self._open[key] = _OpenAlert(alert, now)
+        if len(self._open) > self.max_open:
+            self.expire()
+        return alert, True
+
+    def expire(self, now: Optional[float] = None):
+        """Close alerts whose window has passed, by default as of the watermark"""
+        now = now if now is not None else self.watermark
+        expired = [key for key, open_alert in self._open.items()
+                   if now - open_alert.last_seen > self.window_seconds]
+        for key in expired:
+            del self._open[key]
+
+        # Still too many: close the least recently triggered ones
+        if len(self._open) > self.max_open:
+            oldest = sorted(self._open, key=lambda k: self._open[k].last_seen)
+            for key in oldest[:len(self._open) - self.max_open]:
+                del self._open[key]
+
+    def open_alert_ids(self) -> List[str]:
+        return [open_alert.alert.id for open_alert in self._open.values()] + list(self._dirty)
+
+    def reconcile(self, stored: Dict[str, Tuple[float, str, str]]):
+        """
+        Adopt (anomaly_score, severity, status) rewritten in the database by
+        someone else - a backfill - so the next flush does not overwrite them.
+        Alerts no longer active are closed.
+        """
+        for key, open_alert in list(self._open.items()):
+            state = stored.get(open_alert.alert.id)
+            if state is None:
+                continue
+            score, severity, status = state
+            if status != 'active':
+                del self._open[key]
+                self._dirty.pop(open_alert.alert.id, None)
+                continue
+            open_alert.alert.anomaly_score = score
+            open_alert.alert.severity = severity
+        for alert_id, alert in list(self._dirty.items()):
+            state = stored.get(alert_id)
+            if state is not None:
+                alert.anomaly_score, alert.severity = state[0], state[1]
+
+    def drain_dirty(self) -> List[Alert]:
+        """Alerts updated since the last drain"""
+        dirty = list(self._dirty.values())
+        self._dirty.clear()
+        return dirty
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'open_alerts': len(self._open),
+            'pending_updates': len(self._dirty),
+            'folded_triggers': self.folded
+        }
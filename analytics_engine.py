@@ -0,0 +1,365 @@
+"""
+Historical Analytics Engine for Third Umpire - AI Guard Dog System
+Runs heavy hunting queries over columnar Parquet snapshots with an embedded DuckDB engine,
+so month-long aggregates never touch the hot SQLite ingest database.
+"""
+
+import os
+import shutil
+import sqlite3
+import logging
+import argparse
+import threading
+import importlib.util
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Optional dependency - analytics endpoints report it as unavailable. Only looked up here:
+# the native module is imported on first use, off the application's startup path
+DUCKDB_INSTALLED = importlib.util.find_spec("duckdb") is not None
+
+
+class SnapshotBusyError(RuntimeError):
+    """Raised when a snapshot is already being created"""
+
+
+# Columns exported to the snapshot, in table order
+SNAPSHOT_TABLES = {
+    'user_activities': [
+        'id', 'user_id', 'action', 'timestamp', 'location', 'ip_address',
+        'user_agent', 'user_role', 'success', 'failed_attempts',
+        'session_id', 'device_fingerprint'
+    ],
+    'alerts': [
+        'id', 'activity_id', 'user_id', 'severity', 'anomaly_score',
+        'description', 'timestamp', 'status', 'auto_resolved', 'false_positive'
+    ]
+}
+
+# Named, parameterized hunting queries. Every query accepts start/end (ISO timestamps),
+# an optional user_id filter and a row limit, always bound as parameters.
+HUNTING_QUERIES = {
+    'top_ips_per_user': {
+        'description': 'Most frequently used IP addresses for each user',
+        'sql': """
+            SELECT user_id, ip_address, COUNT(*) AS events,
+                   MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen
+            FROM user_activities
+            WHERE timestamp >= ? AND timestamp < ? AND (? IS NULL OR user_id = ?)
+            GROUP BY user_id, ip_address
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COUNT(*) DESC) <= 5
+            ORDER BY user_id, events DESC
+            LIMIT ?
+        """
+    },
+    'failure_rate_by_hour': {
+        'description': 'Share of failed actions per hour bucket',
+        'sql': """
+            SELECT date_trunc('hour', timestamp) AS hour,
+                   COUNT(*) AS events,
+                   SUM(CASE WHEN success THEN 0 ELSE 1 END) AS failures,
+                   AVG(CASE WHEN success THEN 0.0 ELSE 1.0 END) AS failure_rate
+            FROM user_activities
+            WHERE timestamp >= ? AND timestamp < ? AND (? IS NULL OR user_id = ?)
+            GROUP BY hour
+            ORDER BY hour
+            LIMIT ?
+        """
+    },
+    'action_mix_by_day': {
+        'description': 'Daily share of each action type, to spot shifts in behaviour',
+        'sql': """
+            SELECT date_trunc('day', timestamp) AS day, action, COUNT(*) AS events,
+                   COUNT(*) / SUM(COUNT(*)) OVER (PARTITION BY date_trunc('day', timestamp)) AS share
+            FROM user_activities
+            WHERE timestamp >= ? AND timestamp < ? AND (? IS NULL OR user_id = ?)
+            GROUP BY day, action
+            ORDER BY day, events DESC
+            LIMIT ?
+        """
+    },
+    'alert_severity_by_day': {
+        'description': 'Alert counts and mean anomaly score per day and severity',
+        'sql': """
+            SELECT date_trunc('day', timestamp) AS day, severity, COUNT(*) AS alerts,
+                   AVG(anomaly_score) AS mean_score
+            FROM alerts
+            WHERE timestamp >= ? AND timestamp < ? AND (? IS NULL OR user_id = ?)
+            GROUP BY day, severity
+            ORDER BY day, severity
+            LIMIT ?
+        """
+    },
+    'top_alerted_users': {
+        'description': 'Users with the most alerts and their worst score',
+        'sql': """
+            SELECT user_id, COUNT(*) AS alerts, MAX(anomaly_score) AS max_score,
+                   SUM(CASE WHEN false_positive THEN 1 ELSE 0 END) AS false_positives
+            FROM alerts
+            WHERE timestamp >= ? AND timestamp < ? AND (? IS NULL OR user_id = ?)
+            GROUP BY user_id
+            ORDER BY alerts DESC
+            LIMIT ?
+        """
+    }
+}
+
+
+class HistoricalAnalytics:
+    """
+    Columnar analytics over Parquet snapshots of the activity and alert tables.
+    Snapshots are written from a read-only SQLite connection in bounded chunks and
+    queried with DuckDB, which parallelizes scans across all cores.
+    """
+
+    def __init__(self, db_path: str = "third_umpire.db", snapshot_dir: str = "analytics_snapshots",
+                 chunk_size: int = 100000, threads: Optional[int] = None):
+        self.db_path = db_path
+        self.snapshot_dir = Path(snapshot_dir)
+        self.chunk_size = chunk_size
+        self.threads = threads or os.cpu_count() or 1
+        self.connection = None
+        self.snapshot_info: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        # Queries run on cursors of the shared connection; a swap waits for them to finish
+        self._idle = threading.Condition(self._lock)
+        self._queries = 0
+        self._swapping = False
+        # One snapshot at a time: runs share the staging directory
+        self._snapshot_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """Whether the DuckDB engine is installed"""
+        return DUCKDB_INSTALLED
+
+    def _require_engine(self):
+        if not DUCKDB_INSTALLED:
+            raise RuntimeError("DuckDB is not installed - run `pip install duckdb` to enable historical analytics")
+
+    def create_snapshot(self) -> Dict[str, Any]:
+        """
+        Export user_activities and alerts to Parquet part files.
+        The new snapshot is built beside the current one and swapped in atomically.
+        Raises SnapshotBusyError while another snapshot is being created.
+        """
+        self._require_engine()
+        if not self._snapshot_lock.acquire(blocking=False):
+            raise SnapshotBusyError("An analytics snapshot is already being created")
+        try:
+            return self._create_snapshot()
+        finally:
+            self._snapshot_lock.release()
+
+    def _create_snapshot(self) -> Dict[str, Any]:
+        import duckdb
+
+        started = datetime.now()
+        staging_dir = self.snapshot_dir.with_name(self.snapshot_dir.name + ".staging")
+        if staging_dir.exists():
+            shutil.rmtree(staging_dir)
+        staging_dir.mkdir(parents=True)
+
+        source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        writer = duckdb.connect()
+        row_counts = {}
+
+        try:
+            for table, columns in SNAPSHOT_TABLES.items():
+                table_dir = staging_dir / table
+                table_dir.mkdir()
+                row_counts[table] = self._export_table(source, writer, table, columns, table_dir)
+        finally:
+            source.close()
+            writer.close()
+
+        # Swap the finished snapshot in once in-flight queries are done; views re-open on next use
+        with self._lock:
+            self._swapping = True
+            try:
+                self._idle.wait_for(lambda: self._queries == 0)
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                previous_dir = self.snapshot_dir.with_name(self.snapshot_dir.name + ".previous")
+                if self.snapshot_dir.exists():
+                    if previous_dir.exists():
+                        shutil.rmtree(previous_dir)
+                    self.snapshot_dir.rename(previous_dir)
+                staging_dir.rename(self.snapshot_dir)
+                if previous_dir.exists():
+                    shutil.rmtree(previous_dir)
+
+                self.snapshot_info = {
+                    'created_at': datetime.now().isoformat(),
+                    'duration_seconds': (datetime.now() - started).total_seconds(),
+                    'row_counts': row_counts
+                }
+            finally:
+                self._swapping = False
+                self._idle.notify_all()
+
+        logger.info(f"📦 Analytics snapshot created: {row_counts}")
+        return self.snapshot_info
+
+    def _export_table(self, source: sqlite3.Connection, writer, table: str,
+                      columns: List[str], table_dir: Path) -> int:
+        """Copy one table into Parquet part files, one bounded chunk at a time"""
+        cursor = source.cursor()
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+
+        writer.execute(f"CREATE OR REPLACE TABLE chunk ({', '.join(f'{c} VARCHAR' for c in columns)})")
+        placeholders = ', '.join('?' for _ in columns)
+        total_rows = 0
+        part = 0
+
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+
+            writer.execute("DELETE FROM chunk")
+            writer.executemany(f"INSERT INTO chunk VALUES ({placeholders})",
+                               [tuple(None if v is None else str(v) for v in row) for row in rows])
+
+            part_path = table_dir / f"part-{part:05d}.parquet"
+            writer.execute(f"""
+                COPY (SELECT {self._typed_projection(table)} FROM chunk)
+                TO '{part_path.as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD)
+            """)
+
+            total_rows += len(rows)
+            part += 1
+
+        return total_rows
+
+    def _typed_projection(self, table: str) -> str:
+        """Cast the text columns from SQLite into proper columnar types"""
+        if table == 'user_activities':
+            return """
+                id, user_id, action, CAST(timestamp AS TIMESTAMP) AS timestamp,
+                TRY_CAST(json_extract(location, '$.latitude') AS DOUBLE) AS latitude,
+                TRY_CAST(json_extract(location, '$.longitude') AS DOUBLE) AS longitude,
+                ip_address, user_agent, user_role,
+                success IN ('1', 'True', 'true') AS success,
+                CAST(failed_attempts AS INTEGER) AS failed_attempts,
+                session_id, device_fingerprint
+            """
+        return """
+            id, activity_id, user_id, severity, CAST(anomaly_score AS DOUBLE) AS anomaly_score,
+            description, CAST(timestamp AS TIMESTAMP) AS timestamp, status,
+            auto_resolved IN ('1', 'True', 'true') AS auto_resolved,
+            false_positive IN ('1', 'True', 'true') AS false_positive
+        """
+
+    @contextmanager
+    def _query_connection(self):
+        """
+        The shared connection, held open for the duration of one query:
+        snapshot swaps and close() wait until no query is using it
+        """
+        self._require_engine()
+        with self._lock:
+            self._idle.wait_for(lambda: not self._swapping)
+            connection = self._open_connection()
+            self._queries += 1
+        try:
+            yield connection
+        finally:
+            with self._lock:
+                self._queries -= 1
+                if self._queries == 0:
+                    self._idle.notify_all()
+
+    def _open_connection(self):
+        """Open (once) an in-memory DuckDB connection with views over the snapshot; call with _lock held"""
+        if self.connection is None:
+            if not self.snapshot_dir.exists():
+                raise RuntimeError("No analytics snapshot found - create one first")
+
+            import duckdb
+
+            self.connection = duckdb.connect()
+            self.connection.execute(f"SET threads TO {int(self.threads)}")
+            for table in SNAPSHOT_TABLES:
+                pattern = (self.snapshot_dir / table / "*.parquet").as_posix()
+                if any((self.snapshot_dir / table).glob("*.parquet")):
+                    source = f"read_parquet('{pattern}')"
+                else:
+                    source = self._empty_source(table)
+                self.connection.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM {source}")
+        return self.connection
+
+    def _empty_source(self, table: str) -> str:
+        """Typed empty relation for tables that had no rows at snapshot time"""
+        columns = ', '.join(f"NULL::VARCHAR AS {c}" for c in SNAPSHOT_TABLES[table])
+        return f"(SELECT {self._typed_projection(table)} FROM (SELECT {columns}) WHERE FALSE)"
+
+    def list_queries(self) -> List[Dict[str, str]]:
+        """Describe the available hunting queries"""
+        return [{'name': name, 'description': query['description']}
+                for name, query in HUNTING_QUERIES.items()]
+
+    def run_query(self, name: str, start: datetime, end: datetime,
+                  user_id: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Run a named hunting query with bound parameters and return rows as dicts"""
+        if name not in HUNTING_QUERIES:
+            raise KeyError(f"Unknown analytics query: {name}")
+
+        with self._query_connection() as connection:
+            # Each call gets its own cursor so concurrent queries do not share state
+            cursor = connection.cursor()
+            try:
+                result = cursor.execute(HUNTING_QUERIES[name]['sql'], [start, end, user_id, user_id, limit])
+                columns = [description[0] for description in result.description]
+                rows = []
+                for row in result.fetchall():
+                    rows.append({
+                        column: value.isoformat() if isinstance(value, datetime) else value
+                        for column, value in zip(columns, row)
+                    })
+                return rows
+            finally:
+                cursor.close()
+
+    def close(self):
+        """Close the DuckDB connection once in-flight queries finish"""
+        with self._lock:
+            self._idle.wait_for(lambda: self._queries == 0)
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def main():
+    """Command line entry point: build a snapshot or run a hunting query"""
+    parser = argparse.ArgumentParser(description="Third Umpire historical analytics")
+    parser.add_argument("--db", default="third_umpire.db", help="SQLite database to snapshot")
+    parser.add_argument("--snapshot-dir", default="analytics_snapshots", help="Parquet snapshot directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("snapshot", help="Export a fresh Parquet snapshot")
+
+    query_parser = subparsers.add_parser("query", help="Run a named hunting query")
+    query_parser.add_argument("name", choices=sorted(HUNTING_QUERIES))
+    query_parser.add_argument("--start", required=True, type=datetime.fromisoformat)
+    query_parser.add_argument("--end", default=datetime.now(), type=datetime.fromisoformat)
+    query_parser.add_argument("--user-id", default=None)
+    query_parser.add_argument("--limit", default=100, type=int)
+
+    args = parser.parse_args()
+    analytics = HistoricalAnalytics(db_path=args.db, snapshot_dir=args.snapshot_dir)
+
+    if args.command == "snapshot":
+        print(analytics.create_snapshot())
+    else:
+        for row in analytics.run_query(args.name, args.start, args.end, args.user_id, args.limit):
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""
+Backfill for Third Umpire - AI Guard Dog System
+Re-scores historical activities with the current model and rules and brings
+their alerts in line: new alerts are inserted, existing ones re-scored, and
+active alerts that no longer pass the cutoff are resolved. Activities are
+streamed in keyset chunks, scored in worker processes through the batch path
+and written back one short transaction per chunk, with a checkpoint after
+each so an interrupted run can resume.
+"""
+
+import os
+import json
+import time
+import uuid
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from ai_engine import AnomalyDetector, DEFAULT_RULES_PATH
+from ip_enrichment import IPEnricher
+from models import ActivityRecord, ACTIVITY_COLUMNS
+from peer_groups import PeerGroupIndex
+
+logger = logging.getLogger(__name__)
+
+# Keyset pagination on (timestamp, id): each chunk is one short read, so no
+# long-lived read lock is held against the live writer
+CHUNK_QUERY = f"""
+    SELECT {', '.join(ACTIVITY_COLUMNS)} FROM user_activities
+    WHERE timestamp >= ? AND timestamp < ? AND (timestamp > ? OR (timestamp = ? AND id > ?))
+    ORDER BY timestamp, id
+    LIMIT ?
+"""
+
+# Alert ids for backfilled alerts derive from the activity, so re-runs update rather than duplicate
+ALERT_ID_NAMESPACE = uuid.UUID('6f1c2a9e-4b7d-4c3e-9a51-2d8e0f7b3c41')
+
+# Aggregated alerts, one row per covered activity; last_seen bounds the newest activity folded in
+FOLDED_ALERTS_QUERY = """
+    SELECT alerts.id, alerts.status, related.value
+    FROM alerts, json_each(alerts.related_activities) AS related
+    WHERE alerts.occurrence_count > 1 AND COALESCE(alerts.last_seen, alerts.timestamp) >= ?
+"""
+
+RESOLVE_ALERT_SQL = """
+    UPDATE alerts SET status = 'resolved', auto_resolved = TRUE, anomaly_score = ?,
+        investigation_notes = investigation_notes || ?
+    WHERE id = ?
+"""
+
+
+class BackfillProgress:
+    """Counters for one run, shared with whoever started it (the admin endpoint polls these)"""
+
+    def __init__(self):
+        self.state = 'pending'
+        self.total = 0
+        self.processed = 0
+        self.resumed_from = 0
+        self.alerts_inserted = 0
+        self.alerts_updated = 0
+        self.alerts_resolved = 0
+        self.cursor: Optional[List[str]] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        rate = (self.processed - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.processed, 0)
+        return {
+            'state': self.state,
+            'total': self.total,
+            'processed': self.processed,
+            'percent': 100.0 * self.processed / self.total if self.total else 100.0,
+            'alerts_inserted': self.alerts_inserted,
+            'alerts_updated': self.alerts_updated,
+            'alerts_resolved': self.alerts_resolved,
+            'cursor': self.cursor,
+            'elapsed_seconds': elapsed,
+            'activities_per_second': rate,
+            'eta_seconds': remaining / rate if rate > 0 and self.state == 'running' else None,
+            'error': self.error
+        }
+
+
+# --- Worker processes: one detector each, trained once in the initializer ---
+
+_detector: Optional[AnomalyDetector] = None
+_enricher: Optional[IPEnricher] = None
+
+
+def _init_worker(db_path: str, rules_path: str, engine: str, tenant_engines: Dict[str, str], niceness: int):
+    global _detector, _enricher
+    if niceness:
+        # Stay behind the API process for CPU
+        os.nice(niceness)
+    _detector = AnomalyDetector(rules_path, engine=engine, tenant_engines=tenant_engines)
+    _detector.detectors = _detector._fit_detectors()
+    _detector.is_trained = True
+
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    try:
+        peer_index = PeerGroupIndex()
+        peer_index.load_rows(connection.execute(
+            "SELECT user_id, peer_drift FROM user_profiles WHERE peer_drift > 0"
+        ))
+        _detector.peer_index = peer_index
+    finally:
+        connection.close()
+    _enricher = IPEnricher(geoip_path="data/geoip.csv", lists_dir="data/ip_lists")
+
+
+def _score_rows(rows: List[tuple]) -> List[float]:
+    """Final anomaly scores for rows of one user partition, in event order"""
+    records = [ActivityRecord.from_row(row) for row in rows]
+    for record in records:
+        _enricher.enrich(record)
+    return _detector.score_activities(records).tolist()
+
+
+# --- Coordinator ---
+
+def _load_checkpoint(path: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('params') != params:
+        raise ValueError(f"Checkpoint {path} belongs to a run with different parameters; "
+                         f"delete it or run without resume")
+    return checkpoint
+
+
+def _save_checkpoint(path: str, params: Dict[str, Any], progress: BackfillProgress,
+                     reconciler: 'AlertReconciler'):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({
+            'params': params,
+            'cursor': progress.cursor,
+            'processed': progress.processed,
+            'alerts_inserted': progress.alerts_inserted,
+            'alerts_updated': progress.alerts_updated,
+            'alerts_resolved': progress.alerts_resolved,
+            'alerts': reconciler.state(),
+            'saved_at': datetime.now().isoformat()
+        }, f)
+    os.replace(temp_path, path)
+
+
+class AlertReconciler:
+    """
+    Brings alerts in line with re-scored activities, keeping the live path's
+    aggregation (alert_aggregator). State spans chunks and is checkpointed.
+
+    - Aggregated alerts (occurrence_count > 1) are found through every id in
+      related_activities. They take the maximum re-scored score of their
+      activities, written once by finish(), when all of them have been seen;
+      an alert none of whose activities passes the cutoff is resolved.
+    - Single-activity alerts are updated or resolved chunk by chunk.
+    - Activities that now pass the cutoff but have no alert are folded like
+      live triggers - same (user, session or IP, action) key and event-time
+      window - into alerts whose id derives from the first activity.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, start_key: str, threshold: float,
+                 high_threshold: float, window_seconds: float = 300.0, max_related: int = 200,
+                 state: Optional[Dict[str, Any]] = None):
+        self.threshold = threshold
+        self.high_threshold = high_threshold
+        self.window = window_seconds
+        self.max_related = max_related
+
+        # Every aggregated alert that could cover the range: last_seen is its newest activity
+        self.folded_alert: Dict[str, str] = {}
+        self.folded_status: Dict[str, str] = {}
+        for alert_id, status, activity_id in connection.execute(FOLDED_ALERTS_QUERY, (start_key,)):
+            self.folded_alert[activity_id] = alert_id
+            self.folded_status[alert_id] = status
+
+        state = state or {}
+        self.folded_scores: Dict[str, float] = state.get('folded_scores', {})
+        self.groups: Dict[Tuple[str, str, str], Dict[str, Any]] = {
+            tuple(key): group for key, group in state.get('groups', [])
+        }
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            'folded_scores': self.folded_scores,
+            'groups': [[list(key), group] for key, group in self.groups.items()]
+        }
+
+    def _severity(self, score: float) -> str:
+        return "high" if score > self.high_threshold else "medium"
+
+    def write_chunk(self, connection: sqlite3.Connection, rows: List[tuple], scores: List[float],
+                    run_id: str) -> Dict[str, int]:
+        """Upsert the alerts of one scored chunk in a single transaction"""
+        single: Dict[str, List[tuple]] = {}
+        activity_ids = [row[0] for row in rows]
+        for start in range(0, len(activity_ids), 900):
+            batch = activity_ids[start:start + 900]
+            for alert_id, activity_id, status in connection.execute(
+                f"SELECT id, activity_id, status FROM alerts WHERE activity_id IN ({','.join('?' * len(batch))})",
+                batch
+            ):
+                if alert_id not in self.folded_status:
+                    single.setdefault(activity_id, []).append((alert_id, status))
+
+        updates, resolves = [], []
+        touched: Dict[str, Dict[str, Any]] = {}
+        created = 0
+        for row, score in zip(rows, scores):
+            activity_id, user_id, action, timestamp = row[0], row[1], row[2], row[3]
+            folded = self.folded_alert.get(activity_id)
+            if folded is not None:
+                self.folded_scores[folded] = max(self.folded_scores.get(folded, 0.0), score)
+                continue
+            alerts = single.get(activity_id)
+            if alerts:
+                if score > self.threshold:
+                    updates.extend((score, self._severity(score), alert_id) for alert_id, _ in alerts)
+                else:
+                    resolves.extend((score, f"Resolved by backfill {run_id}: score {score:.3f} below "
+                                            f"{self.threshold:.3f}", alert_id)
+                                    for alert_id, status in alerts if status == 'active')
+                continue
+            if score <= self.threshold:
+                continue
+
+            # New trigger: fold into the open group for its key, as the live aggregator would
+            key = (user_id, row[10] or row[5], action)
+            seen_at = datetime.fromisoformat(timestamp).timestamp()
+            group = self.groups.get(key)
+            if group is not None and seen_at - group['seen_at'] <= self.window:
+                if len(group['related']) < self.max_related:
+                    group['related'].append(activity_id)
+                group['count'] += 1
+                group['score'] = max(group['score'], score)
+                group['last_seen'] = timestamp
+                group['seen_at'] = seen_at
+            else:
+                group = self.groups[key] = {
+                    'id': str(uuid.uuid5(ALERT_ID_NAMESPACE, activity_id)), 'activity_id': activity_id,
+                    'user_id': user_id, 'action': action, 'timestamp': timestamp, 'related': [activity_id],
+                    'count': 1, 'score': score, 'last_seen': timestamp, 'seen_at': seen_at
+                }
+                created += 1
+            touched[group['id']] = group
+
+        with connection:
+            connection.executemany("""
+                INSERT INTO alerts (
+                    id, activity_id, user_id, severity, anomaly_score, description, timestamp,
+                    related_activities, occurrence_count, last_seen
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    severity = excluded.severity,
+                    anomaly_score = excluded.anomaly_score,
+                    related_activities = excluded.related_activities,
+                    occurrence_count = excluded.occurrence_count,
+                    last_seen = excluded.last_seen
+            """, [(
+                group['id'], group['activity_id'], group['user_id'], self._severity(group['score']),
+                group['score'], f"Suspicious activity detected: {group['action']} (re-scored)",
+                group['timestamp'], json.dumps(group['related']), group['count'], group['last_seen']
+            ) for group in touched.values()])
+            connection.executemany("UPDATE alerts SET anomaly_score = ?, severity = ? WHERE id = ?", updates)
+            connection.executemany(RESOLVE_ALERT_SQL, resolves)
+
+        # Groups whose window has closed can no longer take triggers
+        if rows:
+            newest = datetime.fromisoformat(rows[-1][3]).timestamp()
+            self.groups = {key: group for key, group in self.groups.items()
+                           if newest - group['seen_at'] <= self.window}
+        return {'inserted': created, 'updated': len(updates), 'resolved': len(resolves)}
+
+    def finish(self, connection: sqlite3.Connection, run_id: str) -> Dict[str, int]:
+        """Write the aggregated alerts once all of their activities have been re-scored"""
+        updates, resolves = [], []
+        for alert_id, score in self.folded_scores.items():
+            if score > self.threshold:
+                updates.append((score, self._severity(score), alert_id))
+            elif self.folded_status.get(alert_id) == 'active':
+                resolves.append((score, f"Resolved by backfill {run_id}: max score {score:.3f} below "
+                                        f"{self.threshold:.3f}", alert_id))
+        with connection:
+            connection.executemany("UPDATE alerts SET anomaly_score = ?, severity = ? WHERE id = ?", updates)
+            connection.executemany(RESOLVE_ALERT_SQL, resolves)
+        return {'inserted': 0, 'updated': len(updates), 'resolved': len(resolves)}
+
+
+def run_backfill(db_path: str = "third_umpire.db", start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, threshold: float = 0.7, high_threshold: float = 0.9,
+                 engine: str = "isolation_forest", tenant_engines: Optional[Dict[str, str]] = None,
+                 rules_path: str = str(DEFAULT_RULES_PATH), workers: Optional[int] = None,
+                 chunk_size: int = 5000, checkpoint_path: str = "backfill_checkpoint.json",
+                 resume: bool = False, niceness: int = 10, pause: float = 0.0,
+                 progress: Optional[BackfillProgress] = None) -> Dict[str, Any]:
+    """
+    Re-score activities in [start, end) and upsert their alerts.
+
+    Users are hashed onto workers, and each worker is a single process fed in
+    chunk order, so the stateful behavioral features (travel, sliding
+    windows) see every user's events in sequence. Novelty features start
+    empty and the adaptive cutoffs are not used: alerts are judged against
+    the fixed threshold/high_threshold given here.
+    """
+    progress = progress or BackfillProgress()
+    workers = workers or max(1, (os.cpu_count() or 2) // 2)
+    tenant_engines = tenant_engines or {}
+    start_key = start.isoformat() if start else ''
+    end_key = end.isoformat() if end else '9999'
+    params = {
+        'db_path': os.path.abspath(db_path), 'start': start_key, 'end': end_key,
+        'threshold': threshold, 'high_threshold': high_threshold,
+        'engine': engine, 'tenant_engines': tenant_engines
+    }
+
+    checkpoint = _load_checkpoint(checkpoint_path, params) if resume else None
+    if checkpoint is not None:
+        progress.cursor = checkpoint['cursor']
+        progress.processed = progress.resumed_from = checkpoint['processed']
+        progress.alerts_inserted = checkpoint['alerts_inserted']
+        progress.alerts_updated = checkpoint['alerts_updated']
+        progress.alerts_resolved = checkpoint['alerts_resolved']
+        logger.info(f"Resuming backfill at {progress.cursor} ({progress.processed} activities done)")
+    cursor = progress.cursor or [start_key, '']
+    run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+
+    reader = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    writer = sqlite3.connect(db_path, timeout=30)
+    reconciler = AlertReconciler(reader, start_key, threshold, high_threshold,
+                                 state=checkpoint.get('alerts') if checkpoint else None)
+    # Spawned, not forked: the API process has threads (log writer, event loop) whose locks a fork would copy
+    context = multiprocessing.get_context('spawn')
+    executors = [
+        ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                            initargs=(db_path, rules_path, engine, tenant_engines, niceness))
+        for _ in range(workers)
+    ]
+    progress.state = 'running'
+    progress.started_at = time.time()
+    try:
+        progress.total = progress.processed + reader.execute(
+            "SELECT COUNT(*) FROM user_activities WHERE timestamp >= ? AND timestamp < ? "
+            "AND (timestamp > ? OR (timestamp = ? AND id > ?))",
+            (start_key, end_key, cursor[0], cursor[0], cursor[1])
+        ).fetchone()[0]
+
+        # Chunks in flight, oldest first: results are written and checkpointed in read order
+        in_flight = deque()
+
+        def count_alerts(counts: Dict[str, int]):
+            progress.alerts_inserted += counts['inserted']
+            progress.alerts_updated += counts['updated']
+            progress.alerts_resolved += counts['resolved']
+
+        def complete_oldest():
+            rows, partitions, last_key = in_flight.popleft()
+            scores = [0.0] * len(rows)
+            for indices, future in partitions:
+                for index, score in zip(indices, future.result()):
+                    scores[index] = score
+            count_alerts(reconciler.write_chunk(writer, rows, scores, run_id))
+            progress.processed += len(rows)
+            progress.cursor = last_key
+            _save_checkpoint(checkpoint_path, params, progress, reconciler)
+            if pause:
+                time.sleep(pause)
+
+        while not progress.cancel_event.is_set():
+            rows = reader.execute(
+                CHUNK_QUERY, (start_key, end_key, cursor[0], cursor[0], cursor[1], chunk_size)
+            ).fetchall()
+            if not rows:
+                break
+            cursor = [rows[-1][3], rows[-1][0]]
+
+            by_worker: Dict[int, List[int]] = {}
+            for index, row in enumerate(rows):
+                by_worker.setdefault(zlib.crc32(row[1].encode()) % workers, []).append(index)
+            partitions = [
+                (indices, executors[worker].submit(_score_rows, [rows[i] for i in indices]))
+                for worker, indices in by_worker.items()
+            ]
+            in_flight.append((rows, partitions, cursor))
+
+            if len(in_flight) > workers:
+                complete_oldest()
+
+        while in_flight:
+            complete_oldest()
+
+        progress.state = 'cancelled' if progress.cancel_event.is_set() else 'completed'
+        if progress.state == 'completed':
+            count_alerts(reconciler.finish(writer, run_id))
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+    except Exception as e:
+        progress.state = 'failed'
+        progress.error = str(e)
+        raise
+    finally:
+        progress.finished_at = time.time()
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        reader.close()
+        writer.close()
+
+    result = progress.to_dict()
+    logger.info(f"🔁 Backfill {progress.state}: {result}")
+    return result
+
+
+def main():
+    """Command line entry point for a backfill run"""
+    parser = argparse.ArgumentParser(description="Re-score historical activities and update their alerts")
+    parser.add_argument("--db", default="third_umpire.db")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="ISO timestamp (inclusive)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="ISO timestamp (exclusive)")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--high-threshold", type=float, default=0.9)
+    parser.add_argument("--engine", default=os.getenv("DETECTOR_ENGINE", "isolation_forest"))
+    parser.add_argument("--rules", default=str(DEFAULT_RULES_PATH))
+    parser.add_argument("--workers", type=int, help="scoring processes (default: half the CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep after each chunk")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    tenant_engines = dict(
+        item.split("=", 1) for item in os.getenv("DETECTOR_TENANT_ENGINES", "").split(",") if "=" in item
+    )
+    progress = BackfillProgress()
+
+    def report():
+        while not done.wait(10):
+            state = progress.to_dict()
+            logger.info(f"{state['processed']}/{state['total']} activities "
+                        f"({state['percent']:.1f}%, {state['activities_per_second']:.0f}/s)")
+
+    done = threading.Event()
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        result = run_backfill(
+            args.db, args.start, args.end, args.threshold, args.high_threshold, args.engine, tenant_engines,
+            args.rules, args.workers, args.chunk_size, args.checkpoint, args.resume, pause=args.pause,
+            progress=progress
+        )
+    except KeyboardInterrupt:
+        print(f"Interrupted; rerun with --resume to continue from {progress.cursor}")
+        raise SystemExit(1)
+    finally:
+        done.set()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Complex Event Processing for Third Umpire - AI Guard Dog System
+Matches ordered multi-stage attack sequences (e.g. failed logins -> success ->
+privilege escalation -> mass data access) over the live event stream and emits
+SecurityEvents for completed matches.
+"""
+
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from models import SecurityEvent, ACTION_CODES, ACTION_NAMES
+
+logger = logging.getLogger(__name__)
+
+
+class SequenceStep:
+    """One stage of a pattern: a set of actions, optional outcome, and a repeat count"""
+
+    __slots__ = ('actions', 'success', 'min_count')
+
+    def __init__(self, actions: List[str], success: Optional[bool] = None, min_count: int = 1):
+        self.actions = frozenset(ACTION_CODES[action] for action in actions)
+        self.success = success
+        self.min_count = min_count
+
+    def matches(self, activity: Any) -> bool:
+        return activity.action_code in self.actions and (
+            self.success is None or bool(activity.success) == self.success
+        )
+
+
+class SequencePattern:
+    """An ordered list of steps that must complete within a time window per key"""
+
+    def __init__(self, name: str, steps: List[SequenceStep], within_seconds: float,
+                 key: str = 'session', severity: str = 'high', description: str = ''):
+        self.name = name
+        self.steps = steps
+        self.within_seconds = within_seconds
+        self.key = key  # 'session' or 'user'
+        self.severity = severity
+        self.description = description or name
+
+    def key_for(self, activity: Any) -> str:
+        if self.key == 'session' and activity.session_id:
+            return activity.session_id
+        return activity.user_id
+
+
+DEFAULT_PATTERNS = [
+    SequencePattern(
+        'account_takeover_exfiltration',
+        [
+            SequenceStep(['login'], success=False, min_count=3),
+            SequenceStep(['login'], success=True),
+            SequenceStep(['privilege_escalation']),
+            SequenceStep(['mass_data_access', 'suspicious_download', 'download'])
+        ],
+        within_seconds=3600, key='user', severity='critical',
+        description='Brute-forced login followed by privilege escalation and bulk data access'
+    ),
+    SequencePattern(
+        'session_privilege_abuse',
+        [
+            SequenceStep(['privilege_escalation']),
+            SequenceStep(['system_access', 'edit_data']),
+            SequenceStep(['mass_data_access', 'suspicious_download'])
+        ],
+        within_seconds=900, key='session', severity='high',
+        description='Privilege escalation used for system changes and data exfiltration in one session'
+    ),
+    SequencePattern(
+        'credential_stuffing_success',
+        [
+            SequenceStep(['login'], success=False, min_count=5),
+            SequenceStep(['login'], success=True)
+        ],
+        within_seconds=600, key='user', severity='high',
+        description='Many failed logins followed by a successful one'
+    )
+]
+
+
+class _PartialMatch:
+    """Progress of one pattern for one key"""
+
+    __slots__ = ('step', 'count', 'started', 'activity_ids', 'alert_ids', 'source_ip')
+
+    def __init__(self, started: float, source_ip: str):
+        self.step = 0
+        self.count = 0
+        self.started = started
+        self.activity_ids: List[str] = []
+        self.alert_ids: List[str] = []
+        self.source_ip = source_ip
+
+
+class SequenceMatcher:
+    """
+    Streaming matcher over compiled patterns.
+    Patterns are indexed by the action codes they care about, so each event only
+    visits the patterns it can advance; partial matches live in a bounded LRU.
+    """
+
+    def __init__(self, patterns: Optional[List[SequencePattern]] = None, max_partial_matches: int = 100000,
+                 max_tracked_ids: int = 50):
+        self.patterns = patterns if patterns is not None else DEFAULT_PATTERNS
+        self.max_partial_matches = max_partial_matches
+        self.max_tracked_ids = max_tracked_ids
+        self._partials: "OrderedDict[Tuple[int, str], _PartialMatch]" = OrderedDict()
+        self.watermark = 0.0  # newest activity timestamp processed: the clock windows run on
+        self.completed = 0
+        self._compile()
+
+    def _compile(self):
+        """Build the action code -> interested pattern index table"""
+        self._interested: List[List[int]] = [[] for _ in ACTION_NAMES]
+        for index, pattern in enumerate(self.patterns):
+            codes = set().union(*(step.actions for step in pattern.steps))
+            for code in codes:
+                self._interested[code].append(index)
+
+    def process(self, activity: Any, alert_id: Optional[str] = None) -> List[SecurityEvent]:
+        """Advance all relevant patterns with one event; return completed matches"""
+        now = activity.timestamp.timestamp()
+        self.watermark = max(self.watermark, now)
+        events = []
+
+        for index in self._interested[activity.action_code]:
+            pattern = self.patterns[index]
+            key = (index, pattern.key_for(activity))
+            partial = self._partials.get(key)
+
+            if partial is not None and now - partial.started > pattern.within_seconds:
+                del self._partials[key]
+                partial = None
+
+            if partial is None:
+                if not pattern.steps[0].matches(activity):
+                    continue
+                partial = self._partials[key] = _PartialMatch(now, activity.ip_address)
+            else:
+                self._partials.move_to_end(key)
+
+            step = pattern.steps[partial.step]
+            if step.matches(activity):
+                partial.count += 1
+            elif (partial.count >= step.min_count and partial.step + 1 < len(pattern.steps)
+                  and pattern.steps[partial.step + 1].matches(activity)):
+                partial.step += 1
+                partial.count = 1
+            else:
+                continue
+
+            if len(partial.activity_ids) < self.max_tracked_ids:
+                partial.activity_ids.append(activity.id)
+            if alert_id and alert_id not in partial.alert_ids:
+                partial.alert_ids.append(alert_id)
+
+            if partial.step == len(pattern.steps) - 1 and partial.count >= pattern.steps[-1].min_count:
+                del self._partials[key]
+                events.append(self._emit(pattern, key[1], partial))
+
+        while len(self._partials) > self.max_partial_matches:
+            self._partials.popitem(last=False)
+
+        return events
+
+    def _emit(self, pattern: SequencePattern, key: str, partial: _PartialMatch) -> SecurityEvent:
+        self.completed += 1
+        logger.warning(f"🧩 Attack sequence matched: {pattern.name} for {pattern.key} {key}")
+        # Built from trusted internal values, so skip validation
+        return SecurityEvent.model_construct(
+            id=str(uuid.uuid4()),
+            event_type=pattern.name,
+            timestamp=datetime.now(),
+            source_ip=partial.source_ip,
+            target_resource=f"{pattern.key}:{key}",
+            description=pattern.description,
+            severity=pattern.severity,
+            indicators=[f"{len(pattern.steps)} stages in {pattern.within_seconds:.0f}s window"],
+            mitigation_actions=[],
+            status='detected',
+            related_activities=partial.activity_ids,
+            related_alerts=partial.alert_ids
+        )
+
+    def expire(self, now: Optional[float] = None):
+        """Drop partial matches whose window has passed, by default as of the watermark"""
+        now = now if now is not None else self.watermark
+        expired = [key for key, partial in self._partials.items()
+                   if now - partial.started > self.patterns[key[0]].within_seconds]
+        for key in expired:
+            del self._partials[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'patterns': [pattern.name for pattern in self.patterns],
+            'partial_matches': len(self._partials),
+            'completed_matches': self.completed
+        }
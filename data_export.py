@@ -0,0 +1,133 @@
+"""
+Data Export for Third Umpire - AI Guard Dog System
+Streams activities and alerts as NDJSON or CSV chunks, optionally gzip-compressed,
+so exports of any size run in constant memory.
+"""
+
+import io
+import csv
+import json
+import zlib
+import logging
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Any, List, Optional
+
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# Columns holding JSON text in SQLite, decoded for NDJSON output
+JSON_COLUMNS = {'location', 'additional_data', 'related_activities'}
+
+
+def _ndjson_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """Render rows as newline-delimited JSON"""
+    for row in rows:
+        for column in JSON_COLUMNS.intersection(row):
+            if row[column]:
+                row[column] = json.loads(row[column])
+        yield json.dumps(row, default=str) + "\n"
+
+
+def _csv_lines(rows: Iterable[Dict[str, Any]], columns: Optional[List[str]] = None) -> Iterator[str]:
+    """
+    Render rows as CSV. The header comes from `columns`, so even an empty
+    result has one; without them it is taken from the first row.
+    """
+    buffer = io.StringIO()
+    writer = None
+    if columns is not None:
+        writer = csv.DictWriter(buffer, fieldnames=columns)
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_export(rows: Iterable[Dict[str, Any]], export_format: str = 'ndjson',
+                  compress: bool = False, chunk_bytes: int = 64 * 1024,
+                  columns: Optional[List[str]] = None) -> Iterator[bytes]:
+    """
+    Turn a row iterator into byte chunks of roughly chunk_bytes each.
+    With compress=True the chunks form a single gzip stream. `columns` fixes
+    the CSV header (see DatabaseManager.table_columns).
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    lines = _ndjson_lines(rows) if export_format == 'ndjson' else _csv_lines(rows, columns)
+    # wbits=31 makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    pending = []
+    pending_size = 0
+    for line in lines:
+        encoded = line.encode('utf-8')
+        pending.append(encoded)
+        pending_size += len(encoded)
+        if pending_size >= chunk_bytes:
+            chunk = b"".join(pending)
+            pending, pending_size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b"".join(pending)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_to_file(db_manager: DatabaseManager, table: str, path: str, export_format: str = 'ndjson',
+                   start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   filters: Optional[Dict[str, Any]] = None, compress: bool = False) -> int:
+    """Write an export straight to a file and return the number of bytes written"""
+    written = 0
+    rows = db_manager.iter_rows(table, start=start, end=end, filters=filters)
+    with open(path, 'wb') as output:
+        for chunk in stream_export(rows, export_format, compress, columns=db_manager.table_columns(table)):
+            output.write(chunk)
+            written += len(chunk)
+    logger.info(f"Exported {table} to {path} ({written} bytes)")
+    return written
+
+
+def main():
+    """Command line entry point for exports"""
+    parser = argparse.ArgumentParser(description="Export Third Umpire activities or alerts")
+    parser.add_argument("table", choices=["activities", "alerts"])
+    parser.add_argument("output", help="File to write")
+    parser.add_argument("--db", default="third_umpire.db")
+    parser.add_argument("--format", default="ndjson", choices=sorted(EXPORT_FORMATS))
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--user-id", default=None)
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+    args = parser.parse_args()
+
+    table = 'user_activities' if args.table == 'activities' else 'alerts'
+    written = export_to_file(
+        DatabaseManager(args.db), table, args.output, args.format,
+        start=args.start, end=args.end, filters={'user_id': args.user_id}, compress=args.gzip
+    )
+    print(f"Wrote {written} bytes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,30 +6,62 @@ Handles data persistence and retrieval for user activities, alerts, and analytic
 import sqlite3
 import json
 import asyncio
+import time
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 from typing import List, Dict, Any, Optional
 import logging
 from pathlib import Path
 
-from models import UserActivity, Alert, SecurityEvent, DashboardStats, UserBehaviorProfile
+from models import (
+    UserActivity, ActivityRecord, Alert, SecurityEvent, DashboardStats, UserBehaviorProfile, enum_value
+)
+from query_cache import QueryCache
+from metrics import DB_QUERY_SECONDS, availability_percent
+from log_pipeline import sampled_event
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# sqlite3.connect's default wait for a lock held by another connection, in seconds
+SQLITE_DEFAULT_TIMEOUT = 5.0
+
+# Ingestion is idempotent: a repeated activity id is skipped, not an error.
+# Rows start unscored; mark_scored() flips them once scoring has succeeded
+INSERT_ACTIVITY_SQL = """
+    INSERT OR IGNORE INTO user_activities (
+        id, user_id, action, timestamp, location, ip_address,
+        user_agent, user_role, success, failed_attempts,
+        session_id, device_fingerprint, additional_data, geo_location, scored
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+"""
+
 class DatabaseManager:
     """
     Manages database operations for the AI Guard Dog system.
     Uses SQLite for simplicity, but can be easily adapted for PostgreSQL.
     """
     
+    # Columns that streaming exports may filter on, per table
+    STREAM_FILTER_COLUMNS = {
+        'user_activities': {'user_id', 'action', 'user_role', 'ip_address', 'session_id'},
+        'alerts': {'user_id', 'severity', 'status'}
+    }
+
     def __init__(self, db_path: str = "third_umpire.db"):
         self.db_path = db_path
         self.connection = None
+        # Read-through cache for dashboard queries, invalidated by every write
+        self.read_cache = QueryCache(max_entries=256, ttl_seconds=5.0)
+        # Optional TrafficSketches; when set, distinct users come from its HyperLogLog
+        self.traffic_sketches = None
+        # Ids scored since the last flush_scored(); written in batches, not per event
+        self._scored_pending: set = set()
         
     async def init_db(self):
         """Initialize the database and create tables"""
         try:
-            self.connection = sqlite3.connect(self.db_path)
+            self.connection = sqlite3.connect(self.db_path, timeout=SQLITE_DEFAULT_TIMEOUT)
             self.connection.row_factory = sqlite3.Row  # Enable dict-like access
             
             # Create tables synchronously since sqlite3 doesn't support async
@@ -40,6 +72,15 @@ class DatabaseManager:
             logger.error(f"Error initializing database: {e}")
             raise
     
+    @contextmanager
+    def busy_timeout(self, seconds: float):
+        """Wait at most `seconds` for another connection's lock within the block, then fail fast"""
+        self.connection.execute(f"PRAGMA busy_timeout = {int(seconds * 1000)}")
+        try:
+            yield
+        finally:
+            self.connection.execute(f"PRAGMA busy_timeout = {int(SQLITE_DEFAULT_TIMEOUT * 1000)}")
+
     def _create_tables(self):
         """Create database tables"""
         cursor = self.connection.cursor()
@@ -113,81 +154,133 @@ class DatabaseManager:
             )
         """)
         
+        # Columns added after the original schema
+        self._ensure_columns(cursor, 'user_activities', {
+            'scored': 'INTEGER DEFAULT 1',  # rows from before the flag existed count as scored
+            'geo_location': 'TEXT'  # GeoIP estimate for activities sent without a location
+        })
+        self._ensure_columns(cursor, 'alerts', {
+            'occurrence_count': 'INTEGER DEFAULT 1',
+            'last_seen': 'TEXT'
+        })
+        self._ensure_columns(cursor, 'security_events', {
+            'related_activities': 'TEXT',
+            'related_alerts': 'TEXT'
+        })
+        self._ensure_columns(cursor, 'user_profiles', {
+            'novelty_filter': 'BLOB',
+            'novelty_counts': 'TEXT',
+            'behavior_vector': 'TEXT',
+            'cluster_id': 'INTEGER',
+            'peer_distance': 'REAL',
+            'peer_drift': 'REAL'
+        })
+        
+        # Peer group centroids written by the clustering job
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS peer_groups (
+                cluster_id INTEGER PRIMARY KEY,
+                centroid TEXT NOT NULL,
+                radius REAL NOT NULL,
+                size INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        
         # Create indexes for better performance
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_user_id ON user_activities(user_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_timestamp ON user_activities(timestamp)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_severity ON alerts(severity)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_activity_id ON alerts(activity_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_security_events_timestamp ON security_events(timestamp)")
         
         self.connection.commit()
         logger.info("📊 Database tables created successfully")
     
-    async def store_activity(self, activity: UserActivity):
-        """Store user activity in database"""
+    def _ensure_columns(self, cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]):
+        """Add missing columns to an existing table"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row['name'] for row in cursor.fetchall()}
+        for column, declaration in columns.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    
+    def _activity_params(self, activity: Any) -> tuple:
+        """Insert parameters for an ActivityRecord (UserActivity models are converted first)"""
+        if not isinstance(activity, ActivityRecord):
+            activity = ActivityRecord.from_activity(activity)
+        return (
+            activity.id,
+            activity.user_id,
+            activity.action,
+            activity.timestamp.isoformat(),
+            json.dumps(activity.location),
+            activity.ip_address,
+            activity.user_agent,
+            activity.user_role,
+            activity.success,
+            activity.failed_attempts,
+            activity.session_id,
+            activity.device_fingerprint,
+            json.dumps(activity.additional_data),
+            json.dumps(activity.geo_location) if activity.geo_location else None
+        )
+    
+    async def store_activity(self, activity: ActivityRecord) -> bool:
+        """Store user activity in database; False when an activity with this id already exists"""
+        return self.store_activity_sync(activity)
+    
+    def store_activity_sync(self, activity: ActivityRecord) -> bool:
+        """Store user activity in database (synchronous version)"""
         try:
             cursor = self.connection.cursor()
             
-            cursor.execute("""
-                INSERT INTO user_activities (
-                    id, user_id, action, timestamp, location, ip_address,
-                    user_agent, user_role, success, failed_attempts,
-                    session_id, device_fingerprint, additional_data
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                activity.id,
-                activity.user_id,
-                activity.action.value,
-                activity.timestamp.isoformat(),
-                json.dumps(activity.location),
-                activity.ip_address,
-                activity.user_agent,
-                activity.user_role.value,
-                activity.success,
-                activity.failed_attempts,
-                activity.session_id,
-                activity.device_fingerprint,
-                json.dumps(activity.additional_data)
-            ))
+            cursor.execute(INSERT_ACTIVITY_SQL, self._activity_params(activity))
             
             self.connection.commit()
-            logger.debug(f"Stored activity: {activity.id}")
+            if cursor.rowcount:
+                self.read_cache.bump_generation()
+                logger.debug(f"Stored activity: {activity.id}")
+            return cursor.rowcount > 0
             
         except Exception as e:
+            self.connection.rollback()
             logger.error(f"Error storing activity: {e}")
             raise
     
-    def store_activity_sync(self, activity: UserActivity):
-        """Store user activity in database (synchronous version)"""
+    async def store_activities(self, activities: List[ActivityRecord]) -> List[bool]:
+        """
+        Store a batch in one transaction. Returns, per activity, whether it was
+        new; ids already stored (or repeated earlier in the batch) are skipped.
+        """
         try:
             cursor = self.connection.cursor()
+            existing = set()
+            ids = [activity.id for activity in activities]
+            for start in range(0, len(ids), 900):
+                batch = ids[start:start + 900]
+                cursor.execute(
+                    f"SELECT id FROM user_activities WHERE id IN ({','.join('?' * len(batch))})", batch
+                )
+                existing.update(row[0] for row in cursor.fetchall())
             
-            cursor.execute("""
-                INSERT INTO user_activities (
-                    id, user_id, action, timestamp, location, ip_address,
-                    user_agent, user_role, success, failed_attempts,
-                    session_id, device_fingerprint, additional_data
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                activity.id,
-                activity.user_id,
-                activity.action.value,
-                activity.timestamp.isoformat(),
-                json.dumps(activity.location),
-                activity.ip_address,
-                activity.user_agent,
-                activity.user_role.value,
-                activity.success,
-                activity.failed_attempts,
-                activity.session_id,
-                activity.device_fingerprint,
-                json.dumps(activity.additional_data)
-            ))
+            inserted = []
+            for activity in activities:
+                inserted.append(activity.id not in existing)
+                existing.add(activity.id)
             
+            cursor.executemany(INSERT_ACTIVITY_SQL, [
+                self._activity_params(activity) for activity, new in zip(activities, inserted) if new
+            ])
             self.connection.commit()
-            logger.debug(f"Stored activity: {activity.id}")
+            if any(inserted):
+                self.read_cache.bump_generation()
+            return inserted
             
         except Exception as e:
-            logger.error(f"Error storing activity: {e}")
+            self.connection.rollback()
+            logger.error(f"Error storing activities: {e}")
             raise
     
     async def store_alert(self, alert: Alert):
@@ -199,13 +292,14 @@ class DatabaseManager:
                 INSERT INTO alerts (
                     id, activity_id, user_id, severity, anomaly_score,
                     description, timestamp, status, investigation_notes,
-                    auto_resolved, false_positive, related_activities
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    auto_resolved, false_positive, related_activities,
+                    occurrence_count, last_seen
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 alert.id,
                 alert.activity_id,
                 alert.user_id,
-                alert.severity.value,
+                enum_value(alert.severity),
                 alert.anomaly_score,
                 alert.description,
                 alert.timestamp.isoformat(),
@@ -213,95 +307,336 @@ class DatabaseManager:
                 alert.investigation_notes,
                 alert.auto_resolved,
                 alert.false_positive,
-                json.dumps(alert.related_activities)
+                json.dumps(alert.related_activities),
+                alert.occurrence_count,
+                alert.last_seen.isoformat() if alert.last_seen else None
             ))
             
             self.connection.commit()
-            logger.info(f"Stored alert: {alert.id}")
+            self.read_cache.bump_generation()
+            logger.info("Stored alert", extra=sampled_event(alert_id=alert.id))
             
         except Exception as e:
             logger.error(f"Error storing alert: {e}")
             raise
     
+    def _row_to_activity(self, row: sqlite3.Row) -> UserActivity:
+        """Build a UserActivity from a user_activities row (trusted data, so no validation)"""
+        return UserActivity.model_construct(
+            id=row['id'],
+            user_id=row['user_id'],
+            action=row['action'],
+            timestamp=datetime.fromisoformat(row['timestamp']),
+            location=json.loads(row['location'] or '{}'),
+            ip_address=row['ip_address'],
+            user_agent=row['user_agent'],
+            user_role=row['user_role'],
+            success=bool(row['success']),
+            failed_attempts=row['failed_attempts'],
+            session_id=row['session_id'],
+            device_fingerprint=row['device_fingerprint'],
+            additional_data=json.loads(row['additional_data'] or '{}')
+        )
+    
+    def _row_to_alert(self, row: sqlite3.Row) -> Alert:
+        """Build an Alert from an alerts row (trusted data, so no validation)"""
+        return Alert.model_construct(
+            id=row['id'],
+            activity_id=row['activity_id'],
+            user_id=row['user_id'],
+            severity=row['severity'],
+            anomaly_score=row['anomaly_score'],
+            description=row['description'],
+            timestamp=datetime.fromisoformat(row['timestamp']),
+            status=row['status'],
+            investigation_notes=row['investigation_notes'],
+            auto_resolved=bool(row['auto_resolved']),
+            false_positive=bool(row['false_positive']),
+            related_activities=json.loads(row['related_activities'] or '[]'),
+            occurrence_count=row['occurrence_count'] or 1,
+            last_seen=datetime.fromisoformat(row['last_seen']) if row['last_seen'] else None
+        )
+    
+    def fetch_newest(self, table: str, limit: int) -> List[Any]:
+        """Newest rows of user_activities or alerts as models, oldest first (used to warm caches)"""
+        converters = {'user_activities': self._row_to_activity, 'alerts': self._row_to_alert}
+        if table not in converters:
+            raise ValueError(f"Unsupported table: {table}")
+        cursor = self.connection.cursor()
+        cursor.execute(f"""
+            SELECT * FROM (
+                SELECT * FROM {table} ORDER BY timestamp DESC LIMIT ?
+            ) ORDER BY timestamp ASC
+        """, (limit,))
+        return [converters[table](row) for row in cursor.fetchall()]
+    
     async def get_recent_activities(self, limit: int = 100) -> List[UserActivity]:
         """Get recent user activities"""
+        cache_key = ('recent_activities', limit)
+        cached = self.read_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
+            generation = self.read_cache.generation
             cursor = self.connection.cursor()
             
-            cursor.execute("""
-                SELECT * FROM user_activities 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            """, (limit,))
-            
-            rows = cursor.fetchall()
+            with DB_QUERY_SECONDS.time(query='recent_activities'):
+                cursor.execute("""
+                    SELECT * FROM user_activities 
+                    ORDER BY timestamp DESC 
+                    LIMIT ?
+                """, (limit,))
+                
+                rows = cursor.fetchall()
             activities = []
             
             for row in rows:
-                activity = UserActivity(
-                    id=row['id'],
-                    user_id=row['user_id'],
-                    action=row['action'],
-                    timestamp=datetime.fromisoformat(row['timestamp']),
-                    location=json.loads(row['location'] or '{}'),
-                    ip_address=row['ip_address'],
-                    user_agent=row['user_agent'],
-                    user_role=row['user_role'],
-                    success=bool(row['success']),
-                    failed_attempts=row['failed_attempts'],
-                    session_id=row['session_id'],
-                    device_fingerprint=row['device_fingerprint'],
-                    additional_data=json.loads(row['additional_data'] or '{}')
-                )
-                activities.append(activity)
+                activities.append(self._row_to_activity(row))
             
+            self.read_cache.put(cache_key, activities, generation)
             return activities
             
         except Exception as e:
             logger.error(f"Error getting recent activities: {e}")
             return []
     
-    async def get_recent_alerts(self, limit: int = 50) -> List[Alert]:
-        """Get recent security alerts"""
+    async def store_security_event(self, event: SecurityEvent):
+        """Store a detected security event"""
         try:
             cursor = self.connection.cursor()
             
             cursor.execute("""
-                SELECT * FROM alerts 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            """, (limit,))
+                INSERT INTO security_events (
+                    id, event_type, timestamp, source_ip, target_resource,
+                    description, severity, indicators, mitigation_actions, status,
+                    related_activities, related_alerts
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                event.id,
+                event.event_type,
+                event.timestamp.isoformat(),
+                event.source_ip,
+                event.target_resource,
+                event.description,
+                enum_value(event.severity),
+                json.dumps(event.indicators),
+                json.dumps(event.mitigation_actions),
+                event.status,
+                json.dumps(event.related_activities),
+                json.dumps(event.related_alerts)
+            ))
+            
+            self.connection.commit()
+            logger.info("Stored security event", extra=sampled_event(event_id=event.id))
+            
+        except Exception as e:
+            logger.error(f"Error storing security event: {e}")
+            raise
+    
+    async def get_recent_security_events(self, limit: int = 50) -> List[SecurityEvent]:
+        """Get recent security events"""
+        try:
+            cursor = self.connection.cursor()
             
-            rows = cursor.fetchall()
+            with DB_QUERY_SECONDS.time(query='security_events'):
+                cursor.execute("""
+                    SELECT * FROM security_events 
+                    ORDER BY timestamp DESC 
+                    LIMIT ?
+                """, (limit,))
+                
+                rows = cursor.fetchall()
+            
+            return [SecurityEvent.model_construct(
+                id=row['id'],
+                event_type=row['event_type'],
+                timestamp=datetime.fromisoformat(row['timestamp']),
+                source_ip=row['source_ip'],
+                target_resource=row['target_resource'],
+                description=row['description'],
+                severity=row['severity'],
+                indicators=json.loads(row['indicators'] or '[]'),
+                mitigation_actions=json.loads(row['mitigation_actions'] or '[]'),
+                status=row['status'],
+                related_activities=json.loads(row['related_activities'] or '[]'),
+                related_alerts=json.loads(row['related_alerts'] or '[]')
+            ) for row in rows]
+            
+        except Exception as e:
+            logger.error(f"Error getting security events: {e}")
+            return []
+    
+    def mark_scored(self, activity_ids: List[str]):
+        """Record that activities were scored; persisted by the next flush_scored()"""
+        self._scored_pending.update(activity_ids)
+
+    def flush_scored(self):
+        """Persist pending scored marks in one transaction"""
+        if not self._scored_pending:
+            return
+        ids, self._scored_pending = self._scored_pending, set()
+        try:
+            self.connection.executemany("UPDATE user_activities SET scored = 1 WHERE id = ?",
+                                        [(activity_id,) for activity_id in ids])
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            self._scored_pending |= ids
+            logger.error(f"Error marking activities scored: {e}")
+
+    def unscored(self, activity_ids: List[str]) -> set:
+        """
+        Ids that are stored but were never scored - stored before a crash, a
+        cancelled drain or a scoring error. Re-sent, they are scored rather than
+        answered as duplicates.
+        """
+        found = set()
+        ids = [activity_id for activity_id in activity_ids if activity_id not in self._scored_pending]
+        for start in range(0, len(ids), 900):
+            batch = ids[start:start + 900]
+            cursor = self.connection.execute(
+                f"SELECT id FROM user_activities WHERE scored = 0 AND id IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def get_alert_states(self, alert_ids: List[str]) -> Dict[str, tuple]:
+        """(anomaly_score, severity, status) of the given alerts"""
+        states = {}
+        for start in range(0, len(alert_ids), 900):
+            batch = alert_ids[start:start + 900]
+            for row in self.connection.execute(
+                f"SELECT id, anomaly_score, severity, status FROM alerts WHERE id IN ({','.join('?' * len(batch))})",
+                batch
+            ):
+                states[row[0]] = (row[1], row[2], row[3])
+        return states
+
+    async def update_alerts(self, alerts: List[Alert]):
+        """Write back aggregated alert state for a batch of alerts in one transaction"""
+        if not alerts:
+            return
+        try:
+            with self.connection:
+                self.connection.executemany("""
+                    UPDATE alerts SET
+                        severity = ?, anomaly_score = ?, related_activities = ?,
+                        occurrence_count = ?, last_seen = ?
+                    WHERE id = ?
+                """, [(
+                    enum_value(alert.severity),
+                    alert.anomaly_score,
+                    json.dumps(alert.related_activities),
+                    alert.occurrence_count,
+                    alert.last_seen.isoformat() if alert.last_seen else None,
+                    alert.id
+                ) for alert in alerts])
+            self.read_cache.bump_generation()
+            logger.debug(f"Updated {len(alerts)} aggregated alerts")
+            
+        except Exception as e:
+            logger.error(f"Error updating alerts: {e}")
+            raise
+    
+    async def get_recent_alerts(self, limit: int = 50) -> List[Alert]:
+        """Get recent security alerts"""
+        cache_key = ('recent_alerts', limit)
+        cached = self.read_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            generation = self.read_cache.generation
+            cursor = self.connection.cursor()
+            
+            with DB_QUERY_SECONDS.time(query='recent_alerts'):
+                cursor.execute("""
+                    SELECT * FROM alerts 
+                    ORDER BY timestamp DESC 
+                    LIMIT ?
+                """, (limit,))
+                
+                rows = cursor.fetchall()
             alerts = []
             
             for row in rows:
-                alert = Alert(
-                    id=row['id'],
-                    activity_id=row['activity_id'],
-                    user_id=row['user_id'],
-                    severity=row['severity'],
-                    anomaly_score=row['anomaly_score'],
-                    description=row['description'],
-                    timestamp=datetime.fromisoformat(row['timestamp']),
-                    status=row['status'],
-                    investigation_notes=row['investigation_notes'],
-                    auto_resolved=bool(row['auto_resolved']),
-                    false_positive=bool(row['false_positive']),
-                    related_activities=json.loads(row['related_activities'] or '[]')
-                )
-                alerts.append(alert)
+                alerts.append(self._row_to_alert(row))
             
+            self.read_cache.put(cache_key, alerts, generation)
             return alerts
             
         except Exception as e:
             logger.error(f"Error getting recent alerts: {e}")
             return []
     
+    def iter_rows(self, table: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  filters: Optional[Dict[str, Any]] = None, batch_size: int = 1000):
+        """
+        Stream rows of a table in timestamp order as plain dicts.
+        Uses its own read-only connection and fetches in batches, so memory stays
+        constant regardless of how many rows match.
+        """
+        if table not in ('user_activities', 'alerts'):
+            raise ValueError(f"Unsupported table for streaming: {table}")
+
+        clauses = []
+        params: List[Any] = []
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start.isoformat())
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end.isoformat())
+        for column, value in (filters or {}).items():
+            if value is None:
+                continue
+            if column not in self.STREAM_FILTER_COLUMNS[table]:
+                raise ValueError(f"Unsupported filter for {table}: {column}")
+            clauses.append(f"{column} = ?")
+            params.append(value)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._stream_rows(f"SELECT * FROM {table} {where} ORDER BY timestamp", params, batch_size)
+
+    def table_columns(self, table: str) -> List[str]:
+        """Column names of a streamable table, in the order iter_rows returns them"""
+        if table not in ('user_activities', 'alerts'):
+            raise ValueError(f"Unsupported table for streaming: {table}")
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            return [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+        finally:
+            connection.close()
+
+    def _stream_rows(self, query: str, params: List[Any], batch_size: int):
+        """Generator behind iter_rows - arguments are validated before it starts"""
+        # check_same_thread=False: streaming responses may pull batches from different worker threads
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            connection.close()
+
     async def get_dashboard_stats(self) -> DashboardStats:
         """Get dashboard statistics"""
+        cache_key = ('dashboard_stats',)
+        cached = self.read_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
+            generation = self.read_cache.generation
             cursor = self.connection.cursor()
+            started = time.perf_counter()
             
             # Total activities
             cursor.execute("SELECT COUNT(*) as count FROM user_activities")
@@ -316,8 +651,11 @@ class DatabaseManager:
             high_severity_alerts = cursor.fetchone()['count']
             
             # Users monitored
-            cursor.execute("SELECT COUNT(DISTINCT user_id) as count FROM user_activities")
-            users_monitored = cursor.fetchone()['count']
+            if self.traffic_sketches is not None:
+                users_monitored = self.traffic_sketches.total_users()
+            else:
+                cursor.execute("SELECT COUNT(DISTINCT user_id) as count FROM user_activities")
+                users_monitored = cursor.fetchone()['count']
             
             # Anomalies detected today
             today = datetime.now().date().isoformat()
@@ -331,18 +669,22 @@ class DatabaseManager:
             false_positives = cursor.fetchone()['fp']
             
             false_positive_rate = false_positives / total_alerts if total_alerts > 0 else 0.0
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, query='dashboard_stats')
             
-            return DashboardStats(
+            stats = DashboardStats(
                 total_activities=total_activities,
                 active_alerts=active_alerts,
                 high_severity_alerts=high_severity_alerts,
                 users_monitored=users_monitored,
                 anomalies_detected_today=anomalies_today,
                 false_positive_rate=false_positive_rate,
-                system_uptime=99.9,  # Mock value
+                system_uptime=availability_percent(),  # share of activities ingested without error
                 last_updated=datetime.now()
             )
             
+            self.read_cache.put(cache_key, stats, generation)
+            return stats
+            
         except Exception as e:
             logger.error(f"Error getting dashboard stats: {e}")
             return DashboardStats()
@@ -406,33 +748,19 @@ class DatabaseManager:
         try:
             cursor = self.connection.cursor()
             
-            cursor.execute("""
-                SELECT * FROM user_activities 
-                WHERE user_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            """, (user_id, limit))
-            
-            rows = cursor.fetchall()
+            with DB_QUERY_SECONDS.time(query='user_activities'):
+                cursor.execute("""
+                    SELECT * FROM user_activities 
+                    WHERE user_id = ? 
+                    ORDER BY timestamp DESC 
+                    LIMIT ?
+                """, (user_id, limit))
+                
+                rows = cursor.fetchall()
             activities = []
             
             for row in rows:
-                activity = UserActivity(
-                    id=row['id'],
-                    user_id=row['user_id'],
-                    action=row['action'],
-                    timestamp=datetime.fromisoformat(row['timestamp']),
-                    location=json.loads(row['location'] or '{}'),
-                    ip_address=row['ip_address'],
-                    user_agent=row['user_agent'],
-                    user_role=row['user_role'],
-                    success=bool(row['success']),
-                    failed_attempts=row['failed_attempts'],
-                    session_id=row['session_id'],
-                    device_fingerprint=row['device_fingerprint'],
-                    additional_data=json.loads(row['additional_data'] or '{}')
-                )
-                activities.append(activity)
+                activities.append(self._row_to_activity(row))
             
             return activities
             
@@ -440,6 +768,87 @@ class DatabaseManager:
             logger.error(f"Error getting user activities: {e}")
             return []
     
+    def load_novelty_filter(self, user_id: str) -> Optional[tuple]:
+        """Stored (filter bits, per-dimension counts) for a user, if any"""
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "SELECT novelty_filter, novelty_counts FROM user_profiles WHERE user_id = ?", (user_id,)
+        )
+        row = cursor.fetchone()
+        if row is None or row['novelty_filter'] is None:
+            return None
+        return row['novelty_filter'], json.loads(row['novelty_counts'] or '{}')
+    
+    def load_novelty_filters(self, user_ids: List[str], batch_size: int = 500) -> Dict[str, tuple]:
+        """
+        load_novelty_filter for many users, keyed by user_id (users without a
+        stored filter are left out). Uses its own read-only connection, so it
+        can run in a worker thread.
+        """
+        filters = {}
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            for i in range(0, len(user_ids), batch_size):
+                batch = user_ids[i:i + batch_size]
+                rows = connection.execute(
+                    f"SELECT user_id, novelty_filter, novelty_counts FROM user_profiles "
+                    f"WHERE novelty_filter IS NOT NULL AND user_id IN ({', '.join('?' for _ in batch)})",
+                    batch
+                )
+                for user_id, bits, counts in rows:
+                    filters[user_id] = (bits, json.loads(counts or '{}'))
+        finally:
+            connection.close()
+        return filters
+    
+    def save_novelty_filters(self, filters: List[tuple], own_connection: bool = False):
+        """
+        Upsert (user_id, filter bits, counts) tuples in a single transaction.
+        With own_connection it writes through a connection of its own, so it
+        can run in a worker thread without touching the loop's connection.
+        """
+        now = datetime.now().isoformat()
+        connection = sqlite3.connect(self.db_path, timeout=SQLITE_DEFAULT_TIMEOUT) if own_connection else self.connection
+        try:
+            with connection:
+                connection.executemany("""
+                    INSERT INTO user_profiles (user_id, novelty_filter, novelty_counts, last_updated)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        novelty_filter = excluded.novelty_filter,
+                        novelty_counts = excluded.novelty_counts,
+                        last_updated = excluded.last_updated
+                """, [(user_id, bits, json.dumps(counts), now) for user_id, bits, counts in filters])
+            logger.debug(f"Saved {len(filters)} novelty filters")
+        except Exception as e:
+            logger.error(f"Error saving novelty filters: {e}")
+            raise
+        finally:
+            if own_connection:
+                connection.close()
+    
+    def load_peer_drift(self):
+        """Stream (user_id, peer_drift) for users outside their peer group's radius"""
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT user_id, peer_drift FROM user_profiles WHERE peer_drift > 0")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                yield row['user_id'], row['peer_drift']
+    
+    def iter_user_ids(self):
+        """Stream the distinct user ids seen so far (used once to seed sketches)"""
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT DISTINCT user_id FROM user_activities")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                yield row['user_id']
+    
     async def close(self):
         """Close database connection"""
         if self.connection:
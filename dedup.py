@@ -0,0 +1,58 @@
+"""
+Duplicate Suppression for Third Umpire - AI Guard Dog System
+Remembers the activity ids ingested recently so agent retries are answered
+from memory, without a database round trip or a second scoring pass.
+"""
+
+import time
+import logging
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class RecentIdFilter:
+    """
+    Exact set of ids seen within a time window, kept as two generations: ids go
+    into the current set, lookups check both, and every window/2 seconds (or
+    when the current set is full) the older generation is dropped. An id is
+    therefore remembered for between window/2 and window seconds, memory stays
+    bounded, and there are no false positives - a hit is always a real duplicate.
+    Ids older than the window fall through to the database's own uniqueness check.
+    """
+
+    def __init__(self, window_seconds: float = 600.0, max_ids: int = 200000):
+        self.window = window_seconds
+        self.max_ids = max_ids
+        self._current: set = set()
+        self._previous: set = set()
+        self._rotated_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def _maybe_rotate(self, now: float):
+        if now - self._rotated_at >= self.window / 2 or len(self._current) >= self.max_ids:
+            self._previous, self._current = self._current, set()
+            self._rotated_at = now
+
+    def seen(self, activity_id: str) -> bool:
+        """Whether the id was added within the window"""
+        self._maybe_rotate(time.monotonic())
+        if activity_id in self._current or activity_id in self._previous:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, activity_id: str):
+        self._maybe_rotate(time.monotonic())
+        self._current.add(activity_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'window_seconds': self.window,
+            'tracked_ids': len(self._current) + len(self._previous),
+            'duplicates_suppressed': self.hits,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,173 @@
+"""
+Detector Engines for Third Umpire - AI Guard Dog System
+Interchangeable anomaly scoring models behind one interface (fit, score_batch,
+save/load), so a deployment or tenant can trade model strength for per-event cost.
+"""
+
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Type
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Detector(ABC):
+    """
+    Base interface for anomaly detector engines.
+    score_batch returns scores in [0, 1] (higher = more anomalous) with the
+    contamination cutoff of the training data mapped to 0.5 by every engine,
+    so engines can be swapped without retuning alert thresholds.
+    """
+
+    name = "base"
+
+    def __init__(self, contamination: float = 0.1):
+        self.contamination = contamination
+        self.is_fitted = False
+
+    @abstractmethod
+    def fit(self, features: np.ndarray) -> "Detector":
+        """Learn from a training matrix; returns self"""
+
+    @abstractmethod
+    def score_batch(self, features: np.ndarray) -> np.ndarray:
+        """Scores in [0, 1] for a matrix of feature rows"""
+
+    def save(self, path: str):
+        """Persist the fitted engine (joblib ships with scikit-learn)"""
+        import joblib
+        joblib.dump(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Detector":
+        import joblib
+        detector = joblib.load(path)
+        if not isinstance(detector, cls):
+            raise TypeError(f"{path} holds a {type(detector).__name__}, not a {cls.__name__}")
+        return detector
+
+    def get_params(self) -> Dict[str, Any]:
+        return {'engine': self.name, 'contamination': self.contamination, 'fitted': self.is_fitted}
+
+
+class IsolationForestDetector(Detector):
+    """StandardScaler + IsolationForest, the original model"""
+
+    name = "isolation_forest"
+
+    def __init__(self, contamination: float = 0.1, n_estimators: int = 100, random_state: int = 42):
+        super().__init__(contamination)
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        self.n_estimators = n_estimators
+        self.scaler = StandardScaler()
+        self.model = IsolationForest(
+            contamination=contamination, random_state=random_state, n_estimators=n_estimators
+        )
+
+    def fit(self, features: np.ndarray) -> "IsolationForestDetector":
+        self.model.fit(self.scaler.fit_transform(features))
+        self.is_fitted = True
+        return self
+
+    def score_batch(self, features: np.ndarray) -> np.ndarray:
+        decision = self.model.decision_function(self.scaler.transform(features))
+        # decision_function is 0 at the contamination cutoff and negative for outliers
+        return np.clip((1 - decision) / 2, 0.0, 1.0)
+
+    def get_params(self) -> Dict[str, Any]:
+        return {**super().get_params(), 'n_estimators': self.n_estimators}
+
+
+class _CutoffDetector(Detector):
+    """Engines with an unbounded raw score, normalized against the training cutoff"""
+
+    @abstractmethod
+    def _raw_scores(self, features: np.ndarray) -> np.ndarray:
+        """Unbounded outlier score per row (higher = more anomalous)"""
+
+    def _fit_cutoff(self, features: np.ndarray):
+        raw = self._raw_scores(features)
+        self.cutoff = max(float(np.quantile(raw, 1 - self.contamination)), 1e-9)
+        self.is_fitted = True
+
+    def score_batch(self, features: np.ndarray) -> np.ndarray:
+        # raw == cutoff -> 0.5, twice the cutoff (or more) -> 1
+        return np.clip(self._raw_scores(features) / (2 * self.cutoff), 0.0, 1.0)
+
+
+class HBOSDetector(_CutoffDetector):
+    """
+    Histogram-based outlier score: per-feature equal-width histograms, score is
+    the sum of -log(density) across features. O(features) per event.
+    """
+
+    name = "hbos"
+
+    def __init__(self, contamination: float = 0.1, bins: int = 20, alpha: float = 1e-3):
+        super().__init__(contamination)
+        self.bins = bins
+        self.alpha = alpha  # density floor for empty bins and values outside the training range
+
+    def fit(self, features: np.ndarray) -> "HBOSDetector":
+        features = np.asarray(features, dtype=np.float64)
+        self.edges = np.empty((features.shape[1], self.bins + 1))
+        self.log_density = np.empty((features.shape[1], self.bins + 2))
+        for j in range(features.shape[1]):
+            counts, edges = np.histogram(features[:, j], bins=self.bins)
+            density = counts / counts.max()
+            # Bins 0 and bins+1 catch values below/above the training range
+            self.edges[j] = edges
+            self.log_density[j] = -np.log(np.concatenate(([0.0], density, [0.0])) + self.alpha)
+        self._fit_cutoff(features)
+        return self
+
+    def _raw_scores(self, features: np.ndarray) -> np.ndarray:
+        features = np.asarray(features, dtype=np.float64)
+        raw = np.zeros(len(features))
+        for j in range(features.shape[1]):
+            edges = self.edges[j]
+            index = np.searchsorted(edges, features[:, j], side='right')
+            # The right edge of the last bin is inclusive, as in np.histogram
+            index[features[:, j] == edges[-1]] = self.bins
+            raw += self.log_density[j][index]
+        return raw
+
+    def get_params(self) -> Dict[str, Any]:
+        return {**super().get_params(), 'bins': self.bins}
+
+
+class RobustZDetector(_CutoffDetector):
+    """Per-feature robust z-scores (median / MAD); score is the largest |z|"""
+
+    name = "robust_z"
+
+    def fit(self, features: np.ndarray) -> "RobustZDetector":
+        features = np.asarray(features, dtype=np.float64)
+        self.median = np.median(features, axis=0)
+        mad = np.median(np.abs(features - self.median), axis=0) * 1.4826
+        # Constant features (MAD 0) fall back to the standard deviation, then to 1
+        std = features.std(axis=0)
+        self.scale = np.where(mad > 0, mad, np.where(std > 0, std, 1.0))
+        self._fit_cutoff(features)
+        return self
+
+    def _raw_scores(self, features: np.ndarray) -> np.ndarray:
+        z = np.abs((np.asarray(features, dtype=np.float64) - self.median) / self.scale)
+        return z.max(axis=1)
+
+
+DETECTOR_ENGINES: Dict[str, Type[Detector]] = {
+    IsolationForestDetector.name: IsolationForestDetector,
+    HBOSDetector.name: HBOSDetector,
+    RobustZDetector.name: RobustZDetector
+}
+
+
+def create_detector(engine: str, **params) -> Detector:
+    """Instantiate an engine by name"""
+    if engine not in DETECTOR_ENGINES:
+        raise ValueError(f"Unknown detector engine: {engine} (available: {', '.join(DETECTOR_ENGINES)})")
+    return DETECTOR_ENGINES[engine](**params)
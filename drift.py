@@ -0,0 +1,215 @@
+"""
+Feature Drift Monitoring for Third Umpire - AI Guard Dog System
+Compares the live distribution of each model feature with the data the
+detectors were fit on (population stability index over fixed bins) and
+retrains on recent traffic, in a separate process, when they diverge.
+"""
+
+import time
+import sqlite3
+import logging
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from ai_engine import FEATURE_NAMES, activity_features
+from detectors import create_detector
+from models import ActivityRecord, ACTIVITY_COLUMNS
+from thresholds import REBASE_HALF_LIVES
+
+logger = logging.getLogger(__name__)
+
+# Recent activities that did not raise an alert, newest first. Repeats folded into an
+# aggregated alert only appear in its related_activities, so those are excluded too
+RECENT_QUERY = f"""
+    SELECT {', '.join(f'a.{column}' for column in ACTIVITY_COLUMNS)}
+    FROM user_activities a
+    WHERE a.timestamp >= ?
+      AND NOT EXISTS (SELECT 1 FROM alerts WHERE alerts.activity_id = a.id)
+      AND a.id NOT IN (
+          SELECT related.value FROM alerts, json_each(alerts.related_activities) AS related
+          WHERE alerts.occurrence_count > 1 AND COALESCE(alerts.last_seen, alerts.timestamp) >= ?
+      )
+    ORDER BY a.timestamp DESC
+    LIMIT ?
+"""
+
+
+def population_stability_index(expected: np.ndarray, actual: np.ndarray, floor: float = 1e-4) -> float:
+    """PSI between two bin distributions; above 0.25 is conventionally a significant shift"""
+    expected = np.maximum(expected / max(expected.sum(), 1e-12), floor)
+    actual = np.maximum(actual / max(actual.sum(), 1e-12), floor)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class FeatureDriftMonitor:
+    """
+    Per-feature histograms of live traffic on bins fixed by the training data:
+    a category per distinct value for discrete features, deciles otherwise.
+    Each event costs one bisect and one increment per feature; live counts decay
+    with the same forward weighting as the threshold histograms, so the
+    comparison covers roughly the last few half-lives of traffic.
+    """
+
+    def __init__(self, feature_names: List[str] = FEATURE_NAMES, bins: int = 10,
+                 half_life_seconds: float = 6 * 3600.0, psi_threshold: float = 0.25,
+                 min_events: int = 2000, cooldown_seconds: float = 3600.0):
+        self.feature_names = list(feature_names)
+        self.bins = bins
+        self.half_life = half_life_seconds
+        self.psi_threshold = psi_threshold
+        self.min_events = min_events
+        self.cooldown = cooldown_seconds
+
+        self._edges: List[List[float]] = []
+        self.reference: Optional[np.ndarray] = None
+        self.reference_size = 0
+        self.live: Optional[List[List[float]]] = None  # plain lists: scalar increments are cheaper than numpy
+        self._warmup: Optional[List[List[float]]] = None  # live vectors collected while there is no reference
+        self.total = 0.0
+        self.landmark = time.time()
+        self.observed = 0
+
+        self.retraining = False
+        self.retrains = 0
+        self.last_retrain: Optional[Dict[str, Any]] = None
+        self._last_retrain_at = 0.0
+
+    def set_reference(self, features: np.ndarray):
+        """Fix bins and reference proportions from a training matrix, and restart the live counts"""
+        edges = []
+        for column in features.T:
+            values = np.unique(column)
+            if len(values) <= self.bins:
+                # One bin per distinct value
+                edges.append(((values[1:] + values[:-1]) / 2).tolist())
+            else:
+                edges.append(np.unique(np.quantile(column, np.linspace(0, 1, self.bins + 1)[1:-1])).tolist())
+
+        width = max(len(e) for e in edges) + 1
+        reference = np.zeros((len(edges), width))
+        for i, column in enumerate(features.T):
+            index = np.searchsorted(edges[i], column, side='right')
+            reference[i, :len(edges[i]) + 1] = np.bincount(index, minlength=len(edges[i]) + 1)
+
+        self._edges = edges
+        self.reference = reference
+        self.reference_size = len(features)
+        self.live = [[0.0] * (len(e) + 1) for e in edges]
+        self.total = 0.0
+        self.landmark = time.time()
+        self._warmup = None
+
+    def reference_from_live(self):
+        """
+        Drop the reference and build the next one from the first `min_events`
+        live vectors, for models trained on data that is not live traffic
+        (nothing drifts, so nothing retrains, until then)
+        """
+        self._edges = []
+        self.reference = None
+        self.reference_size = 0
+        self.live = None
+        self.total = 0.0
+        self._warmup = []
+
+    def observe(self, features: List[float]):
+        """Count one live event's feature vector"""
+        if self.live is None:
+            if self._warmup is not None:
+                self._warmup.append(list(features))
+                if len(self._warmup) >= self.min_events:
+                    self.set_reference(np.array(self._warmup, dtype=np.float64))
+            return
+        now = time.time()
+        if now - self.landmark > REBASE_HALF_LIVES * self.half_life:
+            # Rebase before the weight is taken, so a long idle gap cannot overflow it
+            decay = 2.0 ** (-(now - self.landmark) / self.half_life)
+            self.live = [[count * decay for count in counts] for counts in self.live]
+            self.total *= decay
+            self.landmark = now
+        weight = 2.0 ** ((now - self.landmark) / self.half_life)
+        live = self.live
+        for i, edges in enumerate(self._edges):
+            live[i][bisect_right(edges, features[i])] += weight
+        self.total += weight
+        self.observed += 1
+
+    def live_events(self, now: Optional[float] = None) -> float:
+        """Decayed number of live events behind the current comparison"""
+        now = now if now is not None else time.time()
+        # Negative exponent: underflows to 0 instead of overflowing when observe() has been idle
+        return self.total * 2.0 ** (-(now - self.landmark) / self.half_life)
+
+    def psi(self) -> Dict[str, float]:
+        """PSI of every feature (0 until there is live traffic)"""
+        if self.live is None or self.total <= 0:
+            return {name: 0.0 for name in self.feature_names}
+        return {
+            name: population_stability_index(self.reference[i, :len(edges) + 1], np.array(self.live[i]))
+            for i, (name, edges) in enumerate(zip(self.feature_names, self._edges))
+        }
+
+    def drifted_features(self) -> List[str]:
+        return [name for name, value in self.psi().items() if value > self.psi_threshold]
+
+    def should_retrain(self) -> bool:
+        """Enough live traffic, some feature past the threshold, and not retrained recently"""
+        now = time.time()
+        return (not self.retraining
+                and now - self._last_retrain_at >= self.cooldown
+                and self.live_events(now) >= self.min_events
+                and bool(self.drifted_features()))
+
+    def record_retrain(self, result: Dict[str, Any]):
+        self._last_retrain_at = time.time()
+        self.last_retrain = {**result, 'finished_at': datetime.now().isoformat()}
+        if not result.get('skipped'):
+            self.retrains += 1
+
+    def get_report(self) -> Dict[str, Any]:
+        psi = self.psi()
+        return {
+            'psi_threshold': self.psi_threshold,
+            'max_psi': max(psi.values()) if psi else 0.0,
+            'drifted_features': [name for name, value in psi.items() if value > self.psi_threshold],
+            'features': psi,
+            'live_events': self.live_events(),
+            'observed_events': self.observed,
+            'reference_size': self.reference_size,
+            'reference_warmup_events': len(self._warmup) if self._warmup is not None else None,
+            'half_life_seconds': self.half_life,
+            'retraining': self.retraining,
+            'retrains': self.retrains,
+            'last_retrain': self.last_retrain
+        }
+
+
+def retrain_from_recent(db_path: str, engines: List[str], contamination: float = 0.1,
+                        lookback_hours: float = 24.0, max_rows: int = 50000,
+                        min_rows: int = 1000) -> Dict[str, Any]:
+    """
+    Fit fresh detectors on recent traffic that raised no alert.
+    Meant to run in its own process; returns the detectors and their training
+    matrix for the caller to swap in, or a 'skipped' reason.
+    """
+    started = time.perf_counter()
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    try:
+        since = (datetime.now() - timedelta(hours=lookback_hours)).isoformat()
+        rows = connection.execute(RECENT_QUERY, (since, since, max_rows)).fetchall()
+    finally:
+        connection.close()
+    if len(rows) < min_rows:
+        return {'skipped': f"only {len(rows)} recent activities (need {min_rows})", 'rows': len(rows)}
+
+    features = np.array([activity_features(ActivityRecord.from_row(row)) for row in rows], dtype=np.float64)
+    detectors = {engine: create_detector(engine, contamination=contamination).fit(features) for engine in engines}
+    return {
+        'detectors': detectors,
+        'features': features,
+        'rows': len(rows),
+        'duration_seconds': time.perf_counter() - started
+    }
@@ -0,0 +1,340 @@
+"""
+Detector Evaluation for Third Umpire - AI Guard Dog System
+Shared harness that runs detector engines, or the full AnomalyDetector
+pipeline in any configuration, over labeled data and reports scoring cost
+(per-event latency, batch throughput) next to detection quality. Score
+parity reports compare two model versions event by event, so performance
+work can be checked for unintended changes in output.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+from detectors import DETECTOR_ENGINES, create_detector
+from models import UserActivity, ActivityRecord
+
+logger = logging.getLogger(__name__)
+
+
+def labeled_dataset(seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """Synthetic feature matrix and labels (1 = anomalous) from the detector's generator"""
+    from ai_engine import generate_training_data, training_matrix
+    data = generate_training_data(seed=seed)
+    return training_matrix(data).astype(np.float64), data['label'].to_numpy()
+
+
+def labeled_activities(seed: int = 7, users: int = 50,
+                       start: datetime = datetime(2024, 1, 1)) -> Tuple[List[ActivityRecord], np.ndarray]:
+    """
+    The generator's rows as activities in event order (labels aligned), spread
+    over 30 days and a pool of users, for evaluating the whole scoring pipeline.
+    """
+    from ai_engine import generate_training_data
+    data = generate_training_data(seed=seed)
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 30, len(data))
+    user_ids = rng.integers(0, users, len(data))
+
+    records = []
+    for i, row in enumerate(data.itertuples(index=False)):
+        user_id = f"eval_user_{user_ids[i]}"
+        records.append(ActivityRecord(
+            f"eval-{seed}-{i}", user_id, row.action_type,
+            start + timedelta(days=int(days[i]), hours=float(row.hour)),
+            {'latitude': float(row.latitude), 'longitude': float(row.longitude)},
+            f"10.0.{user_ids[i] // 250}.{user_ids[i] % 250 + 1}", "eval-agent", row.privilege_level,
+            bool(row.success), int(row.failed_attempts), f"eval-session-{i}", f"eval-device-{user_ids[i]}", {}
+        ))
+    order = sorted(range(len(records)), key=lambda i: records[i].timestamp)
+    return [records[i] for i in order], data['label'].to_numpy()[order]
+
+
+def save_activities(path: str, records: List[ActivityRecord], labels: np.ndarray):
+    """Write a labeled dataset as NDJSON (activity fields plus "label")"""
+    with open(path, 'w') as f:
+        for record, label in zip(records, labels):
+            f.write(json.dumps({**record.to_dict(), 'label': int(label)}, default=str) + '\n')
+
+
+def load_activities(path: str) -> Tuple[List[ActivityRecord], np.ndarray]:
+    """Read an NDJSON dataset written by save_activities (or exported and labeled by hand)"""
+    records, labels = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            labels.append(int(item.pop('label')))
+            records.append(ActivityRecord.from_activity(UserActivity.model_validate(item)))
+    order = sorted(range(len(records)), key=lambda i: records[i].timestamp)
+    return [records[i] for i in order], np.array(labels)[order]
+
+
+def load_dataset(spec: str) -> Tuple[List[ActivityRecord], np.ndarray]:
+    """"synthetic" or "synthetic:SEED" for generated data, anything else is an NDJSON path"""
+    if spec == 'synthetic' or spec.startswith('synthetic:'):
+        return labeled_activities(int(spec.split(':', 1)[1]) if ':' in spec else 7)
+    return load_activities(spec)
+
+
+def detection_quality(scores: np.ndarray, labels: np.ndarray, threshold: float) -> Dict[str, Any]:
+    """Precision, recall, ROC-AUC and alert rate of scores judged against a cutoff"""
+    from sklearn.metrics import roc_auc_score
+
+    predicted = scores > threshold
+    positives = labels == 1
+    true_positives = int((predicted & positives).sum())
+    return {
+        'threshold': threshold,
+        'alerts': int(predicted.sum()),
+        'alert_rate': float(predicted.mean()) if len(predicted) else 0.0,
+        'precision': true_positives / predicted.sum() if predicted.any() else 0.0,
+        'recall': true_positives / positives.sum() if positives.any() else 0.0,
+        'roc_auc': float(roc_auc_score(labels, scores)) if 0 < positives.sum() < len(labels) else None
+    }
+
+
+def latency_percentiles(latencies: np.ndarray) -> Dict[str, float]:
+    return {f"p{q:g}": float(np.percentile(latencies, q) * 1e6) for q in (50, 90, 99, 99.9)}
+
+
+def evaluate_engine(engine: str, train_features: np.ndarray, eval_features: np.ndarray,
+                    labels: np.ndarray, threshold: float = 0.5, latency_samples: int = 1000,
+                    batch_size: int = 1000, **params) -> Dict[str, Any]:
+    """Fit one engine and measure latency, throughput and detection quality"""
+    started = time.perf_counter()
+    detector = create_detector(engine, **params).fit(train_features)
+    fit_seconds = time.perf_counter() - started
+
+    # Per-event latency: one row at a time, as on the ingest path
+    latencies = np.empty(min(latency_samples, len(eval_features)))
+    for i in range(len(latencies)):
+        row = eval_features[i:i + 1]
+        started = time.perf_counter()
+        detector.score_batch(row)
+        latencies[i] = time.perf_counter() - started
+
+    # Batch throughput over the whole evaluation set
+    started = time.perf_counter()
+    scores = np.concatenate([
+        detector.score_batch(eval_features[i:i + batch_size])
+        for i in range(0, len(eval_features), batch_size)
+    ])
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        'engine': engine,
+        'params': detector.get_params(),
+        'fit_seconds': fit_seconds,
+        'latency_us': latency_percentiles(latencies),
+        'throughput_per_second': len(eval_features) / batch_seconds if batch_seconds > 0 else None,
+        **detection_quality(scores, labels, threshold)
+    }
+
+
+def compare_engines(engines: Optional[List[str]] = None, train_seed: int = 42,
+                    eval_seed: int = 7) -> List[Dict[str, Any]]:
+    """Evaluate engines on the same train/eval split (different generator seeds)"""
+    train_features, _ = labeled_dataset(train_seed)
+    eval_features, labels = labeled_dataset(eval_seed)
+    return [evaluate_engine(engine, train_features, eval_features, labels)
+            for engine in (engines or list(DETECTOR_ENGINES))]
+
+
+def build_detector(config: Dict[str, Any], train_features: np.ndarray):
+    """
+    A trained AnomalyDetector for a configuration:
+    {"engine", "tenant_engines", "engine_params": {engine: {...}}, "rules_path"}
+    """
+    from ai_engine import AnomalyDetector, DEFAULT_RULES_PATH
+    detector = AnomalyDetector(config.get('rules_path', str(DEFAULT_RULES_PATH)),
+                               engine=config.get('engine', 'isolation_forest'),
+                               tenant_engines=config.get('tenant_engines'))
+    engine_params = config.get('engine_params', {})
+    detector.swap_detectors({
+        engine: create_detector(engine, **{'contamination': detector.contamination,
+                                           **engine_params.get(engine, {})}).fit(train_features)
+        for engine in {detector.engine, *detector.tenant_engines.values()}
+    }, train_features)
+    detector.is_trained = True
+    return detector
+
+
+def evaluate_pipeline(config: Dict[str, Any], records: List[ActivityRecord], labels: np.ndarray,
+                      train_seed: int = 42, threshold: float = 0.7,
+                      batch_size: int = 1000) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    Score a dataset through the full pipeline (model plus behavioral rules) both
+    ways it runs in production: event by event through detect_anomaly, timing
+    each call, and in batches through score_activities. Each pass gets its own
+    freshly trained detector, since the behavioral state advances with every event.
+    Returns the report and the batch scores.
+    """
+    train_features, _ = labeled_dataset(train_seed)
+
+    started = time.perf_counter()
+    detector = build_detector(config, train_features)
+    fit_seconds = time.perf_counter() - started
+
+    latencies = np.empty(len(records))
+    event_scores = np.empty(len(records))
+
+    async def score_events():
+        for i, record in enumerate(records):
+            started = time.perf_counter()
+            event_scores[i] = await detector.detect_anomaly(record)
+            latencies[i] = time.perf_counter() - started
+
+    asyncio.run(score_events())
+
+    detector = build_detector(config, train_features)
+    started = time.perf_counter()
+    scores = np.concatenate([
+        detector.score_activities(records[i:i + batch_size]) for i in range(0, len(records), batch_size)
+    ])
+    batch_seconds = time.perf_counter() - started
+
+    report = {
+        'config': config,
+        'events': len(records),
+        'fit_seconds': fit_seconds,
+        'latency_us': latency_percentiles(latencies),
+        'events_per_second': len(records) / latencies.sum() if latencies.sum() > 0 else None,
+        'batch_throughput_per_second': len(records) / batch_seconds if batch_seconds > 0 else None,
+        # The two paths must agree; anything above float noise is a bug in one of them
+        'event_batch_max_abs_diff': float(np.abs(event_scores - scores).max()) if len(records) else 0.0,
+        **detection_quality(scores, labels, threshold)
+    }
+    return report, scores
+
+
+def save_scores(path: str, ids: List[str], scores: np.ndarray, labels: np.ndarray, meta: Dict[str, Any]):
+    """Keep a run's scores so a later model version can be compared against them"""
+    np.savez_compressed(path, ids=np.array(ids), scores=scores, labels=labels, meta=json.dumps(meta, default=str))
+
+
+def load_scores(path: str) -> Tuple[List[str], np.ndarray, np.ndarray, Dict[str, Any]]:
+    with np.load(path) as data:
+        return data['ids'].tolist(), data['scores'], data['labels'], json.loads(str(data['meta']))
+
+
+def parity_report(ids: List[str], baseline: np.ndarray, candidate: np.ndarray,
+                  labels: Optional[np.ndarray] = None, threshold: float = 0.7,
+                  tolerance: float = 1e-9, max_examples: int = 20) -> Dict[str, Any]:
+    """Event-by-event comparison of two versions' scores on the same dataset"""
+    from scipy.stats import spearmanr
+
+    difference = candidate - baseline
+    absolute = np.abs(difference)
+    flips = (baseline > threshold) != (candidate > threshold)
+    worst = np.argsort(-absolute)[:max_examples]
+    report = {
+        'events': len(ids),
+        'tolerance': tolerance,
+        'within_tolerance': bool(absolute.max() <= tolerance) if len(ids) else True,
+        'identical_share': float((absolute <= tolerance).mean()) if len(ids) else 1.0,
+        'max_abs_diff': float(absolute.max()) if len(ids) else 0.0,
+        'mean_abs_diff': float(absolute.mean()) if len(ids) else 0.0,
+        'p99_abs_diff': float(np.percentile(absolute, 99)) if len(ids) else 0.0,
+        'mean_diff': float(difference.mean()) if len(ids) else 0.0,
+        'rank_correlation': float(spearmanr(baseline, candidate)[0]) if len(ids) > 1 else 1.0,
+        'decision_flips': int(flips.sum()),
+        'new_alerts': int(((candidate > threshold) & ~(baseline > threshold)).sum()),
+        'dropped_alerts': int(((baseline > threshold) & ~(candidate > threshold)).sum()),
+        'largest_differences': [
+            {'id': ids[i], 'baseline': float(baseline[i]), 'candidate': float(candidate[i])}
+            for i in worst if absolute[i] > tolerance
+        ]
+    }
+    if labels is not None:
+        report['baseline_quality'] = detection_quality(baseline, labels, threshold)
+        report['candidate_quality'] = detection_quality(candidate, labels, threshold)
+    return report
+
+
+def _read_json_arg(value: str) -> Dict[str, Any]:
+    """A JSON object given inline or as a path to a file"""
+    if os.path.exists(value):
+        with open(value) as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def _version_scores(version: str, dataset: str, train_seed: int, threshold: float):
+    """(ids, scores, labels) for a saved .npz score file or a detector configuration"""
+    if version.endswith('.npz'):
+        ids, scores, labels, _ = load_scores(version)
+        return ids, scores, labels
+    records, labels = load_dataset(dataset)
+    _, scores = evaluate_pipeline(_read_json_arg(version), records, labels, train_seed, threshold)
+    return [record.id for record in records], scores, labels
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Evaluate anomaly detection quality and scoring cost")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    engines = commands.add_parser("engines", help="compare detector engines on the model features alone")
+    engines.add_argument("--engines", nargs="+", choices=sorted(DETECTOR_ENGINES), default=None)
+
+    pipeline = commands.add_parser("pipeline", help="evaluate one AnomalyDetector configuration end to end")
+    pipeline.add_argument("--config", default="{}", help="JSON object or path to a JSON file")
+    pipeline.add_argument("--dataset", default="synthetic:7", help="synthetic[:SEED] or an NDJSON file")
+    pipeline.add_argument("--save-scores", help="write scores to this .npz for later parity checks")
+
+    parity = commands.add_parser("parity", help="compare the scores of two model versions")
+    parity.add_argument("--baseline", required=True, help="saved .npz scores, or a configuration")
+    parity.add_argument("--candidate", required=True, help="saved .npz scores, or a configuration")
+    parity.add_argument("--dataset", default="synthetic:7")
+    parity.add_argument("--tolerance", type=float, default=1e-9)
+
+    generate = commands.add_parser("generate", help="write a synthetic labeled dataset as NDJSON")
+    generate.add_argument("--seed", type=int, default=7)
+    generate.add_argument("--out", required=True)
+
+    for command in (pipeline, parity):
+        command.add_argument("--train-seed", type=int, default=42)
+        command.add_argument("--threshold", type=float, default=0.7)
+    args = parser.parse_args()
+
+    if args.command == "engines":
+        for result in compare_engines(args.engines):
+            print(json.dumps(result))
+    elif args.command == "pipeline":
+        config = _read_json_arg(args.config)
+        records, labels = load_dataset(args.dataset)
+        report, scores = evaluate_pipeline(config, records, labels, args.train_seed, args.threshold)
+        if args.save_scores:
+            save_scores(args.save_scores, [record.id for record in records], scores, labels,
+                        {'config': config, 'dataset': args.dataset, 'created_at': datetime.now()})
+        print(json.dumps(report, indent=2))
+    elif args.command == "parity":
+        base_ids, baseline, labels = _version_scores(args.baseline, args.dataset, args.train_seed, args.threshold)
+        ids, candidate, _ = _version_scores(args.candidate, args.dataset, args.train_seed, args.threshold)
+        if ids != base_ids:
+            # Align on activity id; events only one side scored are left out
+            position = {activity_id: i for i, activity_id in enumerate(ids)}
+            shared = [i for i, activity_id in enumerate(base_ids) if activity_id in position]
+            candidate = candidate[[position[base_ids[i]] for i in shared]]
+            baseline, labels = baseline[shared], labels[shared]
+            base_ids = [base_ids[i] for i in shared]
+        report = parity_report(base_ids, baseline, candidate, labels, args.threshold, args.tolerance)
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0 if report['within_tolerance'] else 1)
+    elif args.command == "generate":
+        records, labels = labeled_activities(args.seed)
+        save_activities(args.out, records, labels)
+        print(f"Wrote {len(records)} activities ({int(labels.sum())} anomalous) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
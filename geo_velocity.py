@@ -0,0 +1,196 @@
+"""
+Impossible Travel Detection for Third Umpire - AI Guard Dog System
+Keeps each user's last known location in compact arrays and flags movement
+faster than any plausible means of travel, plus first visits to new areas.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km; works element-wise on NumPy arrays"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class ImpossibleTravelDetector:
+    """
+    Per-user last-known-location table with haversine velocity checks.
+    State lives in parallel NumPy arrays indexed by a user slot, so each event
+    costs one dict lookup and a handful of float operations - no DB access.
+    At most `max_users` users are tracked; the least recently seen one gives
+    up its slot to a new user (who then simply has no history yet). A batch
+    must hold fewer distinct users than that.
+    """
+
+    def __init__(self, max_speed_kmh: float = 900.0, min_distance_km: float = 100.0,
+                 min_interval_seconds: float = 60.0, cell_degrees: float = 1.0,
+                 max_known_cells: int = 8, initial_capacity: int = 1024, max_users: int = 100000):
+        self.max_speed_kmh = max_speed_kmh  # roughly airliner cruising speed
+        self.min_distance_km = min_distance_km  # ignore GPS / IP geolocation jitter
+        self.min_interval_seconds = min_interval_seconds
+        self.cell_degrees = cell_degrees
+        self.max_known_cells = max_known_cells
+        self.max_users = max_users
+
+        self.user_slots: "OrderedDict[str, int]" = OrderedDict()  # least recently seen first
+        self.latitude = np.zeros(initial_capacity, dtype=np.float64)
+        self.longitude = np.zeros(initial_capacity, dtype=np.float64)
+        self.last_seen = np.zeros(initial_capacity, dtype=np.float64)
+        self.has_location = np.zeros(initial_capacity, dtype=np.bool_)
+        # Small per-user list of visited grid cells, most recent last
+        self.known_cells: List[List[int]] = []
+        self.evicted = 0
+
+    def _slot(self, user_id: str) -> int:
+        slot = self.user_slots.get(user_id)
+        if slot is not None:
+            self.user_slots.move_to_end(user_id)
+            return slot
+        if len(self.user_slots) >= self.max_users:
+            # Reuse the least recently seen user's slot
+            _, slot = self.user_slots.popitem(last=False)
+            self.has_location[slot] = False
+            self.known_cells[slot] = []
+            self.evicted += 1
+        else:
+            slot = len(self.user_slots)
+            if slot >= len(self.latitude):
+                self._grow()
+            self.known_cells.append([])
+        self.user_slots[user_id] = slot
+        return slot
+
+    def _grow(self):
+        capacity = len(self.latitude) * 2
+        for name in ('latitude', 'longitude', 'last_seen', 'has_location'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _cell(self, latitude: float, longitude: float) -> int:
+        """Grid cell id of a coordinate"""
+        columns = int(360 / self.cell_degrees)
+        row = int((latitude + 90.0) // self.cell_degrees)
+        column = int((longitude + 180.0) // self.cell_degrees)
+        return row * columns + column
+
+    def _touch_cell(self, slot: int, cell: int) -> bool:
+        """Record a visit and return True if the cell was new for this user"""
+        cells = self.known_cells[slot]
+        is_new = cell not in cells
+        if not is_new:
+            cells.remove(cell)
+        cells.append(cell)
+        if len(cells) > self.max_known_cells:
+            cells.pop(0)
+        return is_new
+
+    def _signal(self, distance_km: float, speed_kmh: float, new_location: bool, had_history: bool) -> Dict[str, Any]:
+        impossible = distance_km >= self.min_distance_km and speed_kmh > self.max_speed_kmh
+        if impossible:
+            score = min(0.8, 0.5 + 0.3 * (speed_kmh / self.max_speed_kmh - 1.0))
+        elif new_location and had_history:
+            score = 0.15
+        else:
+            score = 0.0
+        return {
+            'distance_km': float(distance_km),
+            'speed_kmh': float(speed_kmh),
+            'impossible_travel': bool(impossible),
+            'new_location': bool(new_location and had_history),
+            'score': float(score)
+        }
+
+    def observe(self, user_id: str, location: Dict[str, float], timestamp: float) -> Dict[str, Any]:
+        """Check one event against the user's last location and update the state"""
+        if 'latitude' not in location or 'longitude' not in location:
+            return self._signal(0.0, 0.0, False, False)
+
+        latitude, longitude = location['latitude'], location['longitude']
+        slot = self._slot(user_id)
+        had_history = bool(self.has_location[slot])
+
+        distance_km = speed_kmh = 0.0
+        if had_history:
+            distance_km = float(haversine_km(self.latitude[slot], self.longitude[slot], latitude, longitude))
+            interval = max(abs(timestamp - self.last_seen[slot]), self.min_interval_seconds)
+            speed_kmh = distance_km / (interval / 3600.0)
+
+        new_location = self._touch_cell(slot, self._cell(latitude, longitude))
+        self.latitude[slot] = latitude
+        self.longitude[slot] = longitude
+        self.last_seen[slot] = timestamp
+        self.has_location[slot] = True
+
+        return self._signal(distance_km, speed_kmh, new_location, had_history)
+
+    def observe_batch(self, user_ids: Sequence[str], latitudes: np.ndarray, longitudes: np.ndarray,
+                      timestamps: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Vectorized version of observe for a batch of events.
+        Rows without a location should carry NaN coordinates.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        count = len(user_ids)
+        signals: List[Optional[Dict[str, Any]]] = [self._signal(0.0, 0.0, False, False)] * count
+
+        located = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        rows = np.flatnonzero(located)
+        if len(rows) == 0:
+            return signals
+
+        slots = np.array([self._slot(user_ids[i]) for i in rows], dtype=np.int64)
+        # Process each user's events in time order
+        order = np.lexsort((timestamps[rows], slots))
+        rows, slots = rows[order], slots[order]
+        lat, lon, ts = latitudes[rows], longitudes[rows], timestamps[rows]
+
+        # Previous point: the earlier event of the same user in this batch, else the stored state
+        same_user = np.zeros(len(rows), dtype=np.bool_)
+        same_user[1:] = slots[1:] == slots[:-1]
+        prev_lat = np.where(same_user, np.roll(lat, 1), self.latitude[slots])
+        prev_lon = np.where(same_user, np.roll(lon, 1), self.longitude[slots])
+        prev_ts = np.where(same_user, np.roll(ts, 1), self.last_seen[slots])
+        had_history = same_user | self.has_location[slots]
+
+        distance = np.where(had_history, haversine_km(prev_lat, prev_lon, lat, lon), 0.0)
+        interval = np.maximum(np.abs(ts - prev_ts), self.min_interval_seconds)
+        speed = np.where(had_history, distance / (interval / 3600.0), 0.0)
+
+        for i, row in enumerate(rows):
+            new_location = self._touch_cell(int(slots[i]), self._cell(lat[i], lon[i]))
+            signals[row] = self._signal(distance[i], speed[i], new_location, bool(had_history[i]))
+
+        # Persist each user's last event of the batch
+        last = np.ones(len(rows), dtype=np.bool_)
+        last[:-1] = slots[:-1] != slots[1:]
+        self.latitude[slots[last]] = lat[last]
+        self.longitude[slots[last]] = lon[last]
+        self.last_seen[slots[last]] = ts[last]
+        self.has_location[slots[last]] = True
+
+        return signals
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Size of the tracked state"""
+        return {
+            'users_tracked': len(self.user_slots),
+            'max_users': self.max_users,
+            'evicted': self.evicted,
+            'state_bytes': int(self.latitude.nbytes + self.longitude.nbytes +
+                               self.last_seen.nbytes + self.has_location.nbytes)
+        }
@@ -0,0 +1,333 @@
+"""
+Hot Window for Third Umpire - AI Guard Dog System
+Array-backed ring buffers holding the newest activities and alerts in memory,
+so live dashboard reads, rollups and WebSocket replay never touch the disk.
+"""
+
+import sys
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from models import (
+    ACTION_NAMES, ROLE_NAMES, SEVERITY_NAMES, ACTION_CODES, ROLE_CODES, SEVERITY_CODES, enum_value
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StringInterner:
+    """Maps repeated strings (user ids, IPs, agents...) to small integer codes"""
+
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+        self._strings: List[str] = []
+
+    def intern(self, value: Optional[str]) -> int:
+        value = value or ""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._strings)
+            value = sys.intern(value)
+            self._codes[value] = code
+            self._strings.append(value)
+        return code
+
+    def lookup(self, code: int) -> str:
+        return self._strings[code]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+
+class _RingBuffer:
+    """Shared ring bookkeeping: column arrays plus a write cursor"""
+
+    def __init__(self, capacity: int, columns: Dict[str, Any]):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in columns.items()}
+        self.strings = StringInterner()
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def _next_slot(self) -> int:
+        slot = self.head
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return slot
+
+    def _newest_slots(self, limit: int) -> np.ndarray:
+        """Slot indices of the newest rows, newest first"""
+        limit = min(limit, self.count)
+        return (self.head - 1 - np.arange(limit)) % self.capacity
+
+    def _live_slots(self) -> np.ndarray:
+        return self._newest_slots(self.count)
+
+    def _latest_slots(self, limit: int) -> np.ndarray:
+        """
+        Slot indices of the rows with the latest timestamps, latest first, like
+        the SQL path - late and replayed events arrive out of timestamp order
+        """
+        slots = self._live_slots()
+        order = np.argsort(-self.columns['timestamp'][slots], kind='stable')
+        return slots[order[:limit]]
+
+    def _maybe_compact(self, string_columns: List[str]):
+        """Rebuild the interner once evicted rows leave too many dead strings behind"""
+        if len(self.strings) <= 4 * self.capacity + 1024:
+            return
+
+        fresh = StringInterner()
+        slots = self._live_slots()
+        for name in string_columns:
+            column = self.columns[name]
+            column[slots] = [fresh.intern(self.strings.lookup(code)) for code in column[slots]]
+        self.strings = fresh
+
+
+class ActivityWindow(_RingBuffer):
+    """Ring buffer of the newest user activities"""
+
+    STRING_COLUMNS = ['user_id', 'ip_address', 'user_agent', 'session_id', 'device_fingerprint']
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, {
+            'id': object,
+            'timestamp': np.float64,  # epoch seconds, for ordering and rollups
+            'timestamp_value': object,  # the datetime as stored, returned as is
+            'user_id': np.int32,
+            'action': np.int8,
+            'user_role': np.int8,
+            'success': np.bool_,
+            'failed_attempts': np.int32,
+            'latitude': np.float64,
+            'longitude': np.float64,
+            'ip_address': np.int32,
+            'user_agent': np.int32,
+            'session_id': np.int32,
+            'device_fingerprint': np.int32,
+            'additional_data': object
+        })
+
+    def append(self, activity: Any):
+        """Add one activity (model or record with the same attributes)"""
+        self._maybe_compact(self.STRING_COLUMNS)
+        slot = self._next_slot()
+        c = self.columns
+        location = activity.location or {}
+
+        c['id'][slot] = activity.id
+        c['timestamp'][slot] = activity.timestamp.timestamp()
+        c['timestamp_value'][slot] = activity.timestamp
+        c['action'][slot] = ACTION_CODES.get(enum_value(activity.action), 0)
+        c['user_role'][slot] = ROLE_CODES.get(enum_value(activity.user_role), 0)
+        c['success'][slot] = bool(activity.success)
+        c['failed_attempts'][slot] = activity.failed_attempts
+        c['latitude'][slot] = location.get('latitude', np.nan)
+        c['longitude'][slot] = location.get('longitude', np.nan)
+        c['additional_data'][slot] = activity.additional_data or None
+        for name in self.STRING_COLUMNS:
+            c[name][slot] = self.strings.intern(getattr(activity, name))
+
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """Latest activities first, shaped like UserActivity.dict()"""
+        c = self.columns
+        lookup = self.strings.lookup
+        rows = []
+        for slot in self._latest_slots(limit):
+            latitude = c['latitude'][slot]
+            rows.append({
+                'id': c['id'][slot],
+                'user_id': lookup(c['user_id'][slot]),
+                'action': ACTION_NAMES[c['action'][slot]],
+                'timestamp': c['timestamp_value'][slot],
+                'location': {} if np.isnan(latitude) else {
+                    'latitude': float(latitude), 'longitude': float(c['longitude'][slot])
+                },
+                'ip_address': lookup(c['ip_address'][slot]),
+                'user_agent': lookup(c['user_agent'][slot]),
+                'user_role': ROLE_NAMES[c['user_role'][slot]],
+                'success': bool(c['success'][slot]),
+                'failed_attempts': int(c['failed_attempts'][slot]),
+                'session_id': lookup(c['session_id'][slot]),
+                'device_fingerprint': lookup(c['device_fingerprint'][slot]),
+                'additional_data': c['additional_data'][slot] or {}
+            })
+        return rows
+
+    def rollup(self, since: float) -> Dict[str, Any]:
+        """Aggregate the live window with array operations only"""
+        slots = self._live_slots()
+        c = self.columns
+        slots = slots[c['timestamp'][slots] >= since]
+        if len(slots) == 0:
+            return {'events': 0, 'failure_rate': 0.0, 'action_mix': {}, 'top_users': []}
+
+        action_counts = np.bincount(c['action'][slots], minlength=len(ACTION_NAMES))
+        user_codes, user_counts = np.unique(c['user_id'][slots], return_counts=True)
+        top = np.argsort(user_counts)[::-1][:10]
+
+        return {
+            'events': int(len(slots)),
+            'failure_rate': float(1.0 - c['success'][slots].mean()),
+            'action_mix': {ACTION_NAMES[i]: int(n) for i, n in enumerate(action_counts) if n},
+            'top_users': [
+                {'user_id': self.strings.lookup(user_codes[i]), 'events': int(user_counts[i])}
+                for i in top
+            ]
+        }
+
+
+class AlertWindow(_RingBuffer):
+    """Ring buffer of the newest security alerts"""
+
+    STRING_COLUMNS = ['user_id', 'description', 'status']
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity, {
+            'id': object,
+            'activity_id': object,
+            'user_id': np.int32,
+            'severity': np.int8,
+            'anomaly_score': np.float64,
+            'description': np.int32,
+            'timestamp': np.float64,  # epoch seconds, for ordering and rollups
+            'timestamp_value': object,  # the datetime as stored, returned as is
+            'last_seen': object,
+            'status': np.int32,
+            'investigation_notes': object,
+            'auto_resolved': np.bool_,
+            'false_positive': np.bool_,
+            'related_activities': object,
+            'occurrence_count': np.int32
+        })
+        self.slot_by_id: Dict[str, int] = {}
+
+    def append(self, alert: Any):
+        """Add one alert"""
+        self._maybe_compact(self.STRING_COLUMNS)
+        slot = self._next_slot()
+        self.slot_by_id.pop(self.columns['id'][slot], None)
+        self.slot_by_id[alert.id] = slot
+        self._write(slot, alert)
+
+    def update(self, alert: Any) -> bool:
+        """Overwrite an alert still in the window in place"""
+        slot = self.slot_by_id.get(alert.id)
+        if slot is None:
+            return False
+        self._write(slot, alert)
+        return True
+
+    def _write(self, slot: int, alert: Any):
+        c = self.columns
+
+        c['id'][slot] = alert.id
+        c['activity_id'][slot] = alert.activity_id
+        c['severity'][slot] = SEVERITY_CODES.get(enum_value(alert.severity), 0)
+        c['anomaly_score'][slot] = alert.anomaly_score
+        c['timestamp'][slot] = alert.timestamp.timestamp()
+        c['timestamp_value'][slot] = alert.timestamp
+        c['investigation_notes'][slot] = alert.investigation_notes or ''
+        c['auto_resolved'][slot] = bool(alert.auto_resolved)
+        c['false_positive'][slot] = bool(alert.false_positive)
+        c['related_activities'][slot] = list(alert.related_activities) or None
+        c['occurrence_count'][slot] = getattr(alert, 'occurrence_count', 1)
+        c['last_seen'][slot] = getattr(alert, 'last_seen', None)
+        for name in self.STRING_COLUMNS:
+            c[name][slot] = self.strings.intern(getattr(alert, name))
+
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """Latest alerts first, shaped like Alert.dict()"""
+        c = self.columns
+        lookup = self.strings.lookup
+        return [{
+            'id': c['id'][slot],
+            'activity_id': c['activity_id'][slot],
+            'user_id': lookup(c['user_id'][slot]),
+            'severity': SEVERITY_NAMES[c['severity'][slot]],
+            'anomaly_score': float(c['anomaly_score'][slot]),
+            'description': lookup(c['description'][slot]),
+            'timestamp': c['timestamp_value'][slot],
+            'status': lookup(c['status'][slot]),
+            'investigation_notes': c['investigation_notes'][slot],
+            'auto_resolved': bool(c['auto_resolved'][slot]),
+            'false_positive': bool(c['false_positive'][slot]),
+            'related_activities': list(c['related_activities'][slot] or []),
+            'occurrence_count': int(c['occurrence_count'][slot]),
+            'last_seen': c['last_seen'][slot]
+        } for slot in self._latest_slots(limit)]
+
+    def rollup(self, since: float) -> Dict[str, Any]:
+        """Severity mix and score statistics of recent alerts"""
+        slots = self._live_slots()
+        c = self.columns
+        slots = slots[c['timestamp'][slots] >= since]
+        if len(slots) == 0:
+            return {'alerts': 0, 'severity_mix': {}, 'mean_score': 0.0}
+
+        severity_counts = np.bincount(c['severity'][slots], minlength=len(SEVERITY_NAMES))
+        return {
+            'alerts': int(len(slots)),
+            'severity_mix': {SEVERITY_NAMES[i]: int(n) for i, n in enumerate(severity_counts) if n},
+            'mean_score': float(c['anomaly_score'][slots].mean())
+        }
+
+
+class HotWindow:
+    """
+    In-memory window over the newest activities and alerts.
+    Filled on ingest and warmed from the database at startup; any request for
+    at most `capacity` rows is answered without SQL.
+    """
+
+    def __init__(self, activity_capacity: int = 5000, alert_capacity: int = 2000):
+        self.activities = ActivityWindow(activity_capacity)
+        self.alerts = AlertWindow(alert_capacity)
+        self.is_warm = False
+
+    def warm(self, db_manager) -> None:
+        """Load the newest rows from the database, oldest first"""
+        self.activities = ActivityWindow(self.activities.capacity)
+        self.alerts = AlertWindow(self.alerts.capacity)
+
+        for activity in db_manager.fetch_newest('user_activities', self.activities.capacity):
+            self.activities.append(activity)
+        for alert in db_manager.fetch_newest('alerts', self.alerts.capacity):
+            self.alerts.append(alert)
+
+        self.is_warm = True
+        logger.info(f"🔥 Hot window warmed: {self.activities.count} activities, {self.alerts.count} alerts")
+
+    def add_activity(self, activity: Any):
+        self.activities.append(activity)
+
+    def add_alert(self, alert: Any):
+        self.alerts.append(alert)
+
+    def update_alert(self, alert: Any):
+        self.alerts.update(alert)
+
+    def can_serve_activities(self, limit: int) -> bool:
+        return self.is_warm and limit <= self.activities.capacity
+
+    def can_serve_alerts(self, limit: int) -> bool:
+        return self.is_warm and limit <= self.alerts.capacity
+
+    def recent_activities(self, limit: int) -> List[Dict[str, Any]]:
+        return self.activities.recent(limit)
+
+    def recent_alerts(self, limit: int) -> List[Dict[str, Any]]:
+        return self.alerts.recent(limit)
+
+    def rollup(self, window_minutes: int = 60) -> Dict[str, Any]:
+        """Live analytics over the last window_minutes of in-memory data"""
+        since = datetime.now().timestamp() - window_minutes * 60
+        return {
+            'window_minutes': window_minutes,
+            'activities': self.activities.rollup(since),
+            'alerts': self.alerts.rollup(since)
+        }
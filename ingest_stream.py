@@ -0,0 +1,210 @@
+"""
+Streaming Agent Ingestion for Third Umpire - AI Guard Dog System
+One long-lived WebSocket per agent instead of an HTTP request per event.
+Frames are numbered in arrival order, acknowledged per frame or cumulatively,
+and metered by event credits so a fast agent cannot outrun the pipeline.
+"""
+
+import json
+import zlib
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from metrics import ERRORS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+ACK_MODES = ("message", "window")
+STATUSES = ("logged", "accepted", "duplicate", "invalid", "error")
+MAX_DECOMPRESSED_BYTES = 16 * 1024 * 1024
+POLICY_VIOLATION = 1008  # WebSocket close code
+BACKPRESSURE_POLL = 0.1  # seconds between checks while the pipeline refuses work
+
+
+def decode_frame(message: Dict[str, Any]) -> List[Any]:
+    """
+    Activities carried by one WebSocket message. Text frames hold a JSON array
+    or newline-delimited JSON objects (a single object is one line); binary
+    frames hold zlib-compressed newline-delimited JSON.
+    """
+    if message.get("bytes") is not None:
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(message["bytes"], MAX_DECOMPRESSED_BYTES)
+        except zlib.error as e:
+            raise ValueError(f"Invalid zlib payload: {e}")
+        if inflater.unconsumed_tail:
+            raise ValueError(f"Frame inflates past {MAX_DECOMPRESSED_BYTES} bytes")
+        text = data.decode("utf-8", errors="replace")
+    else:
+        text = message.get("text") or ""
+
+    text = text.strip()
+    try:
+        if text.startswith("["):
+            items = json.loads(text)
+            return items if isinstance(items, list) else [items]
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+
+
+@dataclass
+class Frame:
+    seq: int
+    items: List[Any]
+    cost: int  # credits charged: one per event, at least one per frame
+    error: Optional[str] = None
+    results: List[Dict[str, Any]] = field(default_factory=list)
+
+
+class IngestSession:
+    """
+    Protocol state for one agent connection.
+
+    The server opens with {"type": "ready", "credits": N, "ack": mode}. Each
+    event the agent sends uses one credit - a frame with no events, or one
+    that fails to decode, still uses one - and acks hand credits back as
+    frames are processed; sending past the available credit closes the
+    socket with 1008. Credits therefore also bound the frames queued. In "message" mode every frame gets its own ack with
+    per-event results. In "window" mode one cumulative ack covers every frame
+    processed together - counts, the highest frame seq, and only the events
+    that failed - so ack traffic shrinks as load grows.
+
+    After taking a frame the worker lingers `linger` seconds and coalesces
+    everything that arrived into one call of `process` (up to `max_batch`
+    events), which gives single-event agents the batch storage and scoring
+    path for a few milliseconds of latency. While `backpressure()` is true
+    (the spool is full) the worker holds its batch, and so its credits, back.
+    """
+
+    def __init__(self, websocket: WebSocket,
+                 process: Callable[[List[Any]], Awaitable[List[Dict[str, Any]]]],
+                 credits: int = 5000, ack_mode: str = "window", max_batch: int = 1000,
+                 linger: float = 0.005, backpressure: Optional[Callable[[], bool]] = None):
+        if ack_mode not in ACK_MODES:
+            raise ValueError(f"ack must be one of {', '.join(ACK_MODES)}")
+        self.websocket = websocket
+        self.process = process
+        self.credits = credits
+        self.ack_mode = ack_mode
+        self.max_batch = max_batch
+        self.linger = linger
+        self.backpressure = backpressure
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._seq = 0
+        self._connected = True
+        self.frames = 0
+        self.events = 0
+
+    async def run(self):
+        """Serve the connection until the agent disconnects or breaks flow control"""
+        await self.websocket.accept()
+        await self._send({"type": "ready", "credits": self.credits, "ack": self.ack_mode})
+        worker = asyncio.create_task(self._work())
+        try:
+            await self._receive()
+        finally:
+            # Frames already received are processed even if their acks can no longer be sent
+            self._queue.put_nowait(None)
+            await worker
+
+    async def _receive(self):
+        while True:
+            try:
+                message = await self.websocket.receive()
+            except WebSocketDisconnect:
+                break
+            if message["type"] == "websocket.disconnect":
+                break
+            self._seq += 1
+            try:
+                items = decode_frame(message)
+                frame = Frame(self._seq, items, cost=max(1, len(items)))
+            except ValueError as e:
+                ERRORS_TOTAL.inc(stage='validation')
+                frame = Frame(self._seq, [], cost=1, error=str(e))
+            if frame.cost > self.credits:
+                await self.websocket.close(code=POLICY_VIOLATION, reason="Flow control credit exceeded")
+                break
+            self.credits -= frame.cost
+            self._queue.put_nowait(frame)
+
+    async def _work(self):
+        closing = False
+        while not closing:
+            frame = await self._queue.get()
+            if frame is None:
+                break
+            frames, events = [frame], len(frame.items)
+            if events < self.max_batch and self.linger > 0:
+                await asyncio.sleep(self.linger)
+            while events < self.max_batch and not self._queue.empty():
+                queued = self._queue.get_nowait()
+                if queued is None:
+                    closing = True
+                    break
+                frames.append(queued)
+                events += len(queued.items)
+
+            items = [item for f in frames for item in f.items]
+            while items and self.backpressure is not None and self.backpressure():
+                await asyncio.sleep(BACKPRESSURE_POLL)
+            try:
+                results = await self.process(items) if items else []
+            except Exception as e:
+                logger.error(f"Error processing ingest stream batch: {e}")
+                results = [{"status": "error", "message": str(e)}] * len(items)
+            offset = 0
+            for f in frames:
+                f.results = results[offset:offset + len(f.items)]
+                offset += len(f.items)
+
+            credits = sum(f.cost for f in frames)
+            self.frames += len(frames)
+            self.events += events
+            self.credits += credits
+            if self.ack_mode == "message":
+                for i, f in enumerate(frames):
+                    # All credits of the batch go back with its last ack
+                    await self._send(self._frame_ack(f, credits if i == len(frames) - 1 else 0))
+            else:
+                await self._send(self._window_ack(frames, credits))
+
+    def _frame_ack(self, frame: Frame, credits: int) -> Dict[str, Any]:
+        ack = {"type": "ack", "seq": frame.seq, "credits": credits}
+        if frame.error is not None:
+            return {**ack, "status": "invalid", "message": frame.error}
+        return {**ack, "results": frame.results}
+
+    def _window_ack(self, frames: List[Frame], credits: int) -> Dict[str, Any]:
+        counts = {status: 0 for status in STATUSES}
+        failures = []
+        for frame in frames:
+            if frame.error is not None:
+                failures.append({"seq": frame.seq, "status": "invalid", "message": frame.error})
+                continue
+            for index, result in enumerate(frame.results):
+                counts[result["status"]] += 1
+                if result["status"] in ("invalid", "error"):
+                    failures.append({"seq": frame.seq, "index": index, **result})
+        return {
+            "type": "ack", "seq": frames[-1].seq, "frames": len(frames),
+            **counts, "failures": failures, "credits": credits
+        }
+
+    async def _send(self, message: Dict[str, Any]):
+        if not self._connected:
+            return
+        try:
+            await self.websocket.send_text(json.dumps(message))
+        except Exception as e:
+            # Gone (disconnect, closed transport, reset): unacked events will be re-sent and
+            # caught as duplicates. Never raised, so the worker keeps draining the queue.
+            logger.debug(f"Ingest stream closed before ack: {e!r}")
+            self._connected = False
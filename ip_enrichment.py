@@ -0,0 +1,242 @@
+"""
+IP Enrichment for Third Umpire - AI Guard Dog System
+Resolves IP addresses offline against local data files: a GeoIP range table
+searched with binary search, and CIDR reputation lists held in a radix trie.
+"""
+
+import csv
+import bisect
+import logging
+import ipaddress
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Risk contributed by each reputation list; negative values mark trusted ranges,
+# which the trusted_network rule credits back against the behavioral score
+LABEL_RISK = {
+    'tor_exit': 0.4,
+    'blocklist': 0.6,
+    'corporate': -0.2
+}
+
+
+def _parse_ip(value: str) -> Tuple[int, int]:
+    """Return (version, integer) for a dotted/colon address or a plain integer"""
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number < 2 ** 32 else 6), number
+    address = ipaddress.ip_address(value)
+    return address.version, int(address)
+
+
+class GeoIPTable:
+    """
+    Sorted, non-overlapping IP ranges with coordinates.
+    IPv4 ranges live in NumPy uint32 arrays searched with np.searchsorted;
+    the (much rarer) IPv6 ranges use plain sorted lists and bisect.
+    """
+
+    def __init__(self):
+        self.v4_start = np.zeros(0, dtype=np.uint32)
+        self.v4_end = np.zeros(0, dtype=np.uint32)
+        self.v4_rows = np.zeros(0, dtype=np.int32)
+        self.v6_start: List[int] = []
+        self.v6_end: List[int] = []
+        self.v6_rows: List[int] = []
+        self.latitude = np.zeros(0, dtype=np.float32)
+        self.longitude = np.zeros(0, dtype=np.float32)
+        self.countries: List[str] = []
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'GeoIPTable':
+        """Load rows of start_ip,end_ip,latitude,longitude[,country]; malformed rows are skipped"""
+        table = cls()
+        v4, v6, latitude, longitude = [], [], [], []
+        skipped, first_error = 0, None
+
+        with open(path, newline='') as handle:
+            reader = csv.DictReader(handle)
+            for row in reader:
+                try:
+                    version, start = _parse_ip(row['start_ip'])
+                    _, end = _parse_ip(row['end_ip'])
+                    row_latitude, row_longitude = float(row['latitude']), float(row['longitude'])
+                except (KeyError, TypeError, ValueError, AttributeError) as e:
+                    skipped += 1
+                    first_error = first_error or f"line {reader.line_num}: {e!r}"
+                    continue
+                index = len(latitude)
+                latitude.append(row_latitude)
+                longitude.append(row_longitude)
+                table.countries.append(row.get('country') or '')
+                (v4 if version == 4 else v6).append((start, end, index))
+
+        if skipped:
+            logger.warning(f"GeoIP table {path}: skipped {skipped} malformed rows (first at {first_error})")
+
+        v4.sort()
+        v6.sort()
+        table.v4_start = np.array([r[0] for r in v4], dtype=np.uint32)
+        table.v4_end = np.array([r[1] for r in v4], dtype=np.uint32)
+        table.v4_rows = np.array([r[2] for r in v4], dtype=np.int32)
+        table.v6_start = [r[0] for r in v6]
+        table.v6_end = [r[1] for r in v6]
+        table.v6_rows = [r[2] for r in v6]
+        table.latitude = np.array(latitude, dtype=np.float32)
+        table.longitude = np.array(longitude, dtype=np.float32)
+        return table
+
+    def lookup(self, version: int, number: int) -> Optional[Dict[str, Any]]:
+        """Find the range containing an address"""
+        if version == 4:
+            index = int(np.searchsorted(self.v4_start, number, side='right')) - 1
+            if index < 0 or number > self.v4_end[index]:
+                return None
+            row = int(self.v4_rows[index])
+        else:
+            index = bisect.bisect_right(self.v6_start, number) - 1
+            if index < 0 or number > self.v6_end[index]:
+                return None
+            row = self.v6_rows[index]
+
+        return {
+            'latitude': float(self.latitude[row]),
+            'longitude': float(self.longitude[row]),
+            'country': self.countries[row]
+        }
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+
+class CIDRTrie:
+    """
+    Binary radix trie for longest-prefix CIDR matching.
+    Nodes are stored in flat lists (children and labels by node index) rather than objects.
+    """
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.children: List[List[int]] = [[-1, -1]]
+        self.labels: List[Optional[str]] = [None]
+
+    def insert(self, network: int, prefix_length: int, label: str):
+        node = 0
+        for depth in range(prefix_length):
+            bit = (network >> (self.bits - 1 - depth)) & 1
+            child = self.children[node][bit]
+            if child == -1:
+                child = len(self.labels)
+                self.children.append([-1, -1])
+                self.labels.append(None)
+                self.children[node][bit] = child
+            node = child
+        self.labels[node] = label
+
+    def match(self, address: int) -> Optional[str]:
+        """Label of the most specific prefix containing address"""
+        node = 0
+        found = self.labels[0]
+        for depth in range(self.bits):
+            node = self.children[node][(address >> (self.bits - 1 - depth)) & 1]
+            if node == -1:
+                break
+            if self.labels[node] is not None:
+                found = self.labels[node]
+        return found
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+class IPEnricher:
+    """
+    Offline IP enrichment stage run before scoring.
+    Estimates missing locations from the GeoIP table (kept apart from the
+    reported location) and attaches reputation labels and risk; recent results are kept in an LRU cache.
+    """
+
+    def __init__(self, geoip_path: str = "data/geoip.csv", lists_dir: str = "data/ip_lists",
+                 cache_size: int = 65536):
+        self.geoip = GeoIPTable()
+        self.tries = {4: CIDRTrie(32), 6: CIDRTrie(128)}
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.load(geoip_path, lists_dir)
+
+    def load(self, geoip_path: str, lists_dir: str):
+        """(Re)load the local data files; missing files leave that part empty"""
+        if Path(geoip_path).exists():
+            self.geoip = GeoIPTable.from_csv(geoip_path)
+        else:
+            logger.warning(f"GeoIP table not found at {geoip_path} - locations will not be enriched")
+
+        tries = {4: CIDRTrie(32), 6: CIDRTrie(128)}
+        lists_path = Path(lists_dir)
+        if lists_path.is_dir():
+            # One file per label, e.g. tor_exit.txt, blocklist.txt, corporate.txt
+            for list_file in sorted(lists_path.glob("*.txt")):
+                label = list_file.stem
+                skipped, first_error = 0, None
+                for line_number, line in enumerate(list_file.read_text().splitlines(), 1):
+                    line = line.split('#', 1)[0].strip()
+                    if not line:
+                        continue
+                    try:
+                        network = ipaddress.ip_network(line, strict=False)
+                    except ValueError as e:
+                        skipped += 1
+                        first_error = first_error or f"line {line_number}: {e}"
+                        continue
+                    tries[network.version].insert(int(network.network_address), network.prefixlen, label)
+                if skipped:
+                    logger.warning(f"IP list {list_file.name}: skipped {skipped} malformed entries "
+                                   f"(first at {first_error})")
+        self.tries = tries
+        self._cache.clear()
+
+        logger.info(f"🌐 IP enrichment loaded: {len(self.geoip)} GeoIP ranges, "
+                    f"{len(self.tries[4]) + len(self.tries[6])} CIDR trie nodes")
+
+    def lookup(self, ip_address: str) -> Dict[str, Any]:
+        """Resolve one address (cached)"""
+        cached = self._cache.get(ip_address)
+        if cached is not None:
+            self._cache.move_to_end(ip_address)
+            return cached
+
+        try:
+            version, number = _parse_ip(ip_address)
+        except ValueError:
+            info = {'geo': None, 'label': None, 'risk': 0.0, 'trusted': False}
+        else:
+            label = self.tries[version].match(number)
+            risk = LABEL_RISK.get(label, 0.0)
+            info = {
+                'geo': self.geoip.lookup(version, number),
+                'label': label,
+                'risk': risk,  # negative for trusted ranges
+                'trusted': risk < 0
+            }
+
+        self._cache[ip_address] = info
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return info
+
+    def enrich(self, activity: Any) -> Dict[str, Any]:
+        """Attach IP info to an activity record, and a GeoIP location when none was sent"""
+        info = self.lookup(activity.ip_address)
+        activity.ip_info = info
+        if not activity.location and info['geo'] is not None:
+            activity.geo_location = {
+                'latitude': info['geo']['latitude'],
+                'longitude': info['geo']['longitude']
+            }
+        return info
@@ -0,0 +1,142 @@
+"""
+Logging Pipeline for Third Umpire - AI Guard Dog System
+Log records are sampled and enqueued on the calling thread, then formatted as
+JSON and written by a background listener thread, so the event loop never
+waits on formatting or disk I/O and per-event logging has a bounded cost.
+"""
+
+import sys
+import copy
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+from metrics import REGISTRY
+
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    'third_umpire_log_records_dropped_total', 'Log records not written, by reason', ('reason',)
+)
+
+# LogRecord attributes that are not user-supplied extras
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'sampled', 'fields'}
+
+
+def sampled_event(**fields) -> Dict[str, Any]:
+    """extra= for a per-event log line: subject to sampling below WARNING"""
+    return {'sampled': True, 'fields': fields}
+
+
+def with_fields(**fields) -> Dict[str, Any]:
+    """extra= for a log line with structured fields, never sampled"""
+    return {'fields': fields}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the structured fields inlined"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        if getattr(record, 'sample_rate', None) is not None:
+            entry['sample_rate'] = record.sample_rate
+        entry.update(getattr(record, 'fields', None) or {})
+        for key, value in vars(record).items():
+            if key not in _RESERVED and key != 'sample_rate':
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a `rate` share of per-event records below WARNING - those logged with
+    extra=sampled_event(...) or by a per-request logger such as uvicorn.access -
+    and tags kept ones with the rate so counts can be re-weighted.
+    Warnings, errors and other records always pass.
+    """
+
+    def __init__(self, rate: float = 0.01, sampled_loggers=('uvicorn.access',)):
+        super().__init__()
+        self.rate = rate
+        self.sampled_loggers = frozenset(sampled_loggers)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if not getattr(record, 'sampled', False) and record.name not in self.sampled_loggers:
+            return True
+        if random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        LOG_RECORDS_DROPPED.inc(reason='sampled')
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues without formatting (the listener formats) and never blocks:
+    when the queue is full the record is dropped and counted.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason='queue_full')
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", sample_rate: float = 0.01, log_format: str = "json",
+                  queue_size: int = 10000, stream=None) -> logging.handlers.QueueListener:
+    """Route all logging through the queue; replaces any handlers on the root logger"""
+    global _listener
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -3,30 +3,252 @@ Third Umpire - AI Guard Dog System
 Main application entry point for the AI-driven security monitoring system.
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Response, Depends, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
+from pydantic import ValidationError
+from contextlib import asynccontextmanager, contextmanager
 import uvicorn
 import asyncio
+import hmac
 import json
-from datetime import datetime
-from typing import List, Dict, Any
+import os
+import time
+import sqlite3
+import multiprocessing
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
 import logging
+from pathlib import Path
 
 from ai_engine import AnomalyDetector
-from models import UserActivity, Alert, SecurityEvent
+from models import UserActivity, ActivityRecord, Alert, SecurityEvent, SystemHealth, ROLE_CODES
 from database import DatabaseManager
 from websocket_manager import ConnectionManager
+from analytics_engine import HistoricalAnalytics, SnapshotBusyError
+from data_export import stream_export, EXPORT_FORMATS
+from hot_window import HotWindow
+from ip_enrichment import IPEnricher
+from sketches import TrafficSketches, write_checkpoint
+from novelty import NoveltyTracker
+from alert_aggregator import AlertAggregator
+from cep import SequenceMatcher
+from peer_groups import PeerGroupIndex, run_peer_grouping
+from thresholds import AdaptiveThresholds
+from metrics import (
+    REGISTRY, STAGE_SECONDS, ACTIVITIES_TOTAL, ERRORS_TOTAL, ALERTS_TOTAL, DUPLICATES_TOTAL,
+    SPOOLED_TOTAL, HealthSampler, uptime_seconds
+)
+from log_pipeline import setup_logging, with_fields
+from profiling import SamplingProfiler, MemoryProfiler, Tracer, ProfilerBusyError
+from backfill import BackfillProgress, run_backfill
+from drift import FeatureDriftMonitor, retrain_from_recent
+from dedup import RecentIdFilter
+from spool import Spool, SpoolFullError
+from ingest_stream import IngestSession, ACK_MODES, STATUSES as INGEST_STATUSES
+from concurrent.futures import ProcessPoolExecutor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging: JSON lines written by a background thread, per-event logs sampled
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "0.01")),
+    log_format=os.getenv("LOG_FORMAT", "json")
+)
 logger = logging.getLogger(__name__)
 
+# Detector engine for this deployment, plus per-tenant overrides ("tenant=engine,...")
+DETECTOR_ENGINE = os.getenv("DETECTOR_ENGINE", "isolation_forest")
+DETECTOR_TENANT_ENGINES = dict(
+    item.split("=", 1) for item in os.getenv("DETECTOR_TENANT_ENGINES", "").split(",") if "=" in item
+)
+
 # Initialize components
 db_manager = DatabaseManager()
-anomaly_detector = AnomalyDetector()
+anomaly_detector = AnomalyDetector(engine=DETECTOR_ENGINE, tenant_engines=DETECTOR_TENANT_ENGINES)
+REGISTRY.gauge(
+    'third_umpire_travel_users_tracked', 'Users whose last location the impossible-travel check holds',
+    function=lambda: len(anomaly_detector.travel_detector.user_slots)
+)
 websocket_manager = ConnectionManager()
+historical_analytics = HistoricalAnalytics(db_path=db_manager.db_path)
+hot_window = HotWindow(activity_capacity=5000, alert_capacity=2000)
+ip_enricher = IPEnricher(geoip_path="data/geoip.csv", lists_dir="data/ip_lists")
+traffic_sketches = TrafficSketches()
+anomaly_detector.novelty_tracker = NoveltyTracker(db_manager, max_users=100000)
+alert_aggregator = AlertAggregator(window_seconds=300)
+sequence_matcher = SequenceMatcher()
+peer_index = PeerGroupIndex()
+anomaly_detector.peer_index = peer_index
+# Activity ids ingested recently, so retried posts are not stored or scored twice
+recent_ids = RecentIdFilter(window_seconds=float(os.getenv("DEDUP_WINDOW_SECONDS", "600")))
+# Ingest path: "sync" stores and scores before answering and falls back to the spool while the
+# database is locked; "spool" answers once the event is fsynced and processes it in the background
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+ingest_spool = Spool(
+    directory=os.getenv("SPOOL_DIR", "spool"),
+    flush_interval=float(os.getenv("SPOOL_FLUSH_MS", "2")) / 1000,
+    # Past this backlog ingest answers 503 (agent streams get no credits) instead of filling the disk
+    max_backlog_bytes=int(float(os.getenv("SPOOL_MAX_BACKLOG_MB", "1024")) * 1024 * 1024)
+)
+# Ids between storage and a finished score, so a concurrent re-send is not scored twice
+scoring_in_progress: set = set()
+# Live feature distributions vs. the training data; drift past the threshold triggers a retrain
+drift_monitor = FeatureDriftMonitor(psi_threshold=float(os.getenv("DRIFT_PSI_THRESHOLD", "0.25")))
+anomaly_detector.drift_monitor = drift_monitor
+# Alert cutoffs follow the live score distribution; set ALERT_TARGET_PER_HOUR to budget by volume instead
+alert_thresholds = AdaptiveThresholds(
+    target_percentile=float(os.getenv("ALERT_TARGET_PERCENTILE", "0.99")),
+    target_alerts_per_hour=float(os.environ["ALERT_TARGET_PER_HOUR"]) if os.getenv("ALERT_TARGET_PER_HOUR") else None
+)
+# Diagnostics: admin endpoints are disabled unless ADMIN_TOKEN is set
+cpu_profiler = SamplingProfiler()
+memory_profiler = MemoryProfiler()
+tracer = Tracer(sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0")))
+# Heavy background jobs (clustering, retraining) run here, never in the event loop process.
+# Spawned rather than forked, so the worker does not inherit locks held by our threads
+job_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+# Latest re-scoring run started from the admin API (it manages its own worker processes)
+backfill_progress: Optional[BackfillProgress] = None
+backfill_task: Optional[asyncio.Task] = None
+
+SKETCH_CHECKPOINT_PATH = "traffic_sketches.npz"
+STATS_BROADCAST_INTERVAL = 10  # seconds
+SKETCH_CHECKPOINT_INTERVAL = 60  # seconds
+ALERT_FLUSH_INTERVAL = 2  # seconds
+PEER_GROUP_INTERVAL = 6 * 3600  # seconds
+DRIFT_CHECK_INTERVAL = 60  # seconds
+MAX_BULK_ACTIVITIES = 1000
+INGEST_STREAM_CREDITS = int(os.getenv("INGEST_STREAM_CREDITS", "5000"))  # events in flight per agent socket
+SPOOL_BUSY_TIMEOUT = 0.1  # seconds an ingest write waits on a database lock before spooling instead
+SPOOL_DRAIN_SHUTDOWN_TIMEOUT = 30  # seconds
+SPOOL_FULL_RETRY_AFTER = 5  # seconds, suggested to clients turned away by a full spool
+
+def _restore_sketches():
+    """Load the sketch checkpoint, or seed the distinct-user counter from the database once"""
+    global traffic_sketches
+    if Path(SKETCH_CHECKPOINT_PATH).exists():
+        traffic_sketches = TrafficSketches.load(SKETCH_CHECKPOINT_PATH)
+    else:
+        for user_id in db_manager.iter_user_ids():
+            traffic_sketches.all_users.add(user_id)
+    db_manager.traffic_sketches = traffic_sketches
+
+async def alert_flush_loop():
+    """Persist and broadcast folded alert updates in throttled batches"""
+    while True:
+        try:
+            await asyncio.sleep(ALERT_FLUSH_INTERVAL)
+            with db_manager.busy_timeout(SPOOL_BUSY_TIMEOUT):
+                db_manager.flush_scored()  # kept for the next tick while the database is locked
+            if backfill_task is not None and not backfill_task.done():
+                # A backfill is rewriting alert scores; hold folded updates until they are reconciled
+                continue
+            updated = alert_aggregator.drain_dirty()
+            alert_aggregator.expire()
+            sequence_matcher.expire()
+            if not updated:
+                continue
+
+            await db_manager.update_alerts(updated)
+            for alert in updated:
+                hot_window.update_alert(alert)
+            await websocket_manager.broadcast_custom_event(
+                'alert_update', {'alerts': [alert.dict() for alert in updated]}
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing alert updates: {e}")
+
+async def run_peer_group_job() -> Dict[str, Any]:
+    """Cluster users in the job process, then refresh the in-memory drift lookup"""
+    params = anomaly_detector.dbscan.get_params()
+    result = await asyncio.get_running_loop().run_in_executor(
+        job_executor, run_peer_grouping, db_manager.db_path, params['eps'], params['min_samples']
+    )
+    peer_index.load(db_manager)
+    return result
+
+async def peer_group_loop():
+    """Re-cluster user behavior on a schedule"""
+    while True:
+        try:
+            await asyncio.sleep(PEER_GROUP_INTERVAL)
+            await run_peer_group_job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in peer grouping job: {e}")
+
+async def run_retrain_job(reason: str) -> Dict[str, Any]:
+    """Fit new detectors on recent traffic in the job process, then swap them in"""
+    drift_monitor.retraining = True
+    try:
+        drifted = drift_monitor.drifted_features()
+        engines = sorted({anomaly_detector.engine, *anomaly_detector.tenant_engines.values()})
+        result = await asyncio.get_running_loop().run_in_executor(
+            job_executor, retrain_from_recent, db_manager.db_path, engines, anomaly_detector.contamination
+        )
+        if 'skipped' not in result:
+            anomaly_detector.swap_detectors(result.pop('detectors'), result.pop('features'))
+            result['model_version'] = anomaly_detector.model_version
+        result.update(reason=reason, drifted_features=drifted)
+        drift_monitor.record_retrain(result)
+        logger.info(f"🔄 Retrain finished: {result}")
+        return result
+    finally:
+        drift_monitor.retraining = False
+
+async def drift_loop():
+    """Retrain when live features have drifted from the training data"""
+    while True:
+        try:
+            await asyncio.sleep(DRIFT_CHECK_INTERVAL)
+            if anomaly_detector.is_trained and drift_monitor.should_retrain():
+                await run_retrain_job("drift")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in drift retraining: {e}")
+
+async def stats_loop():
+    """Sample health, push live stats to dashboards and checkpoint the sketches periodically"""
+    last_checkpoint = datetime.now()
+    while True:
+        try:
+            await asyncio.sleep(STATS_BROADCAST_INTERVAL)
+            health_sampler.sample()  # /api/health serves the latest sample
+            if websocket_manager.get_connection_count():
+                stats = (await db_manager.get_dashboard_stats()).dict()
+                stats['traffic'] = traffic_sketches.summary(hours=1)
+                await websocket_manager.broadcast_stats(stats)
+
+            if (datetime.now() - last_checkpoint).total_seconds() >= SKETCH_CHECKPOINT_INTERVAL:
+                # Copy on the loop (observe() mutates the sketches there), compress and write in a thread
+                await asyncio.to_thread(write_checkpoint, SKETCH_CHECKPOINT_PATH, traffic_sketches.snapshot())
+                await anomaly_detector.novelty_tracker.flush_async()
+                last_checkpoint = datetime.now()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in stats loop: {e}")
+
+# Readiness: the server is live as soon as it binds, ready once warm-up has finished
+startup_state: Dict[str, Any] = {"ready": False, "ready_at": None, "error": None}
+
+async def warm_up():
+    """Load the heavy ML stack and train in the background, then report ready"""
+    try:
+        await anomaly_detector.ensure_trained()
+        startup_state["ready"] = True
+        startup_state["ready_at"] = datetime.now()
+        logger.info(f"✅ System ready ({uptime_seconds():.2f}s after start)")
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error(f"Warm-up failed: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -35,13 +257,45 @@ async def lifespan(app: FastAPI):
     
     # Initialize database
     await db_manager.init_db()
+    # Events acknowledged before the last shutdown or crash are replayed by the drain
+    await ingest_spool.open()
     
-    # Train the anomaly detection model with sample data
-    await anomaly_detector.train_model()
+    # Load the newest rows so live reads are served from memory
+    hot_window.warm(db_manager)
+    _restore_sketches()
+    peer_index.load(db_manager)
+    
+    # Train the anomaly detection model without holding up the server; /api/health/ready gates traffic
+    warm_up_task = asyncio.create_task(warm_up())
+    stats_task = asyncio.create_task(stats_loop())
+    alert_flush_task = asyncio.create_task(alert_flush_loop())
+    peer_group_task = asyncio.create_task(peer_group_loop())
+    drift_task = asyncio.create_task(drift_loop())
+    spool_drain_task = asyncio.create_task(ingest_spool.drain(_drain_spooled, retryable=_drain_retryable))
     
     logger.info("✅ System initialized successfully!")
     yield
     # Cleanup code here if needed
+    # Let the drain finish and checkpoint its batch, so nothing is left stored but unscored
+    ingest_spool.stop_drain()
+    try:
+        await asyncio.wait_for(spool_drain_task, timeout=SPOOL_DRAIN_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Spool drain did not finish in time; its batch is replayed on the next start")
+    warm_up_task.cancel()
+    stats_task.cancel()
+    alert_flush_task.cancel()
+    peer_group_task.cancel()
+    drift_task.cancel()
+    await ingest_spool.close()
+    job_executor.shutdown(wait=False, cancel_futures=True)
+    if backfill_progress is not None:
+        backfill_progress.cancel_event.set()  # checkpointed; resume=true picks it up again
+    await db_manager.update_alerts(alert_aggregator.drain_dirty())
+    db_manager.flush_scored()
+    traffic_sketches.checkpoint(SKETCH_CHECKPOINT_PATH)
+    anomaly_detector.novelty_tracker.flush()
+    historical_analytics.close()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -70,76 +324,655 @@ async def root():
         "timestamp": datetime.now().isoformat()
     }
 
+health_sampler = HealthSampler()
+
+def _database_status() -> str:
+    try:
+        db_manager.connection.execute("SELECT 1").fetchone()
+        return "healthy"
+    except Exception as e:
+        logger.error(f"Database health check failed: {e}")
+        return "unhealthy"
+
 @app.get("/api/health")
 async def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "anomaly_detector": "operational",
-        "database": "connected",
-        "websockets": "active"
+    """Live system health from the pipeline metrics"""
+    return SystemHealth(
+        ai_engine_status="healthy" if anomaly_detector.is_trained else "training",
+        database_status=_database_status(),
+        websocket_status="healthy",
+        active_connections=websocket_manager.get_connection_count(),
+        uptime_seconds=uptime_seconds(),
+        **health_sampler.latest
+    ).dict()
+
+@app.get("/api/health/live")
+async def liveness():
+    """Liveness probe: the process is up and the event loop is responsive"""
+    return {"status": "alive", "uptime_seconds": uptime_seconds()}
+
+@app.get("/api/health/ready")
+async def readiness():
+    """Readiness probe: 503 until the detector is trained and the database answers"""
+    checks = {
+        "anomaly_detector": anomaly_detector.is_trained,
+        "database": _database_status() == "healthy"
+    }
+    body = {
+        "ready": all(checks.values()),
+        "checks": checks,
+        "ready_at": startup_state["ready_at"].isoformat() if startup_state["ready_at"] else None,
+        "error": startup_state["error"]
     }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Pipeline metrics in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@contextmanager
+def _stage(name: str):
+    """Time one pipeline stage into the metrics and the current trace, if any"""
+    with STAGE_SECONDS.time(stage=name), tracer.span(name):
+        yield
+
+# Ingest routes whose rejected bodies count as validation errors
+INGEST_PATHS = {"/api/activities", "/api/activities/bulk"}
+
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    """Count rejected ingest bodies, then answer with FastAPI's usual 422"""
+    if request.url.path in INGEST_PATHS:
+        ERRORS_TOTAL.inc(stage='validation')
+    return await request_validation_exception_handler(request, exc)
+
+@app.exception_handler(SpoolFullError)
+async def spool_full_handler(request: Request, exc: SpoolFullError):
+    """Shed ingest load while the spool backlog is at its limit; nothing was accepted"""
+    ERRORS_TOTAL.inc(stage='spool_full')
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(SPOOL_FULL_RETRY_AFTER)})
+
+async def _start_validation_timer(request: Request):
+    """Route dependency: FastAPI resolves it just before validating the body"""
+    request.state.validation_started = time.perf_counter()
 
-@app.post("/api/activities")
-async def log_activity(activity: UserActivity):
+@app.post("/api/activities", dependencies=[Depends(_start_validation_timer)])
+async def log_activity(activity: UserActivity, request: Request, response: Response):
     """Log user activity for monitoring"""
+    STAGE_SECONDS.observe(time.perf_counter() - request.state.validation_started, stage='validation')
+    ACTIVITIES_TOTAL.inc()
+    with tracer.trace("log_activity", force=request.headers.get("x-trace") == "1") as trace:
+        if trace is not None:
+            response.headers["X-Trace-Id"] = trace.id
+        return await _process_activity(ActivityRecord.from_activity(activity))
+
+def _duplicate_response(record: ActivityRecord) -> Dict[str, Any]:
+    return {"status": "duplicate", "duplicate": True, "activity_id": record.id}
+
+def _database_busy(error: sqlite3.OperationalError) -> bool:
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+def _drain_retryable(error: Exception) -> bool:
+    """A locked database only delays the drain; anything else counts towards dead-lettering"""
+    return isinstance(error, sqlite3.OperationalError) and _database_busy(error)
+
+async def _spool_activities(records: List[ActivityRecord], reason: str) -> List[Dict[str, Any]]:
+    """Append to the spool and acknowledge once fsynced; the drain stores and scores them later"""
+    with _stage('spool_append'):
+        await ingest_spool.append([
+            json.dumps(record.to_dict(), default=datetime.isoformat).encode() for record in records
+        ])
+    SPOOLED_TOTAL.inc(len(records), reason=reason)
+    return [{"status": "accepted", "duplicate": False, "activity_id": record.id} for record in records]
+
+async def _drain_spooled(payloads: List[bytes]):
+    """Spool drain handler: store and score a batch of acknowledged events (raising retries it)"""
+    records = [ActivityRecord.from_dict(json.loads(payload)) for payload in payloads]
+    started = time.perf_counter()
+    results = await _store_and_score(records)
+    failed = [record.id for record, result in zip(records, results) if result["status"] == "error"]
+    if failed:
+        # The client already has "accepted" and will not re-send: retry the batch (the scored
+        # records come back as duplicates, the stored-but-unscored ones are scored again)
+        raise RuntimeError(f"{len(failed)} spooled activities were not scored, first {failed[0]}")
+    per_event = (time.perf_counter() - started) / len(records)
+    for _ in records:
+        STAGE_SECONDS.observe(per_event, stage='spool_drain')
+
+async def _process_activity(record: ActivityRecord) -> Dict[str, Any]:
+    """Run one validated activity through storage, scoring, alerting and pattern matching"""
+    started = time.perf_counter()
     try:
-        # Store activity in database
-        await db_manager.store_activity(activity)
+        # Agent retries: answered from memory when recent, by the database's unique id otherwise
+        if recent_ids.seen(record.id):
+            DUPLICATES_TOTAL.inc(source='filter')
+            return _duplicate_response(record)
+        if INGEST_MODE == "spool":
+            return (await _spool_activities([record], reason='mode'))[0]
+        if ingest_spool.has_backlog():
+            # Queue behind what is already spooled: keeps event order and leaves the database to the drain
+            return (await _spool_activities([record], reason='backlog'))[0]
         
-        # Analyze for anomalies
-        anomaly_score = await anomaly_detector.detect_anomaly(activity)
+        # Resolve the IP offline: a GeoIP estimate for a missing location and reputation features
+        with _stage('enrichment'):
+            ip_enricher.enrich(record)
         
-        # If anomaly detected, create alert
-        if anomaly_score > 0.7:  # Threshold for suspicious activity
-            alert = Alert(
-                activity_id=activity.id,
-                user_id=activity.user_id,
-                severity="high" if anomaly_score > 0.9 else "medium",
-                anomaly_score=anomaly_score,
-                description=f"Suspicious activity detected: {activity.action}",
-                timestamp=datetime.now()
-            )
-            
-            await db_manager.store_alert(alert)
-            
-            # Broadcast alert to connected clients
-            await websocket_manager.broadcast_alert(alert.dict())
-            
-            logger.warning(f"🚨 Alert generated: {alert.description}")
+        # Store activity in database; while it is locked, acknowledge from the spool instead of waiting
+        try:
+            with _stage('store_activity'), db_manager.busy_timeout(SPOOL_BUSY_TIMEOUT):
+                stored = await db_manager.store_activity(record)
+        except sqlite3.OperationalError as e:
+            if not _database_busy(e):
+                raise
+            return (await _spool_activities([record], reason='db_busy'))[0]
+        if not stored and (record.id in scoring_in_progress or not db_manager.unscored([record.id])):
+            recent_ids.add(record.id)
+            DUPLICATES_TOTAL.inc(source='database')
+            return _duplicate_response(record)
+        # New, or stored earlier but never scored (crash, cancelled drain, scoring error): score it now
         
-        return {
-            "status": "logged",
-            "anomaly_score": anomaly_score,
-            "alert_generated": anomaly_score > 0.7
-        }
+        result = await _score_activity(record)
+        # Only now is a retry a duplicate; until here it must reach the unscored check above
+        recent_ids.add(record.id)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='pipeline')
+        return result
         
+    except SpoolFullError:
+        raise
     except Exception as e:
+        ERRORS_TOTAL.inc(stage='pipeline')
         logger.error(f"Error logging activity: {e}")
         return {"status": "error", "message": str(e)}
 
+async def _score_activity(record: ActivityRecord, anomaly_score: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Everything after storage: live views, scoring, alerting and pattern matching.
+    Batch callers pass the score they already computed. The activity is marked
+    scored only if this completes.
+    """
+    scoring_in_progress.add(record.id)
+    try:
+        result = await _score_stored_activity(record, anomaly_score)
+    finally:
+        scoring_in_progress.discard(record.id)
+    db_manager.mark_scored([record.id])
+    return result
+
+async def _score_stored_activity(record: ActivityRecord, anomaly_score: Optional[float]) -> Dict[str, Any]:
+    hot_window.add_activity(record)
+    traffic_sketches.observe(record)
+    
+    # Analyze for anomalies
+    if anomaly_score is None:
+        with tracer.span('anomaly_detection'):
+            anomaly_score = await anomaly_detector.detect_anomaly(record)
+    
+    # If anomaly detected, create or extend an alert
+    alert = None
+    severity = alert_thresholds.evaluate(record.user_id, record.user_role, anomaly_score)
+    if severity is not None:
+        alert, is_new = alert_aggregator.offer(
+            record,
+            anomaly_score,
+            severity=severity,
+            rule=record.action,
+            description=f"Suspicious activity detected: {record.action}"
+        )
+        
+        # Repeats fold into the open alert and go out with the next batched flush
+        if is_new:
+            ALERTS_TOTAL.inc(severity=severity)
+            with _stage('store_alert'):
+                await db_manager.store_alert(alert)
+            hot_window.add_alert(alert)
+            
+            # Broadcast alert to connected clients
+            with _stage('broadcast_alert'):
+                await websocket_manager.broadcast_alert(alert.dict())
+            
+            logger.warning(f"🚨 Alert generated: {alert.description}", extra=with_fields(
+                alert_id=alert.id, user_id=record.user_id, severity=severity, anomaly_score=anomaly_score
+            ))
+    
+    # Advance multi-stage attack patterns; completed ones become security events
+    with tracer.span('sequence_matching'):
+        for event in sequence_matcher.process(record, alert.id if alert else None):
+            await db_manager.store_security_event(event)
+            await websocket_manager.broadcast_custom_event('security_event', event.dict())
+    
+    return {
+        "status": "logged",
+        "duplicate": False,
+        "anomaly_score": anomaly_score,
+        "alert_generated": severity is not None
+    }
+
+async def _store_and_score(records: List[ActivityRecord]) -> List[Dict[str, Any]]:
+    """
+    Store validated activities in one transaction, then score them with one model
+    call and alert per event, in order. Raises if the batch could not be stored.
+    """
+    with _stage('enrichment'):
+        for record in records:
+            ip_enricher.enrich(record)
+    with _stage('store_activity'), db_manager.busy_timeout(SPOOL_BUSY_TIMEOUT):
+        stored = await db_manager.store_activities(records)
+    
+    # Already stored but never scored: score the first copy instead of calling it a duplicate
+    unscored = set()
+    duplicates = [record.id for record, is_new in zip(records, stored) if not is_new]
+    if duplicates:
+        inserted = {record.id for record, is_new in zip(records, stored) if is_new}
+        unscored = db_manager.unscored(duplicates) - inserted - scoring_in_progress
+    
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    new = []
+    for i, (record, is_new) in enumerate(zip(records, stored)):
+        if is_new or record.id in unscored:
+            unscored.discard(record.id)
+            new.append((i, record))
+        else:
+            # Already in the database, or repeated earlier in this batch
+            recent_ids.add(record.id)
+            DUPLICATES_TOTAL.inc(source='database')
+            results[i] = _duplicate_response(record)
+    
+    # One model call for the batch; alerting still runs per event, in order
+    scores = await anomaly_detector.detect_anomalies([record for _, record in new]) if new else []
+    for (i, record), score in zip(new, scores):
+        try:
+            results[i] = await _score_activity(record, float(score))
+            recent_ids.add(record.id)  # a retry after a failure below is scored, not filtered
+        except Exception as e:
+            ERRORS_TOTAL.inc(stage='pipeline')
+            logger.error(f"Error logging activity: {e}")
+            results[i] = {"status": "error", "message": str(e)}
+    return results
+
+@app.post("/api/activities/bulk")
+async def log_activities_bulk(
+        items: List[Dict[str, Any]] = Body(..., description="Activities, each as for POST /api/activities")):
+    """
+    Log a JSON array of activities, stored in one transaction. Results come back
+    in input order; invalid items and duplicates do not fail the rest of the batch.
+    """
+    # Only the array shape is checked up front; each item is validated on its own below
+    if len(items) > MAX_BULK_ACTIVITIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ACTIVITIES} activities per request")
+    
+    results = await _ingest_items(items)
+    counts = {status: 0 for status in INGEST_STATUSES}
+    for result in results:
+        counts[result["status"]] += 1
+    return {"received": len(items), **counts, "results": results}
+
+async def _ingest_items(items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Validate raw activity payloads and run the valid, unseen ones through the
+    pipeline as one batch. Returns one result per item, in input order.
+    """
+    started = time.perf_counter()
+    ACTIVITIES_TOTAL.inc(len(items))
+    
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    pending = []
+    with _stage('validation'):
+        for i, item in enumerate(items):
+            try:
+                record = ActivityRecord.from_activity(UserActivity.model_validate(item))
+            except ValidationError as e:
+                ERRORS_TOTAL.inc(stage='validation')
+                results[i] = {"status": "invalid", "errors": e.errors(include_url=False, include_context=False)}
+                continue
+            if recent_ids.seen(record.id):
+                DUPLICATES_TOTAL.inc(source='filter')
+                results[i] = _duplicate_response(record)
+                continue
+            pending.append((i, record))
+    
+    records = [record for _, record in pending]
+    try:
+        if INGEST_MODE == "spool" or ingest_spool.has_backlog():
+            processed = await _spool_activities(records, reason='mode' if INGEST_MODE == "spool" else 'backlog') if records else []
+        else:
+            try:
+                processed = await _store_and_score(records) if records else []
+            except sqlite3.OperationalError as e:
+                if not _database_busy(e):
+                    raise
+                processed = await _spool_activities(records, reason='db_busy')
+    except SpoolFullError:
+        raise
+    except Exception as e:
+        ERRORS_TOTAL.inc(len(pending), stage='pipeline')
+        logger.error(f"Error storing activity batch: {e}")
+        processed = [{"status": "error", "message": str(e)}] * len(pending)
+    for (i, _), result in zip(pending, processed):
+        results[i] = result
+    
+    if pending:
+        per_event = (time.perf_counter() - started) / len(pending)
+        for _ in pending:
+            STAGE_SECONDS.observe(per_event, stage='pipeline')
+    return results
+
+def _not_modified(request: Request, response: Response, cache_key: tuple) -> bool:
+    """Set the ETag for a cached query and report whether the client already has it"""
+    etag = db_manager.read_cache.etag(cache_key)
+    response.headers["ETag"] = etag
+    # If-None-Match is a list of tags or "*"; weak comparison ignores the W/ prefix
+    candidates = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
 @app.get("/api/alerts")
-async def get_alerts(limit: int = 50):
+async def get_alerts(request: Request, response: Response, limit: int = 50):
     """Get recent security alerts"""
+    if _not_modified(request, response, ('recent_alerts', limit)):
+        return Response(status_code=304, headers={"ETag": response.headers["ETag"]})
+    if hot_window.can_serve_alerts(limit):
+        return {"alerts": hot_window.recent_alerts(limit)}
     alerts = await db_manager.get_recent_alerts(limit)
     return {"alerts": [alert.dict() for alert in alerts]}
 
 @app.get("/api/activities/recent")
-async def get_recent_activities(limit: int = 100):
+async def get_recent_activities(request: Request, response: Response, limit: int = 100):
     """Get recent user activities"""
+    if _not_modified(request, response, ('recent_activities', limit)):
+        return Response(status_code=304, headers={"ETag": response.headers["ETag"]})
+    if hot_window.can_serve_activities(limit):
+        return {"activities": hot_window.recent_activities(limit)}
     activities = await db_manager.get_recent_activities(limit)
     return {"activities": [activity.dict() for activity in activities]}
 
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats():
-    """Get dashboard statistics"""
+    """Get dashboard statistics (no ETag: uptime, last_updated and today's counts change without writes)"""
     stats = await db_manager.get_dashboard_stats()
     return stats.dict()
 
+@app.get("/api/dashboard/top-talkers")
+async def get_top_talkers(hours: int = 1, k: int = 10):
+    """Distinct counts and heavy hitters from the streaming sketches"""
+    return traffic_sketches.summary(hours=hours, k=k)
+
+@app.get("/api/analytics/live")
+async def get_live_analytics(window_minutes: int = 60):
+    """Rollups over the in-memory window of recent activities and alerts"""
+    return hot_window.rollup(window_minutes)
+
+@app.get("/api/rules/stats")
+async def get_rule_stats():
+    """Behavioral rule hit counters and evaluation timings"""
+    return anomaly_detector.rule_engine.get_stats()
+
+@app.post("/api/rules/reload")
+async def reload_rules():
+    """Recompile the rules file now instead of waiting for the periodic check"""
+    reloaded = anomaly_detector.rule_engine.reload(force=True)
+    return {"reloaded": reloaded, "error": anomaly_detector.rule_engine.last_error}
+
+@app.get("/api/thresholds")
+async def get_thresholds():
+    """Current adaptive alert thresholds and the score distributions behind them"""
+    return alert_thresholds.get_report()
+
+@app.get("/api/thresholds/users/{user_id}")
+async def get_user_thresholds(user_id: str, role: str = "user"):
+    """Thresholds that apply to one user"""
+    if role not in ROLE_CODES:
+        raise HTTPException(status_code=400, detail=f"Unknown role: {role}")
+    return alert_thresholds.get_user_report(user_id, role)
+
+@app.get("/api/detectors")
+async def get_detectors():
+    """Configured anomaly detector engines"""
+    return anomaly_detector.get_detector_info()
+
+@app.get("/api/peer-groups")
+async def get_peer_groups():
+    """State of the peer group drift lookup"""
+    return peer_index.get_stats()
+
+@app.get("/api/drift")
+async def get_drift():
+    """Per-feature drift of live traffic against the training data, and retrain history"""
+    return {"model_version": anomaly_detector.model_version, **drift_monitor.get_report()}
+
+@app.get("/api/security-events")
+async def get_security_events(limit: int = 50):
+    """Get recent multi-stage security events"""
+    events = await db_manager.get_recent_security_events(limit)
+    return {"events": [event.dict() for event in events], "matcher": sequence_matcher.get_stats()}
+
+@app.get("/api/alerts/aggregation")
+async def get_alert_aggregation_stats():
+    """Open correlation windows and how many triggers were folded"""
+    return alert_aggregator.get_stats()
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Read cache hit rates and current write generation, and duplicate suppression"""
+    return {**db_manager.read_cache.get_stats(), "recent_ids": recent_ids.get_stats()}
+
+@app.get("/api/spool")
+async def get_spool_stats():
+    """Ingest mode and write-ahead spool state: backlog, drain progress and fsync batching"""
+    return {"ingest_mode": INGEST_MODE, **ingest_spool.get_stats()}
+
+@app.get("/api/analytics/queries")
+async def list_analytics_queries():
+    """List the historical hunting queries and the current snapshot"""
+    return {
+        "engine_available": historical_analytics.available,
+        "snapshot": historical_analytics.snapshot_info,
+        "queries": historical_analytics.list_queries()
+    }
+
+@app.post("/api/analytics/snapshot")
+async def create_analytics_snapshot():
+    """Export a fresh columnar snapshot of activities and alerts"""
+    if not historical_analytics.available:
+        raise HTTPException(status_code=503, detail="Historical analytics engine is not installed")
+    # Runs off the event loop - the export only reads through a separate read-only connection
+    try:
+        snapshot = await asyncio.to_thread(historical_analytics.create_snapshot)
+    except SnapshotBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "created", "snapshot": snapshot}
+
+@app.get("/api/analytics/query/{query_name}")
+async def run_analytics_query(query_name: str, start: Optional[datetime] = None,
+                              end: Optional[datetime] = None, user_id: Optional[str] = None,
+                              limit: int = 1000):
+    """Run a parameterized hunting query against the latest snapshot"""
+    if not historical_analytics.available:
+        raise HTTPException(status_code=503, detail="Historical analytics engine is not installed")
+
+    end = end or datetime.now()
+    start = start or end - timedelta(days=30)
+    try:
+        rows = await asyncio.to_thread(
+            historical_analytics.run_query, query_name, start, end, user_id, limit
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return {"query": query_name, "start": start.isoformat(), "end": end.isoformat(), "rows": rows}
+
+def _export_response(table: str, filters: Dict[str, Any], start: Optional[datetime],
+                     end: Optional[datetime], format: str, gzip: bool) -> StreamingResponse:
+    """Build a streaming export response for one table"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+    try:
+        # iter_rows validates filters eagerly, so bad requests fail before streaming starts
+        rows = db_manager.iter_rows(table, start=start, end=end, filters=filters)
+        chunks = stream_export(rows, format, compress=gzip, columns=db_manager.table_columns(table))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # A gzip export is a .gz file download, not a transfer encoding clients would undo
+    extension = format + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{table}.{extension}"'}
+    media_type = "application/gzip" if gzip else EXPORT_FORMATS[format]
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+@app.get("/api/export/activities")
+async def export_activities(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                            user_id: Optional[str] = None, action: Optional[str] = None,
+                            format: str = "ndjson", gzip: bool = False):
+    """Stream user activities in a time range as NDJSON or CSV"""
+    return _export_response("user_activities", {"user_id": user_id, "action": action},
+                            start, end, format, gzip)
+
+@app.get("/api/export/alerts")
+async def export_alerts(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        user_id: Optional[str] = None, severity: Optional[str] = None,
+                        format: str = "ndjson", gzip: bool = False):
+    """Stream security alerts in a time range as NDJSON or CSV"""
+    return _export_response("alerts", {"user_id": user_id, "severity": severity},
+                            start, end, format, gzip)
+
+def require_admin(request: Request):
+    """Admin endpoints need X-Admin-Token matching the ADMIN_TOKEN environment variable"""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/api/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(seconds: float = 10.0, interval_ms: float = 10.0):
+    """Sample all threads for N seconds; returns collapsed stacks for flamegraph tools"""
+    if not 0 < seconds <= 300 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 300], interval_ms in [1, 1000]")
+    try:
+        cpu_profiler.start(interval_ms / 1000)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        collapsed = await asyncio.to_thread(cpu_profiler.stop)
+    return PlainTextResponse(collapsed, headers={
+        "Content-Disposition": f'attachment; filename="profile-{datetime.now():%Y%m%dT%H%M%S}.collapsed"',
+        "X-Profile-Samples": str(cpu_profiler.samples)
+    })
+
+@app.post("/api/admin/profile/memory/snapshot", dependencies=[Depends(require_admin)])
+async def memory_snapshot():
+    """Start tracemalloc if needed and record a baseline snapshot"""
+    return await asyncio.to_thread(memory_profiler.snapshot)
+
+@app.get("/api/admin/profile/memory/diff", dependencies=[Depends(require_admin)])
+async def memory_diff(limit: int = 25, group_by: str = "lineno"):
+    """Top allocation changes since the baseline snapshot"""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return await asyncio.to_thread(memory_profiler.diff, limit, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.delete("/api/admin/profile/memory", dependencies=[Depends(require_admin)])
+async def memory_stop():
+    """Stop tracemalloc"""
+    memory_profiler.stop()
+    return {"tracing": False}
+
+@app.get("/api/admin/traces", dependencies=[Depends(require_admin)])
+async def get_traces(limit: int = 50):
+    """Recent request traces (send X-Trace: 1 to trace a request, or set a sample rate)"""
+    return {"sample_rate": tracer.sample_rate, "traces": tracer.recent(limit)}
+
+@app.put("/api/admin/traces/sample-rate", dependencies=[Depends(require_admin)])
+async def set_trace_sample_rate(rate: float):
+    """Change the share of requests traced without the header"""
+    if not 0 <= rate <= 1:
+        raise HTTPException(status_code=400, detail="rate must be between 0 and 1")
+    tracer.sample_rate = rate
+    return {"sample_rate": rate}
+
+@app.post("/api/drift/retrain", dependencies=[Depends(require_admin)])
+async def trigger_retrain():
+    """Retrain on recent traffic now, regardless of drift"""
+    if drift_monitor.retraining:
+        raise HTTPException(status_code=409, detail="A retrain is already running")
+    return await run_retrain_job("manual")
+
+@app.post("/api/peer-groups/run", dependencies=[Depends(require_admin)])
+async def trigger_peer_grouping():
+    """Run the clustering job now"""
+    return await run_peer_group_job()
+
+@app.post("/api/admin/backfill", dependencies=[Depends(require_admin)])
+async def start_backfill(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         threshold: Optional[float] = None, high_threshold: Optional[float] = None,
+                         workers: Optional[int] = None, chunk_size: int = 5000, resume: bool = False):
+    """
+    Re-score activities in [start, end) with the current model and rules and
+    update their alerts in the background. Cutoffs default to the live global ones.
+    """
+    global backfill_progress, backfill_task
+    # The task, not progress.state, marks a run: state stays 'pending' until the worker thread starts
+    if backfill_task is not None and not backfill_task.done():
+        raise HTTPException(status_code=409, detail="A backfill is already running")
+    if not 100 <= chunk_size <= 50000:
+        raise HTTPException(status_code=400, detail="chunk_size must be between 100 and 50000")
+    live = alert_thresholds.get_report()['global']
+    progress = backfill_progress = BackfillProgress()
+    
+    async def run():
+        try:
+            await asyncio.to_thread(
+                run_backfill, db_manager.db_path, start, end,
+                threshold if threshold is not None else live['threshold'],
+                high_threshold if high_threshold is not None else live['high_threshold'],
+                DETECTOR_ENGINE, DETECTOR_TENANT_ENGINES, workers=workers, chunk_size=chunk_size,
+                resume=resume, progress=progress
+            )
+        except Exception as e:
+            logger.error(f"Error in backfill: {e}")
+        finally:
+            # Alerts changed behind the API's back: open aggregated alerts adopt the rewritten
+            # scores before the held-back flushes resume
+            alert_aggregator.reconcile(db_manager.get_alert_states(alert_aggregator.open_alert_ids()))
+            db_manager.read_cache.bump_generation()
+            hot_window.warm(db_manager)
+    
+    backfill_task = asyncio.create_task(run())
+    return progress.to_dict()
+
+@app.get("/api/admin/backfill", dependencies=[Depends(require_admin)])
+async def get_backfill_status():
+    """Progress of the latest backfill run"""
+    if backfill_progress is None:
+        raise HTTPException(status_code=404, detail="No backfill has been started")
+    return backfill_progress.to_dict()
+
+@app.delete("/api/admin/backfill", dependencies=[Depends(require_admin)])
+async def cancel_backfill():
+    """Stop the running backfill after its in-flight chunks; resume=true continues it later"""
+    if backfill_task is None or backfill_task.done():
+        raise HTTPException(status_code=409, detail="No backfill is running")
+    backfill_progress.cancel_event.set()
+    return backfill_progress.to_dict()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time updates"""
     await websocket_manager.connect(websocket)
+    # Bring the new dashboard up to date straight from memory
+    await websocket_manager.send_replay(
+        websocket,
+        alerts=hot_window.recent_alerts(20),
+        activities=hot_window.recent_activities(50)
+    )
     try:
         while True:
             # Keep connection alive
@@ -147,11 +980,23 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         websocket_manager.disconnect(websocket)
 
+@app.websocket("/ws/ingest")
+async def ingest_stream_endpoint(websocket: WebSocket, ack: str = "window"):
+    """Persistent agent ingestion: activity frames in, acks and flow-control credits out"""
+    if ack not in ACK_MODES:
+        await websocket.close(code=1008, reason=f"ack must be one of {', '.join(ACK_MODES)}")
+        return
+    await IngestSession(
+        websocket, _ingest_items, credits=INGEST_STREAM_CREDITS, ack_mode=ack, max_batch=MAX_BULK_ACTIVITIES,
+        backpressure=ingest_spool.is_full
+    ).run()
+
 @app.post("/api/demo/generate")
 async def generate_demo_data():
     """Generate demo data for testing"""
     try:
         demo_activities = db_manager.generate_demo_activities()
+        hot_window.warm(db_manager)
         return {
             "message": "Demo data generated",
             "activities_created": len(demo_activities)
@@ -170,5 +1015,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        log_config=None  # keep the queue-based pipeline set up above
     )
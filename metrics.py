@@ -0,0 +1,294 @@
+"""
+Metrics for Third Umpire - AI Guard Dog System
+Low-overhead counters, gauges and fixed-bucket latency histograms for the
+ingest pipeline, rendered in the Prometheus text format and summarized into
+the live SystemHealth report.
+"""
+
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+# Upper bounds (seconds) of the latency buckets; +Inf is implied
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+PROCESS_START_TIME = time.time()
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, or be read from a callback at scrape time"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        self._values[_label_key(self.labelnames, labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+        return super().samples()
+
+
+class _HistogramSeries:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect plus three increments"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.bounds = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def _get_series(self, labels: Dict[str, str]) -> _HistogramSeries:
+        key = _label_key(self.labelnames, labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.bounds) + 1)
+        return series
+
+    def observe(self, value: float, **labels):
+        series = self._get_series(labels)
+        series.buckets[bisect_left(self.bounds, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the enclosed block (also when it raises)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def totals(self, **labels) -> Tuple[float, int]:
+        """(sum, count) for one label set"""
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return (series.sum, series.count) if series is not None else (0.0, 0)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Bucket upper bound at quantile q (None without observations)"""
+        series = self._series.get(_label_key(self.labelnames, labels))
+        if series is None or series.count == 0:
+            return None
+        rank = q * series.count
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), series.buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), series.buckets):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Ingest pipeline
+STAGE_SECONDS = REGISTRY.histogram(
+    'third_umpire_stage_seconds', 'Latency of each ingest pipeline stage', ('stage',)
+)
+ACTIVITIES_TOTAL = REGISTRY.counter('third_umpire_activities_total', 'Activities received for ingest')
+ERRORS_TOTAL = REGISTRY.counter('third_umpire_errors_total', 'Failures by pipeline stage', ('stage',))
+ALERTS_TOTAL = REGISTRY.counter('third_umpire_alerts_total', 'Alerts raised by severity', ('severity',))
+DUPLICATES_TOTAL = REGISTRY.counter(
+    'third_umpire_duplicate_activities_total', 'Re-sent activities skipped, by where they were caught', ('source',)
+)
+SPOOLED_TOTAL = REGISTRY.counter(
+    'third_umpire_spooled_activities_total', 'Activities acknowledged from the write-ahead spool, by why', ('reason',)
+)
+SPOOL_DEAD_LETTERED_TOTAL = REGISTRY.counter(
+    'third_umpire_spool_dead_lettered_total', 'Spooled records the drain gave up on and moved to the dead-letter file'
+)
+
+# Database reads (cache misses only; hits are counted by the query cache)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'third_umpire_db_query_seconds', 'Latency of database read queries', ('query',)
+)
+
+# WebSocket fan-out
+WS_SEND_SECONDS = REGISTRY.histogram(
+    'third_umpire_websocket_send_seconds', 'Latency of one WebSocket send', ('type',)
+)
+WS_PENDING_SENDS = REGISTRY.gauge(
+    'third_umpire_websocket_pending_sends', 'Messages queued for clients but not yet sent'
+)
+WS_SEND_FAILURES_TOTAL = REGISTRY.counter(
+    'third_umpire_websocket_send_failures_total', 'WebSocket sends that failed and dropped the client'
+)
+
+REGISTRY.gauge(
+    'third_umpire_process_start_time_seconds', 'Unix time the process started',
+    function=lambda: PROCESS_START_TIME
+)
+
+
+def uptime_seconds() -> float:
+    return time.time() - PROCESS_START_TIME
+
+
+def process_memory_percent() -> float:
+    """Resident memory as a share of physical memory (Linux /proc; 0 elsewhere)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return min(100.0, 100.0 * resident_pages / os.sysconf('SC_PHYS_PAGES'))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class HealthSampler:
+    """
+    Turns the cumulative metrics into live rates: each sample covers the time
+    since the previous one (CPU share, mean pipeline latency, error rate).
+    Meant to be sampled by one periodic task; readers take `latest`.
+    """
+
+    def __init__(self):
+        self._last = self._read()
+        self.latest: Dict[str, float] = {
+            'cpu_usage': 0.0,
+            'memory_usage': process_memory_percent(),
+            'processing_latency': 0.0,
+            'error_rate': 0.0
+        }
+
+    def _read(self) -> Dict[str, float]:
+        times = os.times()
+        latency_sum, latency_count = STAGE_SECONDS.totals(stage='pipeline')
+        return {
+            'wall': time.monotonic(),
+            'cpu': times.user + times.system,
+            'latency_sum': latency_sum,
+            'latency_count': latency_count,
+            'activities': ACTIVITIES_TOTAL.total(),
+            'errors': ERRORS_TOTAL.total()
+        }
+
+    def sample(self) -> Dict[str, float]:
+        current = self._read()
+        last, self._last = self._last, current
+        wall = max(current['wall'] - last['wall'], 1e-9)
+        latency_count = current['latency_count'] - last['latency_count']
+        activities = current['activities'] - last['activities']
+        self.latest = {
+            'cpu_usage': min(100.0, 100.0 * (current['cpu'] - last['cpu']) / wall / (os.cpu_count() or 1)),
+            'memory_usage': process_memory_percent(),
+            'processing_latency': (
+                1000.0 * (current['latency_sum'] - last['latency_sum']) / latency_count if latency_count else 0.0
+            ),
+            'error_rate': min(100.0, 100.0 * (current['errors'] - last['errors']) / activities) if activities else 0.0
+        }
+        return self.latest
+
+
+def availability_percent() -> float:
+    """Share of ingested activities handled without error since the process started"""
+    activities = ACTIVITIES_TOTAL.total()
+    if not activities:
+        return 100.0
+    return max(0.0, 100.0 * (1 - ERRORS_TOTAL.value(stage='pipeline') / activities))
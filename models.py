@@ -3,6 +3,7 @@ Data models for Third Umpire - AI Guard Dog System
 Defines the data structures for user activities, alerts, and security events.
 """
 
+import json
 from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Dict, List, Optional, Any
@@ -58,6 +59,123 @@ class UserActivity(BaseModel):
         use_enum_values = True
         from_attributes = True
 
+# Pre-encoded enum codes, in enum declaration order
+ACTION_NAMES = [action.value for action in ActionType]
+ROLE_NAMES = [role.value for role in UserRole]
+SEVERITY_NAMES = [severity.value for severity in SeverityLevel]
+ACTION_CODES = {name: code for code, name in enumerate(ACTION_NAMES)}
+ROLE_CODES = {name: code for code, name in enumerate(ROLE_NAMES)}
+SEVERITY_CODES = {name: code for code, name in enumerate(SEVERITY_NAMES)}
+
+# user_activities columns in the order ActivityRecord.from_row expects
+ACTIVITY_COLUMNS = (
+    'id', 'user_id', 'action', 'timestamp', 'location', 'ip_address', 'user_agent', 'user_role',
+    'success', 'failed_attempts', 'session_id', 'device_fingerprint', 'additional_data', 'geo_location'
+)
+
+def enum_value(value: Any) -> Any:
+    """Enum fields hold plain values with use_enum_values, but enums when set directly"""
+    return getattr(value, 'value', value)
+
+class ActivityRecord:
+    """
+    Compact internal representation of a validated user activity.
+    Built once at the API edge and passed through storage, scoring and broadcast
+    without further validation.
+    """
+    __slots__ = (
+        'id', 'user_id', 'action', 'action_code', 'timestamp', 'location',
+        'ip_address', 'user_agent', 'user_role', 'role_code', 'success',
+        'failed_attempts', 'session_id', 'device_fingerprint', 'additional_data',
+        'ip_info', 'geo_location'
+    )
+
+    def __init__(self, id: str, user_id: str, action: str, timestamp: datetime,
+                 location: Dict[str, float], ip_address: str, user_agent: str, user_role: str,
+                 success: bool, failed_attempts: int, session_id: str,
+                 device_fingerprint: str, additional_data: Dict[str, Any]):
+        self.id = id
+        self.user_id = user_id
+        self.action = action
+        self.action_code = ACTION_CODES[action]
+        self.timestamp = timestamp
+        self.location = location
+        self.ip_address = ip_address
+        self.user_agent = user_agent
+        self.user_role = user_role
+        self.role_code = ROLE_CODES[user_role]
+        self.success = success
+        self.failed_attempts = failed_attempts
+        self.session_id = session_id
+        self.device_fingerprint = device_fingerprint
+        self.additional_data = additional_data
+        self.ip_info: Optional[Dict[str, Any]] = None  # filled by IP enrichment
+        # GeoIP estimate when no location was sent; stored apart, `location` stays as reported
+        self.geo_location: Optional[Dict[str, float]] = None
+
+    @property
+    def scoring_location(self) -> Dict[str, float]:
+        """The reported location, or the GeoIP estimate when none was sent"""
+        return self.location or self.geo_location or {}
+
+    @classmethod
+    def from_activity(cls, activity: 'UserActivity') -> 'ActivityRecord':
+        """Convert an already validated UserActivity"""
+        return cls(
+            activity.id, activity.user_id, enum_value(activity.action), activity.timestamp,
+            activity.location, activity.ip_address, activity.user_agent,
+            enum_value(activity.user_role), activity.success, activity.failed_attempts,
+            activity.session_id, activity.device_fingerprint, activity.additional_data
+        )
+
+    @classmethod
+    def from_row(cls, row) -> 'ActivityRecord':
+        """Build from a user_activities row selected as ACTIVITY_COLUMNS (trusted data)"""
+        (activity_id, user_id, action, timestamp, location, ip_address, user_agent, user_role,
+         success, failed_attempts, session_id, device_fingerprint, additional_data, geo_location) = row
+        record = cls(
+            activity_id, user_id, action, datetime.fromisoformat(timestamp), json.loads(location or '{}'),
+            ip_address, user_agent, user_role, bool(success), failed_attempts, session_id,
+            device_fingerprint, json.loads(additional_data or '{}')
+        )
+        record.geo_location = json.loads(geo_location) if geo_location else None
+        return record
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ActivityRecord':
+        """Inverse of to_dict, also accepting an ISO timestamp string (trusted data)"""
+        timestamp = data['timestamp']
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return cls(
+            data['id'], data['user_id'], data['action'], timestamp, data['location'],
+            data['ip_address'], data['user_agent'], data['user_role'], data['success'],
+            data['failed_attempts'], data['session_id'], data['device_fingerprint'],
+            data['additional_data']
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Same shape as UserActivity.dict()"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'action': self.action,
+            'timestamp': self.timestamp,
+            'location': self.location,
+            'ip_address': self.ip_address,
+            'user_agent': self.user_agent,
+            'user_role': self.user_role,
+            'success': self.success,
+            'failed_attempts': self.failed_attempts,
+            'session_id': self.session_id,
+            'device_fingerprint': self.device_fingerprint,
+            'additional_data': self.additional_data
+        }
+
+    def to_model(self) -> 'UserActivity':
+        """Wrap as a UserActivity without re-running validation"""
+        return UserActivity.model_construct(**self.to_dict())
+
 class Alert(BaseModel):
     """Model for security alerts"""
     id: str = Field(..., description="Unique alert identifier")
@@ -72,6 +190,8 @@ class Alert(BaseModel):
     auto_resolved: bool = Field(default=False, description="Whether alert was auto-resolved")
     false_positive: bool = Field(default=False, description="Whether this was a false positive")
     related_activities: List[str] = Field(default_factory=list, description="Related activity IDs")
+    occurrence_count: int = Field(default=1, description="Number of triggers folded into this alert")
+    last_seen: Optional[datetime] = Field(default=None, description="Timestamp of the latest folded trigger")
 
     class Config:
         json_encoders = {
@@ -92,6 +212,8 @@ class SecurityEvent(BaseModel):
     indicators: List[str] = Field(default_factory=list, description="Security indicators")
     mitigation_actions: List[str] = Field(default_factory=list, description="Actions taken to mitigate")
     status: str = Field(default="detected", description="Event status")
+    related_activities: List[str] = Field(default_factory=list, description="Activity IDs that formed the event")
+    related_alerts: List[str] = Field(default_factory=list, description="Alert IDs linked to the event")
 
     class Config:
         json_encoders = {
@@ -164,6 +286,7 @@ class SystemHealth(BaseModel):
     active_connections: int = Field(default=0, description="Active WebSocket connections")
     processing_latency: float = Field(default=0.0, description="Average processing latency in ms")
     error_rate: float = Field(default=0.0, ge=0, le=100, description="Error rate percentage")
+    uptime_seconds: float = Field(default=0.0, description="Seconds since the process started")
 
     class Config:
         json_encoders = {
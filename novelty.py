@@ -0,0 +1,214 @@
+"""
+Novelty Detection for Third Umpire - AI Guard Dog System
+Per-user Bloom filters answering "first time this user shows up with this
+device / user agent / IP" in O(1), with bounded memory and persistence
+alongside user_profiles.
+"""
+
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Fields tracked per user and the feature name they produce
+NOVELTY_DIMENSIONS = {
+    'device_fingerprint': 'new_device',
+    'user_agent': 'new_user_agent',
+    'ip_address': 'new_ip'
+}
+
+# Bloom filter bytes per dimension. With 4 hashes a filter stays near 1% false
+# positives up to one value per ~9.6 bits: ~100 devices or user agents and
+# ~430 IPs per user, where IPs are by far the most numerous.
+DEFAULT_FILTER_BYTES = {
+    'device_fingerprint': 128,
+    'user_agent': 128,
+    'ip_address': 512
+}
+
+
+class UserNoveltyFilter:
+    """
+    A user's Bloom filters, one per dimension, stored back to back in a single
+    bytearray (the persisted blob), plus a count of values added per dimension.
+    """
+
+    __slots__ = ('layout', 'bits', 'counts', 'dirty')
+
+    def __init__(self, layout: Dict[str, Tuple[int, int]], bits: Optional[bytes] = None,
+                 counts: Optional[Dict[str, int]] = None):
+        self.layout = layout  # dimension -> (byte offset, byte size), shared by all users
+        total = sum(size for _, size in layout.values())
+        if bits is not None and len(bits) != total:
+            # Stored with another layout; the bits cannot be split, so start over
+            bits, counts = None, None
+        self.bits = bytearray(bits) if bits else bytearray(total)
+        self.counts = counts or {}
+        self.dirty = False
+
+    def _positions(self, dimension: str, value: str, hashes: int) -> List[int]:
+        offset, size = self.layout[dimension]
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        base, size = offset * 8, size * 8
+        return [base + (h1 + i * h2) % size for i in range(hashes)]
+
+    def check_and_add(self, dimension: str, value: str, hashes: int) -> bool:
+        """Add a value and return True if it was (probably) already present"""
+        positions = self._positions(dimension, value, hashes)
+        present = all(self.bits[p >> 3] & (1 << (p & 7)) for p in positions)
+        if not present:
+            for p in positions:
+                self.bits[p >> 3] |= 1 << (p & 7)
+            self.counts[dimension] = self.counts.get(dimension, 0) + 1
+            self.dirty = True
+        return present
+
+
+class NoveltyTracker:
+    """
+    LRU of per-user novelty filters.
+    Users not in memory are loaded from user_profiles on first sight - in
+    batches off the event loop when the caller prefetches them - and evicted
+    and periodically flushed filters are written back in one batch, from a
+    worker thread except at shutdown.
+    """
+
+    def __init__(self, db_manager=None, max_users: int = 100000,
+                 filter_bytes: Optional[Dict[str, int]] = None, hashes: int = 4):
+        self.db_manager = db_manager
+        self.max_users = max_users
+        self.filter_bytes = dict(filter_bytes or DEFAULT_FILTER_BYTES)
+        self.hashes = hashes
+        self.layout: Dict[str, Tuple[int, int]] = {}
+        offset = 0
+        for dimension in NOVELTY_DIMENSIONS:
+            self.layout[dimension] = (offset, self.filter_bytes[dimension])
+            offset += self.filter_bytes[dimension]
+        self._filters: "OrderedDict[str, UserNoveltyFilter]" = OrderedDict()
+        self._pending_writes: Dict[str, UserNoveltyFilter] = {}
+        # Evicted filters being written by flush_async(); reused, not reloaded, if their user returns
+        self._flushing: Dict[str, UserNoveltyFilter] = {}
+
+    def _install(self, user_id: str, novelty_filter: UserNoveltyFilter):
+        self._filters[user_id] = novelty_filter
+        if len(self._filters) > self.max_users:
+            evicted_user, evicted = self._filters.popitem(last=False)
+            if evicted.dirty:
+                self._pending_writes[evicted_user] = evicted
+
+    def _get_filter(self, user_id: str) -> UserNoveltyFilter:
+        novelty_filter = self._filters.get(user_id)
+        if novelty_filter is not None:
+            self._filters.move_to_end(user_id)
+            return novelty_filter
+
+        novelty_filter = self._pending_writes.pop(user_id, None)
+        if novelty_filter is None:
+            novelty_filter = self._flushing.get(user_id)
+        if novelty_filter is None:
+            # Not prefetched: a single synchronous load
+            stored = self.db_manager.load_novelty_filter(user_id) if self.db_manager else None
+            novelty_filter = UserNoveltyFilter(self.layout, *(stored or ()))
+
+        self._install(user_id, novelty_filter)
+        return novelty_filter
+
+    async def prefetch(self, user_ids: Iterable[str]):
+        """Load the filters of users not in memory with one query in a worker thread"""
+        if self.db_manager is None:
+            return
+        missing = {user_id for user_id in user_ids if not self._known(user_id)}
+        if not missing:
+            return
+        stored = await asyncio.to_thread(self.db_manager.load_novelty_filters, sorted(missing))
+        for user_id in missing:
+            # Another caller may have loaded the user while the query ran
+            if self._known(user_id):
+                continue
+            self._install(user_id, UserNoveltyFilter(self.layout, *stored.get(user_id, ())))
+
+    def _known(self, user_id: str) -> bool:
+        """Whether the user's filter is in memory (resident, evicted or being written)"""
+        return user_id in self._filters or user_id in self._pending_writes or user_id in self._flushing
+
+    def observe(self, activity: Any) -> Dict[str, Any]:
+        """Novelty features for one activity; also records the values as seen"""
+        novelty_filter = self._get_filter(activity.user_id)
+        features: Dict[str, Any] = {}
+        for dimension, feature in NOVELTY_DIMENSIONS.items():
+            value = getattr(activity, dimension)
+            if not value:
+                features[feature] = False
+                continue
+            had_history = novelty_filter.counts.get(dimension, 0) > 0
+            seen = novelty_filter.check_and_add(dimension, value, self.hashes)
+            # The very first value for a user is not "new", there is nothing to compare with
+            features[feature] = had_history and not seen
+        return features
+
+    def _collect(self) -> List[Tuple[str, UserNoveltyFilter]]:
+        """Take every dirty filter (evicted and resident) for a write and mark it clean"""
+        items: List[Tuple[str, UserNoveltyFilter]] = list(self._pending_writes.items())
+        items.extend((user_id, f) for user_id, f in self._filters.items() if f.dirty)
+        self._flushing = dict(self._pending_writes)
+        self._pending_writes.clear()
+        for _, novelty_filter in items:
+            novelty_filter.dirty = False
+        return items
+
+    def _restore(self, items: List[Tuple[str, UserNoveltyFilter]]):
+        """Put filters from a failed write back, so the next flush retries them"""
+        for user_id, novelty_filter in items:
+            novelty_filter.dirty = True
+            if user_id not in self._filters:
+                self._pending_writes.setdefault(user_id, novelty_filter)
+
+    def flush(self) -> int:
+        """Persist every dirty filter in one transaction on the caller's connection (shutdown)"""
+        if self.db_manager is None:
+            return 0
+        items = self._collect()
+        if not items:
+            return 0
+        try:
+            self.db_manager.save_novelty_filters(
+                [(user_id, bytes(f.bits), dict(f.counts)) for user_id, f in items]
+            )
+        except BaseException:
+            self._restore(items)
+            raise
+        finally:
+            self._flushing = {}
+        return len(items)
+
+    async def flush_async(self) -> int:
+        """
+        flush() for the periodic checkpoint: the filters are copied on the loop
+        (observe() keeps changing them) and written from a worker thread
+        """
+        if self.db_manager is None:
+            return 0
+        items = self._collect()
+        if not items:
+            return 0
+        rows = [(user_id, bytes(f.bits), dict(f.counts)) for user_id, f in items]
+        try:
+            await asyncio.to_thread(self.db_manager.save_novelty_filters, rows, True)
+        except BaseException:
+            self._restore(items)
+            raise
+        finally:
+            self._flushing = {}
+        return len(items)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'users_in_memory': len(self._filters),
+            'pending_writes': len(self._pending_writes),
+            'memory_bytes': len(self._filters) * sum(self.filter_bytes.values())
+        }
@@ -0,0 +1,229 @@
+"""
+Peer Group Analysis for Third Umpire - AI Guard Dog System
+Background job that clusters users by behavior with DBSCAN and stores each
+user's distance from their peer group, so scoring only needs a lookup.
+"""
+
+import json
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from models import ACTION_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Per-user behavior aggregates, computed in SQLite over the lookback window
+BEHAVIOR_QUERY = f"""
+    SELECT user_id,
+           COUNT(*) AS events,
+           AVG(CAST(substr(timestamp, 12, 2) AS REAL)) AS mean_hour,
+           AVG(CASE WHEN CAST(substr(timestamp, 12, 2) AS INTEGER) BETWEEN 6 AND 22 THEN 0.0 ELSE 1.0 END) AS off_hours,
+           AVG(CASE WHEN success THEN 0.0 ELSE 1.0 END) AS failure_rate,
+           AVG(failed_attempts) AS mean_failed_attempts,
+           COUNT(DISTINCT ip_address) AS distinct_ips,
+           COUNT(DISTINCT device_fingerprint) AS distinct_devices,
+           {', '.join(f"AVG(action = '{name}') AS action_{name}" for name in ACTION_NAMES)}
+    FROM user_activities
+    WHERE timestamp >= ?
+    GROUP BY user_id
+"""
+
+# Written back per user by the job
+PROFILE_UPSERT_SQL = """
+    INSERT INTO user_profiles (
+        user_id, typical_actions, behavior_vector, cluster_id, peer_distance, peer_drift, last_updated
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        typical_actions = excluded.typical_actions,
+        behavior_vector = excluded.behavior_vector,
+        cluster_id = excluded.cluster_id,
+        peer_distance = excluded.peer_distance,
+        peer_drift = excluded.peer_drift,
+        last_updated = excluded.last_updated
+"""
+
+FEATURE_COLUMNS = [
+    'mean_hour', 'off_hours', 'failure_rate', 'mean_failed_attempts',
+    'log_events', 'log_distinct_ips', 'log_distinct_devices'
+] + [f"action_{name}" for name in ACTION_NAMES]
+
+
+def build_behavior_matrix(connection: sqlite3.Connection, since: datetime):
+    """Return (user_ids, raw feature matrix, per-user aggregates)"""
+    connection.row_factory = sqlite3.Row
+    rows = connection.execute(BEHAVIOR_QUERY, (since.isoformat(),)).fetchall()
+    user_ids = [row['user_id'] for row in rows]
+    matrix = np.zeros((len(rows), len(FEATURE_COLUMNS)), dtype=np.float64)
+
+    for i, row in enumerate(rows):
+        values = dict(row)
+        values['log_events'] = np.log1p(values['events'])
+        values['log_distinct_ips'] = np.log1p(values['distinct_ips'])
+        values['log_distinct_devices'] = np.log1p(values['distinct_devices'])
+        matrix[i] = [values[column] or 0.0 for column in FEATURE_COLUMNS]
+
+    return user_ids, matrix, rows
+
+
+def cluster_users(features: np.ndarray, eps: float, min_samples: int, max_fit_size: int = 50000,
+                  random_state: int = 42) -> np.ndarray:
+    """
+    DBSCAN labels for every row.
+    Above max_fit_size, DBSCAN runs on a random sample and the remaining users join
+    the cluster of their nearest core sample (if within eps), keeping the job near-linear.
+    """
+    from sklearn.cluster import DBSCAN
+    from sklearn.neighbors import NearestNeighbors
+
+    if len(features) <= max_fit_size:
+        return DBSCAN(eps=eps, min_samples=min_samples, algorithm='kd_tree').fit_predict(features)
+
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(features), size=max_fit_size, replace=False)
+    model = DBSCAN(eps=eps, min_samples=min_samples, algorithm='kd_tree').fit(features[sample])
+
+    labels = np.full(len(features), -1, dtype=np.int64)
+    labels[sample] = model.labels_
+    if len(model.core_sample_indices_) == 0:
+        return labels
+
+    core_points = features[sample][model.core_sample_indices_]
+    core_labels = model.labels_[model.core_sample_indices_]
+    rest = np.setdiff1d(np.arange(len(features)), sample)
+    distances, nearest = NearestNeighbors(n_neighbors=1, algorithm='kd_tree').fit(core_points).kneighbors(features[rest])
+    within = distances[:, 0] <= eps
+    labels[rest[within]] = core_labels[nearest[within, 0]]
+    return labels
+
+
+def peer_distances(features: np.ndarray, labels: np.ndarray):
+    """Centroids, radii and each user's normalized distance to their (nearest) peer group"""
+    clusters = sorted(set(labels.tolist()) - {-1})
+    if not clusters:
+        return {}, np.zeros(len(features)), np.zeros(len(features))
+
+    centroids = np.array([features[labels == c].mean(axis=0) for c in clusters])
+    cluster_index = {c: i for i, c in enumerate(clusters)}
+    column = np.array([cluster_index.get(label, -1) for label in labels])
+
+    # Noise users are measured against their nearest centroid (kd-tree, no users x clusters matrix)
+    noise = column < 0
+    if noise.any():
+        from sklearn.neighbors import NearestNeighbors
+        _, nearest = NearestNeighbors(n_neighbors=1).fit(centroids).kneighbors(features[noise])
+        column[noise] = nearest[:, 0]
+    distance = np.linalg.norm(features - centroids[column], axis=1)
+    own = np.where(noise, -1, column)
+
+    radii = np.array([
+        max(np.percentile(distance[own == i], 95), 1e-6) for i in range(len(clusters))
+    ])
+    # 0 inside the group's 95th-percentile radius, growing to 1 at twice the radius
+    drift = np.clip(distance / radii[column] - 1.0, 0.0, 1.0)
+
+    summary = {
+        c: {'centroid': centroids[i].tolist(), 'radius': float(radii[i]), 'size': int((own == i).sum())}
+        for c, i in cluster_index.items()
+    }
+    return summary, distance, drift
+
+
+def run_peer_grouping(db_path: str = "third_umpire.db", eps: float = 0.5, min_samples: int = 5,
+                      lookback_days: int = 30, batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Full job: aggregate behavior, cluster, write profiles and peer groups back.
+    Meant to run in its own process (module-level function, picklable arguments).
+    Profiles are written `batch_size` users per transaction so the ingest path
+    never waits long for the write lock.
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    started = datetime.now()
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        user_ids, raw, rows = build_behavior_matrix(connection, started - timedelta(days=lookback_days))
+        if len(user_ids) < min_samples:
+            return {'users': len(user_ids), 'clusters': 0, 'skipped': 'not enough users'}
+
+        features = StandardScaler().fit_transform(raw)
+        labels = cluster_users(features, eps, min_samples)
+        summary, distance, drift = peer_distances(features, labels)
+
+        now = started.isoformat()
+        profiles = []
+        for i, row in enumerate(rows):
+            action_mix = {name: row[f"action_{name}"] or 0.0 for name in ACTION_NAMES}
+            typical = [name for name, share in sorted(action_mix.items(), key=lambda kv: -kv[1]) if share >= 0.1]
+            profiles.append((
+                user_ids[i], json.dumps(typical), json.dumps(raw[i].tolist()),
+                int(labels[i]), float(distance[i]), float(drift[i]), now
+            ))
+
+        for i in range(0, len(profiles), batch_size):
+            with connection:
+                connection.executemany(PROFILE_UPSERT_SQL, profiles[i:i + batch_size])
+        with connection:
+            connection.execute("DELETE FROM peer_groups")
+            connection.executemany(
+                "INSERT INTO peer_groups (cluster_id, centroid, radius, size, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(c, json.dumps(info['centroid']), info['radius'], info['size'], now) for c, info in summary.items()]
+            )
+    finally:
+        connection.close()
+
+    result = {
+        'users': len(user_ids),
+        'clusters': len(summary),
+        'noise_users': int((labels == -1).sum()),
+        'drifting_users': int((drift > 0).sum()),
+        'duration_seconds': (datetime.now() - started).total_seconds()
+    }
+    logger.info(f"👥 Peer grouping finished: {result}")
+    return result
+
+
+class PeerGroupIndex:
+    """In-memory user -> peer drift lookup used on the scoring path"""
+
+    def __init__(self):
+        self._drift: Dict[str, float] = {}
+        self.loaded_at: Optional[datetime] = None
+
+    def load(self, db_manager):
+        """Reload drift values written by the last job (only non-zero ones are kept)"""
+        self.load_rows(db_manager.load_peer_drift())
+
+    def load_rows(self, rows):
+        """Replace the lookup with (user_id, peer_drift) pairs"""
+        self._drift = dict(rows)
+        self.loaded_at = datetime.now()
+
+    def drift(self, user_id: str) -> float:
+        return self._drift.get(user_id, 0.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'drifting_users': len(self._drift),
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None
+        }
+
+
+def main():
+    """Command line entry point for a one-off peer grouping run"""
+    parser = argparse.ArgumentParser(description="Cluster users into behavioral peer groups")
+    parser.add_argument("--db", default="third_umpire.db")
+    parser.add_argument("--eps", type=float, default=0.5)
+    parser.add_argument("--min-samples", type=int, default=5)
+    parser.add_argument("--lookback-days", type=int, default=30)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(run_peer_grouping(args.db, args.eps, args.min_samples, args.lookback_days))
+
+
+if __name__ == "__main__":
+    main()
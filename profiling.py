@@ -0,0 +1,194 @@
+"""
+Profiling Hooks for Third Umpire - AI Guard Dog System
+On-demand diagnostics for a live process: a sampling CPU profiler that emits
+flamegraph-compatible collapsed stacks, tracemalloc snapshot diffs, and
+lightweight per-request tracing spans.
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import logging
+import threading
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profiling session is already running"""
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack from a background thread at a fixed interval.
+    Nothing is installed in the profiled code (no sys.setprofile), so overhead
+    is one stack walk per thread per tick and zero when idle.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Counter = Counter()
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01):
+        with self._lock:
+            if self.running:
+                raise ProfilerBusyError("A CPU profile is already being recorded")
+            self._stacks = Counter()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sample_loop, args=(interval,), name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks ("frame;frame;frame count" lines)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return '\n'.join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + '\n'
+
+    def _sample_loop(self, interval: float):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self._stacks[';'.join(reversed(frames))] += 1
+            self.samples += 1
+
+
+class MemoryProfiler:
+    """tracemalloc baseline snapshots and diffs against them"""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self.baseline_at: Optional[float] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Start tracing if needed and take a new baseline"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._baseline = tracemalloc.take_snapshot()
+        self.baseline_at = time.time()
+        current, peak = tracemalloc.get_traced_memory()
+        return {'tracing': True, 'traced_bytes': current, 'peak_bytes': peak, 'baseline_at': self.baseline_at}
+
+    def diff(self, limit: int = 25, group_by: str = 'lineno') -> Dict[str, Any]:
+        """Largest allocation changes since the baseline"""
+        if self._baseline is None or not tracemalloc.is_tracing():
+            raise RuntimeError("No baseline - take a snapshot first")
+        current = tracemalloc.take_snapshot()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = current.filter_traces(filters).compare_to(self._baseline.filter_traces(filters), group_by)
+        return {
+            'baseline_at': self.baseline_at,
+            'seconds_since_baseline': time.time() - self.baseline_at,
+            'traced_bytes': tracemalloc.get_traced_memory()[0],
+            'top': [{
+                'location': str(stat.traceback[0]) if stat.traceback else None,
+                'size_diff_bytes': stat.size_diff,
+                'size_bytes': stat.size,
+                'count_diff': stat.count_diff,
+                'count': stat.count
+            } for stat in stats[:limit]]
+        }
+
+    def stop(self):
+        """Stop tracing and drop the baseline (tracemalloc costs memory and CPU while on)"""
+        tracemalloc.stop()
+        self._baseline = None
+        self.baseline_at = None
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    __slots__ = ('id', 'name', 'started', 'wall_started', 'duration', 'spans')
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.duration: Optional[float] = None
+        self.spans: List[tuple] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.id,
+            'name': self.name,
+            'started_at': self.wall_started,
+            'duration_ms': self.duration * 1000 if self.duration is not None else None,
+            'spans': [{'name': name, 'offset_ms': offset * 1000, 'duration_ms': duration * 1000}
+                      for name, offset, duration in self.spans]
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+class Tracer:
+    """
+    Per-request tracing: a request is traced when the caller asks for it (header)
+    or it falls in the sample rate. Untraced requests pay one ContextVar lookup
+    per span.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, max_traces: int = 200):
+        self.sample_rate = sample_rate
+        self._traces: deque = deque(maxlen=max_traces)
+
+    @contextmanager
+    def trace(self, name: str, force: bool = False):
+        """Trace the enclosed request; yields the Trace, or None when not sampled"""
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            yield None
+            return
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - trace.started
+            _current_trace.reset(token)
+            self._traces.append(trace)
+
+    @contextmanager
+    def span(self, name: str):
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace.spans.append((name, started - trace.started, time.perf_counter() - started))
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return [trace.to_dict() for trace in list(self._traces)[-limit:]][::-1]
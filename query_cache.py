@@ -0,0 +1,101 @@
+"""
+Query Cache for Third Umpire - AI Guard Dog System
+Bounded LRU read-through cache with TTL and write-generation invalidation
+for the hot dashboard queries.
+"""
+
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    LRU cache keyed on query name and parameters.
+    Every entry remembers the write generation it was computed at; a bump of the
+    generation (any write) makes all older entries stale without walking the cache.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self._entries: "OrderedDict[Hashable, Tuple[int, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Distinguishes ETags across restarts, when the generation counter starts over
+        self._instance_id = uuid.uuid4().hex[:8]
+        self.hits = 0
+        self.misses = 0
+
+    def bump_generation(self):
+        """Invalidate every cached result - called on each write"""
+        self.generation += 1
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            generation, stored_at, value = entry
+            if generation != self.generation or time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """Store a value computed at the given generation"""
+        with self._lock:
+            self._entries[key] = (self.generation if generation is None else generation,
+                                  time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Read-through helper for synchronous loaders"""
+        value = self.get(key)
+        if value is None:
+            # Capture the generation first so a write during compute leaves the entry stale
+            generation = self.generation
+            value = compute()
+            self.put(key, value, generation)
+        return value
+
+    def etag(self, key: Hashable) -> str:
+        """
+        Weak ETag for a query result, derived only from its key and the write
+        generation - no query or serialization needed. Only for results that
+        change through writes alone (recent rows); a result that also depends
+        on the clock, like the dashboard stats, must not be served with it.
+        """
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest()
+        return f'W/"{self._instance_id}-{digest}-{self.generation}"'
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache effectiveness counters"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,253 @@
+"""
+Rule Engine for Third Umpire - AI Guard Dog System
+Declarative behavioral rules loaded from a JSON file, compiled once into
+vectorized NumPy predicates over feature columns, and hot-reloaded atomically.
+"""
+
+import json
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from pathlib import Path
+from typing import Dict, List, Any, Callable, Optional, Sequence
+
+import numpy as np
+
+from models import ACTION_CODES, ROLE_CODES
+
+logger = logging.getLogger(__name__)
+
+# Feature columns rules may reference (built by AnomalyDetector for each batch)
+FEATURE_FIELDS = {
+    'hour', 'action', 'user_role', 'success', 'failed_attempts', 'latitude', 'longitude',
+    'has_location', 'travel_score', 'impossible_travel', 'new_location',
+    'new_device', 'new_user_agent', 'new_ip', 'ip_risk', 'ip_trusted',
+    'user_events_1m', 'user_failures_10m', 'peer_drift'
+}
+
+# Fields compared by name in the config but stored as codes in the columns
+CODED_FIELDS = {'action': ACTION_CODES, 'user_role': ROLE_CODES}
+
+OPERATORS: Dict[str, Callable[[np.ndarray, Any], np.ndarray]] = {
+    'lt': lambda column, value: column < value,
+    'le': lambda column, value: column <= value,
+    'gt': lambda column, value: column > value,
+    'ge': lambda column, value: column >= value,
+    'eq': lambda column, value: column == value,
+    'ne': lambda column, value: column != value,
+    'in': lambda column, value: np.isin(column, value),
+    'not_in': lambda column, value: ~np.isin(column, value)
+}
+
+
+class CompiledRule:
+    """A rule turned into a predicate over feature columns plus its weight"""
+
+    __slots__ = ('id', 'group', 'weight', 'value_field', 'predicate', 'description')
+
+    def __init__(self, rule_id: str, group: Optional[str], weight: float, value_field: Optional[str],
+                 predicate: Callable[[Dict[str, np.ndarray]], np.ndarray], description: str):
+        self.id = rule_id
+        self.group = group
+        self.weight = weight
+        self.value_field = value_field
+        self.predicate = predicate
+        self.description = description
+
+
+class RuleSet:
+    """An immutable, compiled set of rules"""
+
+    def __init__(self, rules: List[CompiledRule], version: Any, loaded_at: float):
+        self.rules = rules
+        self.version = version
+        self.loaded_at = loaded_at
+
+
+def _compile_condition(condition: Dict[str, Any]) -> Callable[[Dict[str, np.ndarray]], np.ndarray]:
+    field, op, value = condition['field'], condition['op'], condition['value']
+    if field not in FEATURE_FIELDS:
+        raise ValueError(f"Unknown rule field: {field}")
+    if op not in OPERATORS:
+        raise ValueError(f"Unknown rule operator: {op}")
+
+    if field in CODED_FIELDS:
+        codes = CODED_FIELDS[field]
+        value = [codes[v] for v in value] if isinstance(value, list) else codes[value]
+    elif isinstance(value, list):
+        value = np.asarray(value)
+
+    compare = OPERATORS[op]
+    return lambda columns: compare(columns[field], value)
+
+
+def _compile_predicate(rule: Dict[str, Any]) -> Callable[[Dict[str, np.ndarray]], np.ndarray]:
+    """Combine 'all' (AND) and 'any' (OR) condition lists into one predicate"""
+    all_conditions = [_compile_condition(c) for c in rule.get('all', [])]
+    any_conditions = [_compile_condition(c) for c in rule.get('any', [])]
+    if not all_conditions and not any_conditions:
+        raise ValueError(f"Rule {rule['id']} has no conditions")
+
+    def predicate(columns: Dict[str, np.ndarray]) -> np.ndarray:
+        size = len(columns['hour'])
+        hits = np.ones(size, dtype=np.bool_)
+        for condition in all_conditions:
+            hits &= condition(columns)
+        if any_conditions:
+            any_hits = np.zeros(size, dtype=np.bool_)
+            for condition in any_conditions:
+                any_hits |= condition(columns)
+            hits &= any_hits
+        return hits
+
+    return predicate
+
+
+def compile_rules(config: Dict[str, Any], risk_weights: Dict[str, float]) -> RuleSet:
+    """Validate and compile a rules config; raises ValueError on bad rules"""
+    compiled = []
+    seen = set()
+    for rule in config.get('rules', []):
+        rule_id = rule['id']
+        if rule_id in seen:
+            raise ValueError(f"Duplicate rule id: {rule_id}")
+        seen.add(rule_id)
+
+        # Weights are either literal or a multiple of one of the detector's risk_weights
+        if 'risk_weight' in rule:
+            weight = risk_weights[rule['risk_weight']] * rule.get('multiplier', 1.0)
+        else:
+            weight = float(rule['weight'])
+
+        value_field = rule.get('value_field')
+        if value_field is not None and value_field not in FEATURE_FIELDS:
+            raise ValueError(f"Unknown value field in rule {rule_id}: {value_field}")
+
+        compiled.append(CompiledRule(
+            rule_id, rule.get('group'), weight, value_field,
+            _compile_predicate(rule), rule.get('description', '')
+        ))
+    return RuleSet(compiled, config.get('version'), time.time())
+
+
+class RuleEngine:
+    """
+    Evaluates the current RuleSet over batches of feature columns.
+    The rules file is re-checked at most every `reload_interval` seconds; a
+    changed file is compiled off to the side and swapped in with one assignment,
+    and a file that fails to compile leaves the previous rules active.
+    """
+
+    def __init__(self, path: str, risk_weights: Dict[str, float], enabled_groups: Dict[str, bool],
+                 reload_interval: float = 5.0):
+        self.path = Path(path)
+        self.risk_weights = risk_weights
+        self.enabled_groups = enabled_groups
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.eval_seconds: Dict[str, float] = {}
+        self.rows_evaluated = 0
+        self.last_error: Optional[str] = None
+        self.ruleset = RuleSet([], None, 0.0)
+        self.reload(force=True)
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompile the rules file if it changed; returns True when new rules were installed"""
+        with self._reload_lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = self.path.stat().st_mtime
+                if not force and mtime == self._mtime:
+                    return False
+                ruleset = compile_rules(json.loads(self.path.read_text()), self.risk_weights)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Rules in {self.path} not loaded, keeping previous rules: {e}")
+                return False
+
+            self._mtime = mtime
+            self.ruleset = ruleset  # atomic swap; in-flight evaluations keep the old set
+            self.last_error = None
+            logger.info(f"📜 Loaded {len(ruleset.rules)} behavioral rules (version {ruleset.version})")
+            return True
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Score a batch: sum of weights of matching rules, capped at 1"""
+        if time.monotonic() - self._last_check > self.reload_interval:
+            self.reload()
+
+        ruleset = self.ruleset
+        size = len(columns['hour'])
+        scores = np.zeros(size, dtype=np.float64)
+
+        for rule in ruleset.rules:
+            if rule.group is not None and not self.enabled_groups.get(rule.group, True):
+                continue
+            started = time.perf_counter()
+            hits = rule.predicate(columns)
+            if rule.value_field is None:
+                scores += rule.weight * hits
+            else:
+                scores += rule.weight * np.where(hits, columns[rule.value_field], 0.0)
+            self.eval_seconds[rule.id] = self.eval_seconds.get(rule.id, 0.0) + time.perf_counter() - started
+            self.hits[rule.id] = self.hits.get(rule.id, 0) + int(np.count_nonzero(hits))
+
+        self.rows_evaluated += size
+        return np.clip(scores, 0.0, 1.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-rule hit counters and cumulative evaluation time"""
+        ruleset = self.ruleset
+        return {
+            'version': ruleset.version,
+            'loaded_at': ruleset.loaded_at,
+            'rows_evaluated': self.rows_evaluated,
+            'last_error': self.last_error,
+            'rules': [{
+                'id': rule.id,
+                'group': rule.group,
+                'enabled': rule.group is None or self.enabled_groups.get(rule.group, True),
+                'weight': rule.weight,
+                'hits': self.hits.get(rule.id, 0),
+                'eval_ms_total': self.eval_seconds.get(rule.id, 0.0) * 1000
+            } for rule in ruleset.rules]
+        }
+
+
+class WindowFeatures:
+    """Per-user sliding-window counters (events in the last minute, failures in ten)"""
+
+    def __init__(self, max_users: int = 100000, max_events_per_user: int = 256):
+        self.max_users = max_users
+        self.max_events_per_user = max_events_per_user
+        self._events: "OrderedDict[str, deque]" = OrderedDict()
+        self._failures: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _window(self, table: "OrderedDict[str, deque]", user_id: str) -> deque:
+        window = table.get(user_id)
+        if window is None:
+            window = table[user_id] = deque(maxlen=self.max_events_per_user)
+            if len(table) > self.max_users:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(user_id)
+        return window
+
+    def observe(self, user_id: str, timestamp: float, success: bool) -> tuple:
+        """Record an event and return (events in last 60s, failures in last 600s)"""
+        events = self._window(self._events, user_id)
+        events.append(timestamp)
+        while events and events[0] < timestamp - 60:
+            events.popleft()
+
+        failures = self._window(self._failures, user_id)
+        if not success:
+            failures.append(timestamp)
+        while failures and failures[0] < timestamp - 600:
+            failures.popleft()
+
+        return len(events), len(failures)
@@ -0,0 +1,247 @@
+"""
+Streaming Sketches for Third Umpire - AI Guard Dog System
+Fixed-memory HyperLogLog and Count-Min sketches for distinct counts and
+heavy hitters on the live dashboard. All sketches are mergeable across workers.
+"""
+
+import json
+import time
+import heapq
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def write_checkpoint(path: str, arrays: Dict[str, np.ndarray]):
+    """Write a TrafficSketches.snapshot() to an .npz file (atomically via a temp file)"""
+    target = Path(path)
+    temp = target.with_suffix('.tmp.npz')
+    np.savez_compressed(temp, **arrays)
+    temp.replace(target)
+
+
+def _hash64(value: str) -> int:
+    """Stable 64-bit hash (Python's hash() is salted per process, so not mergeable)"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers"""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, value: str):
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            return int(round(m * np.log(m / zeros)))
+        return int(round(raw))
+
+
+class CountMinSketch:
+    """Count-Min sketch with depth rows derived by double hashing"""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+
+    def _columns(self, value: str) -> np.ndarray:
+        hashed = _hash64(value)
+        h1, h2 = hashed & 0xFFFFFFFF, (hashed >> 32) | 1
+        return (h1 + self._rows * h2) % self.width
+
+    def add(self, value: str, count: int = 1) -> int:
+        """Add and return the new estimate"""
+        columns = self._columns(value)
+        self.table[self._rows, columns] += count
+        return int(self.table[self._rows, columns].min())
+
+    def estimate(self, value: str) -> int:
+        return int(self.table[self._rows, self._columns(value)].min())
+
+    def merge(self, other: 'CountMinSketch'):
+        self.table += other.table
+
+
+class HeavyHitters:
+    """Count-Min sketch plus a bounded candidate set of the top-k keys"""
+
+    def __init__(self, k: int = 20, width: int = 2048, depth: int = 4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates: Dict[str, int] = {}
+
+    def add(self, value: str, count: int = 1):
+        if not value:
+            return
+        estimate = self.sketch.add(value, count)
+        if value in self.candidates or len(self.candidates) < self.k * 2:
+            self.candidates[value] = estimate
+            return
+        # Replace the weakest candidate only when the new key beats it
+        weakest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[weakest]:
+            del self.candidates[weakest]
+            self.candidates[value] = estimate
+
+    def merge(self, other: 'HeavyHitters'):
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        estimates = {key: self.sketch.estimate(key) for key in keys}
+        self.candidates = dict(heapq.nlargest(self.k * 2, estimates.items(), key=lambda item: item[1]))
+
+    def top(self, k: Optional[int] = None) -> List[Tuple[str, int]]:
+        return heapq.nlargest(k or self.k, self.candidates.items(), key=lambda item: item[1])
+
+
+class SketchWindow:
+    """All sketches for one time bucket"""
+
+    DISTINCT = ('users', 'ips', 'devices')
+    HEAVY = ('ips', 'failed_users', 'devices')
+
+    def __init__(self, precision: int = 12, k: int = 20):
+        self.distinct = {name: HyperLogLog(precision) for name in self.DISTINCT}
+        self.heavy = {name: HeavyHitters(k) for name in self.HEAVY}
+        self.events = 0
+
+    def merge(self, other: 'SketchWindow'):
+        for name in self.DISTINCT:
+            self.distinct[name].merge(other.distinct[name])
+        for name in self.HEAVY:
+            self.heavy[name].merge(other.heavy[name])
+        self.events += other.events
+
+
+class TrafficSketches:
+    """
+    Hourly sketch windows plus an all-time distinct-user counter.
+    Memory is fixed by (retained windows x sketch size), independent of traffic.
+    """
+
+    def __init__(self, window_seconds: int = 3600, retained_windows: int = 24,
+                 precision: int = 12, k: int = 20):
+        self.window_seconds = window_seconds
+        self.retained_windows = retained_windows
+        self.precision = precision
+        self.k = k
+        self.windows: Dict[int, SketchWindow] = {}
+        self.all_users = HyperLogLog(precision)
+
+    def _window(self, timestamp: float) -> SketchWindow:
+        bucket = int(timestamp // self.window_seconds)
+        window = self.windows.get(bucket)
+        if window is None:
+            window = self.windows[bucket] = SketchWindow(self.precision, self.k)
+            for old in sorted(self.windows)[:-self.retained_windows]:
+                del self.windows[old]
+        return window
+
+    def observe(self, activity: Any):
+        """Update all sketches with one activity"""
+        window = self._window(time.time())
+        window.events += 1
+        self.all_users.add(activity.user_id)
+        window.distinct['users'].add(activity.user_id)
+        window.distinct['ips'].add(activity.ip_address)
+        window.heavy['ips'].add(activity.ip_address)
+        if activity.device_fingerprint:
+            window.distinct['devices'].add(activity.device_fingerprint)
+            window.heavy['devices'].add(activity.device_fingerprint)
+        if not activity.success:
+            window.heavy['failed_users'].add(activity.user_id)
+
+    def _merged(self, hours: int) -> SketchWindow:
+        merged = SketchWindow(self.precision, self.k)
+        newest = int(time.time() // self.window_seconds)
+        for bucket, window in self.windows.items():
+            if bucket > newest - hours:
+                merged.merge(window)
+        return merged
+
+    def total_users(self) -> int:
+        return self.all_users.estimate()
+
+    def summary(self, hours: int = 1, k: int = 10) -> Dict[str, Any]:
+        """Distinct counts and top talkers over the last `hours` windows"""
+        merged = self._merged(hours)
+        return {
+            'hours': hours,
+            'events': merged.events,
+            'distinct': {name: hll.estimate() for name, hll in merged.distinct.items()},
+            'top': {
+                name: [{'key': key, 'count': count} for key, count in heavy.top(k)]
+                for name, heavy in merged.heavy.items()
+            }
+        }
+
+    def merge(self, other: 'TrafficSketches'):
+        """Fold in the sketches of another worker"""
+        self.all_users.merge(other.all_users)
+        for bucket, window in other.windows.items():
+            self.windows.setdefault(bucket, SketchWindow(self.precision, self.k)).merge(window)
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """
+        Copy of all sketches as checkpoint arrays. Take it on the thread that
+        calls observe(); write_checkpoint() can then run anywhere.
+        """
+        arrays = {'all_users': self.all_users.registers.copy()}
+        meta = {'windows': {}}
+        for bucket, window in self.windows.items():
+            for name, hll in window.distinct.items():
+                arrays[f"{bucket}_hll_{name}"] = hll.registers.copy()
+            for name, heavy in window.heavy.items():
+                arrays[f"{bucket}_cms_{name}"] = heavy.sketch.table.copy()
+            meta['windows'][str(bucket)] = {
+                'events': window.events,
+                'candidates': {name: heavy.candidates for name, heavy in window.heavy.items()}
+            }
+        # Serializing here also freezes the candidate dicts
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)
+        return arrays
+
+    def checkpoint(self, path: str):
+        """Write all sketches to an .npz file (atomically via a temp file)"""
+        write_checkpoint(path, self.snapshot())
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'TrafficSketches':
+        """Restore sketches from a checkpoint"""
+        sketches = cls(**kwargs)
+        with np.load(path) as data:
+            sketches.all_users.registers = data['all_users'].copy()
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            for bucket, info in meta['windows'].items():
+                window = SketchWindow(sketches.precision, sketches.k)
+                window.events = info['events']
+                for name in SketchWindow.DISTINCT:
+                    window.distinct[name].registers = data[f"{bucket}_hll_{name}"].copy()
+                for name in SketchWindow.HEAVY:
+                    window.heavy[name].sketch.table = data[f"{bucket}_cms_{name}"].copy()
+                    window.heavy[name].candidates = info['candidates'][name]
+                sketches.windows[int(bucket)] = window
+        return sketches
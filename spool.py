@@ -0,0 +1,387 @@
+"""
+Write-Ahead Spool for Third Umpire - AI Guard Dog System
+Append-only segment files in front of the database: ingestion acknowledges an
+event once it is on disk, and a background drain feeds it to storage and
+scoring, so a locked or slow database delays processing rather than losing data.
+"""
+
+import os
+import json
+import zlib
+import struct
+import asyncio
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+
+from metrics import SPOOL_DEAD_LETTERED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Every record: payload length and CRC32, little-endian, then the payload
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_PATTERN = "segment-{:012d}.log"
+CHECKPOINT_FILE = "checkpoint.json"
+DEAD_LETTER_FILE = "dead-letter.log"  # records the drain gave up on, in the segment format
+
+# (segment sequence number, byte offset within it)
+Position = Tuple[int, int]
+
+
+def _fsync_all(fds: List[int]):
+    for fd in fds:
+        os.fsync(fd)
+
+
+class SpoolFullError(Exception):
+    """The backlog has reached max_backlog_bytes; callers shed load until the drain catches up"""
+
+
+class Spool:
+    """
+    Durable FIFO of opaque payloads kept as numbered segment files.
+
+    Appends are buffered writes on the event loop; a flusher task group-commits
+    them with one fsync every `flush_interval` seconds and only then resolves
+    the appenders, so many concurrent events share each fsync. The drain reads
+    records up to the last fsynced position, hands them to a handler in
+    batches, and checkpoints the position after each batch it accepts. After a
+    crash the drain resumes from the checkpoint - records after it are replayed,
+    so handlers must be idempotent - and a record torn by the crash is cut off
+    the end of the newest segment. Segments wholly before the checkpoint are
+    deleted, so disk use is bounded by the backlog, not by history - and the
+    backlog by `max_backlog_bytes`, past which appends raise SpoolFullError.
+    """
+
+    def __init__(self, directory: str = "spool", segment_bytes: int = 16 * 1024 * 1024,
+                 flush_interval: float = 0.002, max_backlog_bytes: Optional[int] = None):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.max_backlog_bytes = max_backlog_bytes
+
+        self._file = None
+        self._segment = 0        # segment being appended to
+        self._size = 0           # bytes written to it (fsynced or not)
+        self._sizes: Dict[int, int] = {}  # sizes of the older segments still on disk
+        self._durable: Position = (0, 0)
+        self._sealed: List[Any] = []  # rolled segment files waiting for their final fsync
+        self._waiters: List[asyncio.Future] = []
+        self._dirty: Optional[asyncio.Event] = None
+        self._readable: Optional[asyncio.Event] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+        self._checkpoint: Position = (0, 0)
+        self._read_file = None
+        self._read_segment = -1
+
+        self.appended = 0
+        self.drained = 0
+        self.replayed = 0
+        self.fsyncs = 0
+        self.truncated_bytes = 0
+        self.drain_errors = 0
+        self.dead_lettered = 0
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / SEGMENT_PATTERN.format(segment)
+
+    def _segments(self) -> List[int]:
+        return sorted(int(path.stem.split('-')[1]) for path in self.directory.glob("segment-*.log"))
+
+    async def open(self):
+        """Recover the on-disk state and start accepting appends"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        checkpoint_path = self.directory / CHECKPOINT_FILE
+        if checkpoint_path.exists():
+            saved = json.loads(checkpoint_path.read_text())
+            self._checkpoint = (saved['segment'], saved['offset'])
+
+        segments = self._segments()
+        if segments:
+            self._segment = segments[-1]
+            self._size = self._recover_tail(self._segment)
+            self._sizes = {segment: self._segment_path(segment).stat().st_size for segment in segments[:-1]}
+            if self._checkpoint[0] < segments[0]:
+                # Checkpoint behind a compacted segment (or missing): start at the oldest kept
+                self._checkpoint = (segments[0], 0)
+        else:
+            self._segment = max(self._checkpoint[0], 1)
+            self._size = 0
+            self._checkpoint = (self._segment, 0)
+        self._checkpoint = min(self._checkpoint, (self._segment, self._size))
+
+        self._file = open(self._segment_path(self._segment), 'ab')
+        self._durable = (self._segment, self._size)
+        self._dirty = asyncio.Event()
+        self._readable = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+        self.replayed = self._count_records(self._checkpoint, self._durable)
+        if self.replayed:
+            logger.info(f"Spool: replaying {self.replayed} records from segment {self._checkpoint[0]} "
+                        f"offset {self._checkpoint[1]}")
+
+    def _recover_tail(self, segment: int) -> int:
+        """Validate the newest segment and cut off a record torn by a crash; returns its valid size"""
+        path = self._segment_path(segment)
+        valid = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid += RECORD_HEADER.size + length
+        size = path.stat().st_size
+        if size > valid:
+            logger.warning(f"Spool: truncating {size - valid} bytes of a torn record in {path.name}")
+            self.truncated_bytes += size - valid
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+                os.fsync(f.fileno())
+        return valid
+
+    def _count_records(self, start: Position, end: Position) -> int:
+        count = 0
+        for segment in self._segments():
+            if not start[0] <= segment <= end[0]:
+                continue
+            offset = start[1] if segment == start[0] else 0
+            limit = end[1] if segment == end[0] else None
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                while limit is None or offset < limit:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    length, _ = RECORD_HEADER.unpack(header)
+                    f.seek(length, os.SEEK_CUR)
+                    offset += RECORD_HEADER.size + length
+                    count += 1
+        return count
+
+    async def append(self, payloads: List[bytes]):
+        """Append payloads in order; returns once they are fsynced. Raises SpoolFullError when full"""
+        if not payloads:
+            return
+        if self.is_full():
+            raise SpoolFullError(f"Spool backlog is at its {self.max_backlog_bytes} byte limit")
+        write = self._file.write
+        for payload in payloads:
+            write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            write(payload)
+            self._size += RECORD_HEADER.size + len(payload)
+        self.appended += len(payloads)
+        if self._size >= self.segment_bytes:
+            # Seal here rather than in the flusher, which may never see an idle writer
+            self._sealed.append(self._file)
+            self._sizes[self._segment] = self._size
+            self._segment += 1
+            self._size = 0
+            self._file = open(self._segment_path(self._segment), 'ab')
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._dirty.set()
+        await future
+
+    async def _flush_loop(self):
+        """Group commit: one fsync covers every append since the previous one"""
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.flush_interval)  # let concurrent appends join this fsync
+            self._dirty.clear()
+            waiters, self._waiters = self._waiters, []
+            sealed, self._sealed = self._sealed, []
+            position = (self._segment, self._size)
+            files = sealed + [self._file]
+            try:
+                for f in files:
+                    f.flush()
+                await asyncio.to_thread(_fsync_all, [f.fileno() for f in files])
+            except Exception as e:
+                self._sealed = sealed + self._sealed
+                logger.error(f"Spool fsync failed: {e}")
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for f in sealed:
+                f.close()
+            self.fsyncs += 1
+            self._durable = position
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
+            self._readable.set()
+
+    def _read(self, position: Position, max_records: int) -> List[Tuple[bytes, Position]]:
+        """Durable records from `position` on, each with the position just after it"""
+        records = []
+        segment, offset = position
+        while len(records) < max_records and (segment, offset) < self._durable:
+            if self._read_segment != segment:
+                if self._read_file is not None:
+                    self._read_file.close()
+                self._read_file = open(self._segment_path(segment), 'rb')
+                self._read_segment = segment
+            # The live segment is readable up to its fsynced size; sealed ones to the end
+            limit = self._durable[1] if segment == self._durable[0] else None
+            self._read_file.seek(offset)
+            while len(records) < max_records and (limit is None or offset < limit):
+                header = self._read_file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, _ = RECORD_HEADER.unpack(header)
+                payload = self._read_file.read(length)
+                offset += RECORD_HEADER.size + length
+                records.append((payload, (segment, offset)))
+            if limit is None and len(records) < max_records:
+                segment, offset = segment + 1, 0
+        return records
+
+    def _commit(self, position: Position):
+        """Checkpoint the drain position and delete segments it has passed"""
+        if position == self._checkpoint:
+            return
+        self._checkpoint = position
+        path = self.directory / CHECKPOINT_FILE
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'segment': position[0], 'offset': position[1]}))
+        os.replace(tmp, path)
+        for segment in self._segments():
+            if segment >= position[0]:
+                break
+            self._segment_path(segment).unlink(missing_ok=True)
+            self._sizes.pop(segment, None)
+
+    def _dead_letter(self, records: List[Tuple[bytes, Position]]):
+        """Append records to the dead-letter file and fsync it, before the drain checkpoints past them"""
+        with open(self.directory / DEAD_LETTER_FILE, 'ab') as f:
+            for payload, _ in records:
+                f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def drain(self, handler: Callable[[List[bytes]], Awaitable[None]], batch_size: int = 500,
+                    retry_delay: float = 0.5, max_retry_delay: float = 30.0, max_attempts: int = 5,
+                    retryable: Optional[Callable[[Exception], bool]] = None):
+        """
+        Feed durable records to `handler` in order until stop_drain(). A batch
+        is checkpointed once the handler returns; if it raises, the same batch
+        is retried with exponential backoff. Errors `retryable` accepts (the
+        database is just locked) retry without limit, others `max_attempts`
+        times; a batch that keeps failing is then retried record by record, and
+        a record that keeps failing alone goes to the dead-letter file and is
+        checkpointed past, so one bad event cannot hold up the rest.
+        """
+        delay = retry_delay
+        attempts = 0
+        isolate_until: Optional[Position] = None  # end of a failed batch being retried record by record
+        while not self._stopped.is_set():
+            self._readable.clear()
+            isolating = isolate_until is not None and self._checkpoint < isolate_until
+            batch = self._read(self._checkpoint, 1 if isolating else batch_size)
+            if not batch:
+                await self._readable.wait()
+                continue
+            try:
+                await handler([payload for payload, _ in batch])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.drain_errors += 1
+                if retryable is None or not retryable(e):
+                    attempts += 1
+                if attempts >= max_attempts:
+                    attempts, delay = 0, retry_delay
+                    if len(batch) > 1:
+                        logger.warning(f"Spool batch of {len(batch)} failed {max_attempts} times, "
+                                       f"retrying its records one by one: {e}")
+                        isolate_until = batch[-1][1]
+                        continue
+                    await asyncio.to_thread(self._dead_letter, batch)
+                    self.dead_lettered += 1
+                    SPOOL_DEAD_LETTERED_TOTAL.inc()
+                    logger.error(f"Spool record at segment {self._checkpoint[0]} offset {self._checkpoint[1]} "
+                                 f"failed {max_attempts} times, moved to {DEAD_LETTER_FILE}: {e}")
+                    self._commit(batch[-1][1])
+                    continue
+                logger.warning(f"Spool drain failed, retrying in {delay:.1f}s: {e}")
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), delay)  # stop_drain() cuts the wait short
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, max_retry_delay)
+                continue
+            attempts, delay = 0, retry_delay
+            self.drained += len(batch)
+            self._commit(batch[-1][1])
+
+    def stop_drain(self):
+        """Ask drain() to return once its current batch is handled and checkpointed"""
+        if self._stopped is not None:
+            self._stopped.set()
+            self._readable.set()
+
+    def has_backlog(self) -> bool:
+        """Whether anything appended is still waiting for the drain"""
+        # Not a position comparison: a drain that finished a sealed segment sits at
+        # its end, which is the same place as offset 0 of the next one
+        return self.backlog_bytes() > 0
+
+    def backlog_bytes(self) -> int:
+        """Bytes appended but not yet drained"""
+        total = self._size + sum(size for segment, size in self._sizes.items() if segment >= self._checkpoint[0])
+        return total - self._checkpoint[1]
+
+    def is_full(self) -> bool:
+        """Whether the backlog has reached max_backlog_bytes (never, without a limit)"""
+        return self.max_backlog_bytes is not None and self.backlog_bytes() >= self.max_backlog_bytes
+
+    async def close(self):
+        """Stop the flusher after a final fsync; undrained records stay for the next start"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        for f in self._sealed:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self._sealed = []
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if self._read_file is not None:
+            self._read_file.close()
+            self._read_file = None
+        for future in self._waiters:
+            if not future.done():
+                future.set_result(None)
+        self._waiters = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'directory': str(self.directory),
+            'segments': len(self._segments()),
+            'segment': self._segment,
+            'checkpoint': {'segment': self._checkpoint[0], 'offset': self._checkpoint[1]},
+            'backlog_bytes': self.backlog_bytes() if self._file is not None else 0,
+            'max_backlog_bytes': self.max_backlog_bytes,
+            'appended': self.appended,
+            'drained': self.drained,
+            'replayed_on_start': self.replayed,
+            'fsyncs': self.fsyncs,
+            'records_per_fsync': self.appended / self.fsyncs if self.fsyncs else 0.0,
+            'truncated_bytes': self.truncated_bytes,
+            'drain_errors': self.drain_errors,
+            'dead_lettered': self.dead_lettered
+        }
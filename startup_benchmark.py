@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for Third Umpire - AI Guard Dog System
+Measures import time of the app module and, for a real uvicorn process,
+time until the first request is answered (liveness) and until it is ready.
+Exits non-zero when a measurement exceeds its budget, so it can gate CI.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import urllib.error
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _child_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(APP_DIR), env.get("PYTHONPATH")]))
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def measure_import(workdir: str, top: int = 10) -> dict:
+    """Seconds to import main in a fresh interpreter, plus the slowest modules"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"],
+        cwd=workdir, env=_child_env(), capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|", 2)
+            if cumulative.strip().isdigit():
+                modules.append((int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return {
+        "import_seconds": float(result.stdout.strip().splitlines()[-1]),
+        "slowest_imports_ms": {name: micros / 1000 for micros, name in modules[1:top + 1]}
+    }
+
+
+def _wait_for(url: str, started: float, timeout: float, process: subprocess.Popen):
+    """Seconds from `started` until url answers 200 (None on timeout or exit)"""
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def measure_server(workdir: str, timeout: float = 60.0) -> dict:
+    """Spawn uvicorn and time liveness (first request) and readiness"""
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=workdir, env=_child_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        first_request = _wait_for(f"{base}/api/health/live", started, timeout, process)
+        ready = _wait_for(f"{base}/api/health/ready", started, timeout, process) if first_request else None
+        return {"first_request_seconds": first_request, "ready_seconds": ready}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure and enforce startup time budgets")
+    parser.add_argument("--import-budget", type=float, default=1.5, help="seconds to import main")
+    parser.add_argument("--first-request-budget", type=float, default=3.0,
+                        help="seconds from process start to the first answered request")
+    parser.add_argument("--ready-budget", type=float, default=10.0,
+                        help="seconds from process start to readiness")
+    parser.add_argument("--runs", type=int, default=3, help="server starts to measure (median is used)")
+    args = parser.parse_args()
+
+    # Run in a scratch directory so the benchmark never touches the real database
+    with tempfile.TemporaryDirectory() as workdir:
+        report = measure_import(workdir)
+        runs = [measure_server(workdir) for _ in range(args.runs)]
+
+    def median(key):
+        values = sorted(run[key] for run in runs if run[key] is not None)
+        return values[len(values) // 2] if len(values) == len(runs) else None
+
+    report["first_request_seconds"] = median("first_request_seconds")
+    report["ready_seconds"] = median("ready_seconds")
+    report["runs"] = runs
+
+    failures = []
+    for key, budget in (("import_seconds", args.import_budget),
+                        ("first_request_seconds", args.first_request_budget),
+                        ("ready_seconds", args.ready_budget)):
+        if report[key] is None or report[key] > budget:
+            failures.append(f"{key}={report[key]} exceeds budget {budget}s")
+    report["budget_failures"] = failures
+
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
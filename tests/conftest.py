@@ -0,0 +1,8 @@
+"""
+Shared test setup: the application modules live at the repository root.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,129 @@
+"""
+HTTP ingest and dashboard routes, against the full application in a scratch directory.
+"""
+
+import os
+import sqlite3
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def app_env(tmp_path_factory):
+    """Import main from a scratch directory: the database, spool and checkpoints are created there"""
+    workdir = tmp_path_factory.mktemp("app")
+    previous = os.getcwd()
+    os.chdir(workdir)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["SPOOL_DIR"] = str(workdir / "spool")
+    import main
+    try:
+        with TestClient(main.app) as client:
+            deadline = time.time() + 120
+            while client.get("/api/health/ready").status_code != 200:
+                assert time.time() < deadline, "application did not become ready"
+                time.sleep(0.2)
+            yield main, client
+    finally:
+        os.chdir(previous)
+
+
+def _activity(user_id="alice"):
+    return {"id": str(uuid.uuid4()), "user_id": user_id, "action": "login", "ip_address": "10.0.0.1"}
+
+
+def _wait_for_drain(main, timeout=60):
+    deadline = time.time() + timeout
+    while main.ingest_spool.has_backlog():
+        assert time.time() < deadline, "spool backlog was not drained"
+        time.sleep(0.05)
+
+
+class _Locked:
+    """Hold the database write lock from another connection, like a long-running writer"""
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, isolation_level=None)
+
+    def __enter__(self):
+        self.connection.execute("BEGIN EXCLUSIVE")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.connection.execute("ROLLBACK")
+        self.connection.close()
+
+
+def test_dashboard_stats_are_never_answered_with_304(app_env):
+    main, client = app_env
+    first = client.get("/api/dashboard/stats")
+    assert first.status_code == 200
+    assert "etag" not in first.headers
+
+    # Even with nothing written in between: uptime, last_updated and today's counts move on regardless
+    second = client.get("/api/dashboard/stats", headers={"If-None-Match": "*"})
+    assert second.status_code == 200
+    assert "etag" not in second.headers
+
+
+def test_recent_activities_etag_changes_with_writes(app_env):
+    main, client = app_env
+    etag = client.get("/api/activities/recent").headers["etag"]
+    assert client.get("/api/activities/recent", headers={"If-None-Match": etag}).status_code == 304
+
+    assert client.post("/api/activities", json=_activity()).json()["status"] != "error"
+    _wait_for_drain(main)
+    after = client.get("/api/activities/recent", headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["etag"] != etag
+
+
+def test_new_events_queue_behind_the_spool_backlog(app_env):
+    main, client = app_env
+    first, second = _activity("bob"), _activity("bob")
+    busy = main.SPOOLED_TOTAL.value(reason='db_busy')
+    backlog = main.SPOOLED_TOTAL.value(reason='backlog')
+
+    with _Locked(main.db_manager.db_path):
+        # The database is locked: the first event is acknowledged from the spool...
+        assert client.post("/api/activities", json=first).json()["status"] == "accepted"
+        assert main.SPOOLED_TOTAL.value(reason='db_busy') == busy + 1
+        assert main.ingest_spool.has_backlog()
+        # ...and the next one queues behind it rather than overtaking it
+        assert client.post("/api/activities", json=second).json()["status"] == "accepted"
+        assert main.SPOOLED_TOTAL.value(reason='backlog') == backlog + 1
+
+    _wait_for_drain(main)
+    client.portal.call(main.db_manager.flush_scored)
+    with sqlite3.connect(f"file:{main.db_manager.db_path}?mode=ro", uri=True) as reader:
+        rows = reader.execute(
+            "SELECT id, scored FROM user_activities WHERE id IN (?, ?) ORDER BY rowid", (first["id"], second["id"])
+        ).fetchall()
+    assert rows == [(first["id"], 1), (second["id"], 1)]
+
+    # With the backlog gone, events are stored in the request again
+    spooled = main.SPOOLED_TOTAL.value(reason='backlog')
+    assert client.post("/api/activities", json=_activity("bob")).json()["status"] != "accepted"
+    assert main.SPOOLED_TOTAL.value(reason='backlog') == spooled
+
+
+def test_full_spool_answers_503(app_env):
+    main, client = app_env
+    limit = main.ingest_spool.max_backlog_bytes
+    main.ingest_spool.max_backlog_bytes = 1
+    try:
+        with _Locked(main.db_manager.db_path):
+            assert client.post("/api/activities", json=_activity("carol")).json()["status"] == "accepted"
+            refused = client.post("/api/activities", json=_activity("carol"))
+            assert refused.status_code == 503
+            assert refused.headers["retry-after"] == str(main.SPOOL_FULL_RETRY_AFTER)
+            assert client.post("/api/activities/bulk", json=[_activity("carol")]).status_code == 503
+    finally:
+        main.ingest_spool.max_backlog_bytes = limit
+    _wait_for_drain(main)
@@ -0,0 +1,66 @@
+"""
+Forward-decayed counts in the drift monitor and the adaptive thresholds across long idle gaps.
+"""
+
+import math
+import time
+
+import numpy as np
+
+from drift import FeatureDriftMonitor
+from thresholds import AdaptiveThresholds, DecayedHistogram
+
+# Far enough that 2^(gap / half_life) does not fit in a float
+IDLE_HALF_LIVES = 10000
+
+
+def _monitor():
+    monitor = FeatureDriftMonitor(feature_names=['hour', 'size'], half_life_seconds=60.0)
+    rng = np.random.default_rng(0)
+    monitor.set_reference(np.column_stack([rng.integers(0, 24, 500), rng.normal(size=500)]))
+    return monitor
+
+
+def test_drift_observe_after_a_long_idle_gap():
+    monitor = _monitor()
+    for _ in range(50):
+        monitor.observe([9, 0.1])
+    monitor.landmark -= IDLE_HALF_LIVES * monitor.half_life
+
+    monitor.observe([9, 0.1])
+    assert math.isfinite(monitor.total)
+    assert all(math.isfinite(count) for counts in monitor.live for count in counts)
+    # The old traffic has decayed away; only the new event is left
+    assert abs(monitor.live_events() - 1.0) < 0.01
+    assert all(math.isfinite(value) for value in monitor.psi().values())
+
+
+def test_drift_live_events_reads_zero_after_a_long_idle_gap():
+    monitor = _monitor()
+    monitor.observe([9, 0.1])
+    assert monitor.live_events(time.time() + IDLE_HALF_LIVES * monitor.half_life) == 0.0
+
+
+def test_histogram_add_after_a_long_idle_gap():
+    histogram = DecayedHistogram(bins=100, half_life_seconds=60.0)
+    now = time.time()
+    for _ in range(100):
+        histogram.add(0.2, now)
+
+    later = now + IDLE_HALF_LIVES * histogram.half_life
+    histogram.add(0.9, later)
+    assert np.isfinite(histogram.counts).all()
+    assert abs(histogram.count(later) - 1.0) < 0.01
+    assert histogram.quantiles([0.5])[0] == 0.91
+
+
+def test_thresholds_evaluate_after_a_long_idle_gap():
+    thresholds = AdaptiveThresholds(half_life_seconds=60.0, min_events=10, refresh_every=10)
+    for _ in range(20):
+        thresholds.evaluate('alice', 'user', 0.1)
+    for histogram in [thresholds.global_scores, *thresholds.role_scores, *thresholds._users.values()]:
+        histogram.landmark -= IDLE_HALF_LIVES * histogram.half_life
+
+    assert thresholds.evaluate('alice', 'user', 0.99) == 'high'
+    report = thresholds.get_report()
+    assert math.isfinite(report['global']['events'])
@@ -0,0 +1,201 @@
+"""
+Write-ahead spool: crash recovery, checkpointing, dead-lettering and the backlog cap.
+"""
+
+import asyncio
+import json
+import zlib
+
+import pytest
+
+from spool import Spool, SpoolFullError, RECORD_HEADER, CHECKPOINT_FILE, DEAD_LETTER_FILE
+
+
+def _payloads(count, prefix="event"):
+    return [f"{prefix}-{i}".encode() for i in range(count)]
+
+
+async def _drain_all(spool, handler=None, **kwargs):
+    """Drain until the backlog is empty, then stop the drain; returns what reached the handler"""
+    seen = []
+
+    async def collect(batch):
+        if handler is not None:
+            await handler(batch)
+        seen.extend(batch)
+
+    task = asyncio.create_task(spool.drain(collect, **kwargs))
+    while spool.has_backlog():
+        await asyncio.sleep(0.01)
+    spool.stop_drain()
+    await asyncio.wait_for(task, 5)
+    return seen
+
+
+def _run(coroutine):
+    asyncio.run(asyncio.wait_for(coroutine, 30))
+
+
+async def _crash(directory, payloads, segment_bytes=16 * 1024 * 1024):
+    """Append and fsync, then drop the spool without close() (the process died)"""
+    spool = Spool(directory, segment_bytes=segment_bytes, flush_interval=0.001)
+    await spool.open()
+    await spool.append(payloads)
+    spool._flusher.cancel()
+    return spool
+
+
+def _newest_segment(directory):
+    return sorted(directory.glob("segment-*.log"))[-1]
+
+
+def test_replay_cuts_off_a_torn_record(tmp_path):
+    async def run():
+        spool = await _crash(tmp_path, _payloads(10))
+        spool._file.close()
+        with open(_newest_segment(tmp_path), 'ab') as f:
+            # Header of a 100 byte record whose payload never made it to disk
+            f.write(RECORD_HEADER.pack(100, 0) + b"partial")
+
+        recovered = Spool(tmp_path, flush_interval=0.001)
+        await recovered.open()
+        assert recovered.truncated_bytes == RECORD_HEADER.size + len(b"partial")
+        assert recovered.replayed == 10
+
+        # Appends after recovery follow the last intact record
+        await recovered.append([b"after"])
+        assert await _drain_all(recovered) == _payloads(10) + [b"after"]
+        await recovered.close()
+
+    _run(run())
+
+
+def test_replay_stops_at_a_record_with_a_bad_crc(tmp_path):
+    async def run():
+        spool = await _crash(tmp_path, _payloads(5))
+        spool._file.close()
+        path = _newest_segment(tmp_path)
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 0xFF  # flip a bit in the last payload
+        path.write_bytes(bytes(data))
+
+        recovered = Spool(tmp_path, flush_interval=0.001)
+        await recovered.open()
+        assert recovered.truncated_bytes == RECORD_HEADER.size + len(b"event-4")
+        assert await _drain_all(recovered) == _payloads(4)
+        await recovered.close()
+
+    _run(run())
+
+
+def test_checkpoint_resumes_after_the_drained_records_and_deletes_old_segments(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, segment_bytes=64, flush_interval=0.001)
+        await spool.open()
+        for payload in _payloads(20):
+            await spool.append([payload])
+        assert len(list(tmp_path.glob("segment-*.log"))) > 3
+
+        drained = []
+
+        async def handler(batch):
+            drained.extend(batch)
+            if len(drained) >= 12:
+                spool.stop_drain()
+
+        await spool.drain(handler, batch_size=4)
+        await spool.close()
+        assert drained == _payloads(12)
+
+        checkpoint = json.loads((tmp_path / CHECKPOINT_FILE).read_text())
+        segments = sorted(int(path.stem.split('-')[1]) for path in tmp_path.glob("segment-*.log"))
+        assert segments[0] == checkpoint['segment']
+
+        reopened = Spool(tmp_path, segment_bytes=64, flush_interval=0.001)
+        await reopened.open()
+        assert reopened.replayed == 8
+        assert await _drain_all(reopened) == _payloads(20)[12:]
+        assert not reopened.has_backlog()
+        checkpoint = json.loads((tmp_path / CHECKPOINT_FILE).read_text())
+        assert min(reopened._segments()) == checkpoint['segment']
+        await reopened.close()
+
+    _run(run())
+
+
+def test_no_backlog_once_the_drain_reaches_the_end_of_a_sealed_segment(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, segment_bytes=RECORD_HEADER.size + 8, flush_interval=0.001)
+        await spool.open()
+        await spool.append([b"12345678"])  # fills the segment, so the next append starts a new one
+        assert spool._segment == 2
+        assert await _drain_all(spool) == [b"12345678"]
+        assert not spool.has_backlog() and spool.backlog_bytes() == 0
+        await spool.close()
+
+    _run(run())
+
+
+def test_a_record_that_keeps_failing_is_dead_lettered(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, flush_interval=0.001)
+        await spool.open()
+        await spool.append([b"good-1", b"poison", b"good-2"])
+        stored = []
+
+        async def handler(batch):
+            if b"poison" in batch:
+                raise ValueError("cannot store")
+            stored.extend(batch)
+
+        await _drain_all(spool, handler, retry_delay=0.001, max_attempts=2)
+        await spool.close()
+
+        assert stored == [b"good-1", b"good-2"]
+        assert spool.dead_lettered == 1
+        dead = (tmp_path / DEAD_LETTER_FILE).read_bytes()
+        length, crc = RECORD_HEADER.unpack(dead[:RECORD_HEADER.size])
+        payload = dead[RECORD_HEADER.size:RECORD_HEADER.size + length]
+        assert payload == b"poison" and zlib.crc32(payload) == crc
+
+    _run(run())
+
+
+def test_locked_database_errors_do_not_count_towards_dead_lettering(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, flush_interval=0.001)
+        await spool.open()
+        await spool.append([b"event"])
+        failures = []
+
+        async def handler(batch):
+            if len(failures) < 5:
+                failures.append(batch)
+                raise RuntimeError("database is locked")
+
+        await _drain_all(spool, handler, retry_delay=0.001, max_attempts=2,
+                         retryable=lambda e: "locked" in str(e))
+        await spool.close()
+        assert len(failures) == 5
+        assert spool.dead_lettered == 0 and spool.drained == 1
+
+    _run(run())
+
+
+def test_appends_past_the_backlog_limit_are_refused(tmp_path):
+    async def run():
+        spool = Spool(tmp_path, flush_interval=0.001, max_backlog_bytes=100)
+        await spool.open()
+        await spool.append([b"x" * 60])
+        await spool.append([b"x" * 60])  # the check is before the write, so one batch may overshoot
+        assert spool.is_full()
+        with pytest.raises(SpoolFullError):
+            await spool.append([b"x"])
+
+        await _drain_all(spool)
+        assert not spool.is_full()
+        await spool.append([b"x"])
+        assert spool.has_backlog()
+        await spool.close()
+
+    _run(run())
@@ -0,0 +1,237 @@
+"""
+Adaptive Alert Thresholds for Third Umpire - AI Guard Dog System
+Streaming quantiles of final anomaly scores (globally, per role and per user)
+turn a target percentile or a target alerts/hour into score cutoffs that
+follow the traffic mix, with fixed memory per tracked scope.
+"""
+
+import math
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from models import ROLE_NAMES, ROLE_CODES
+
+logger = logging.getLogger(__name__)
+
+# Percentiles reported for every scope's score distribution
+REPORT_QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+# Half-lives after which the decay landmark moves forward (weights stay below 2^40)
+REBASE_HALF_LIVES = 40
+
+
+class DecayedHistogram:
+    """
+    Quantile sketch for values in [0, 1]: a fixed-bin histogram with exponential
+    time decay. Decay uses forward weighting - new samples get weight
+    2^(age/half_life) relative to a landmark - so updates are O(1) and the whole
+    array is only rescaled when weights grow large. Reads decay with a negative
+    exponent, so a scope idle for any length of time reads as empty instead of
+    overflowing.
+    """
+
+    __slots__ = ('bins', 'half_life', 'counts', 'total', 'landmark')
+
+    def __init__(self, bins: int = 1000, half_life_seconds: float = 3600.0, dtype=np.float64):
+        self.bins = bins
+        self.half_life = half_life_seconds
+        self.counts = np.zeros(bins, dtype=dtype)
+        self.total = 0.0
+        self.landmark = time.time()
+
+    def _decay(self, now: float) -> float:
+        """Factor from landmark-relative weights to current counts (underflows to 0, never overflows)"""
+        return 2.0 ** (-(now - self.landmark) / self.half_life)
+
+    def add(self, value: float, now: float):
+        if now - self.landmark > REBASE_HALF_LIVES * self.half_life:
+            decay = self._decay(now)
+            self.counts *= decay
+            self.total *= decay
+            self.landmark = now
+        weight = 2.0 ** ((now - self.landmark) / self.half_life)
+        index = min(max(int(value * self.bins), 0), self.bins - 1)
+        self.counts[index] += weight
+        self.total += weight
+
+    def count(self, now: float) -> float:
+        """Decayed number of samples (a steady rate r/s converges to r * half_life / ln 2)"""
+        return self.total * self._decay(now)
+
+    def rate_per_hour(self, now: float) -> float:
+        return self.count(now) * math.log(2) / self.half_life * 3600
+
+    def quantiles(self, qs) -> np.ndarray:
+        """Upper bin edges at the given quantiles (error at most one bin width)"""
+        if self.total <= 0:
+            return np.zeros(len(qs))
+        cumulative = np.cumsum(self.counts, dtype=np.float64)
+        index = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return (np.minimum(index, self.bins - 1) + 1) / self.bins
+
+    def fraction_above(self, value: float) -> float:
+        if self.total <= 0:
+            return 0.0
+        index = min(max(int(value * self.bins), 0), self.bins - 1)
+        return float(self.counts[index + 1:].sum() / self.counts.sum())
+
+
+class AdaptiveThresholds:
+    """
+    Alert and high-severity cutoffs derived from the live score distribution.
+    An event is judged against the most specific scope with enough history
+    (user, then role, then global); until the global scope is warm the fixed
+    legacy cutoffs apply. Cutoffs are clamped to [min_threshold, max_threshold]
+    so a noisy population cannot silence clear anomalies; the floor defaults to
+    the legacy alert cutoff, so adapting only ever raises the bar for noisy
+    scopes and never alerts on scores the fixed cutoff would have passed.
+    """
+
+    def __init__(self, target_percentile: float = 0.99, target_alerts_per_hour: Optional[float] = None,
+                 high_percentile: float = 0.999, min_threshold: float = 0.7, max_threshold: float = 0.95,
+                 default_threshold: float = 0.7, default_high_threshold: float = 0.9,
+                 half_life_seconds: float = 3600.0, global_bins: int = 1000, user_bins: int = 100,
+                 max_users: int = 10000, min_events: int = 200, user_min_events: int = 50,
+                 refresh_every: int = 100):
+        self.target_percentile = target_percentile
+        self.target_alerts_per_hour = target_alerts_per_hour
+        self.high_percentile = high_percentile
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.default_threshold = default_threshold
+        self.default_high_threshold = default_high_threshold
+        self.half_life = half_life_seconds
+        self.user_bins = user_bins
+        self.max_users = max_users
+        self.min_events = min_events
+        self.user_min_events = user_min_events
+        self.refresh_every = refresh_every
+
+        self.global_scores = DecayedHistogram(global_bins, half_life_seconds)
+        self.role_scores = [DecayedHistogram(global_bins, half_life_seconds) for _ in ROLE_NAMES]
+        self._users: "OrderedDict[str, DecayedHistogram]" = OrderedDict()
+
+        # Cached (threshold, high_threshold) for the global and role scopes
+        self._global_cutoffs = (default_threshold, default_high_threshold)
+        self._role_cutoffs = [None] * len(ROLE_NAMES)
+        self._since_refresh = 0
+        self.evaluated = 0
+        self.alerts = 0
+
+    def _percentiles(self, now: float) -> Tuple[float, float]:
+        """Alert and high-severity percentiles, from the alert budget when one is set"""
+        percentile = self.target_percentile
+        if self.target_alerts_per_hour is not None:
+            events_per_hour = self.global_scores.rate_per_hour(now)
+            if events_per_hour > 0:
+                percentile = 1.0 - self.target_alerts_per_hour / events_per_hour
+        percentile = min(max(percentile, 0.5), 0.9999)
+        return percentile, max(self.high_percentile, percentile)
+
+    def _cutoffs(self, histogram: DecayedHistogram, percentiles: Tuple[float, float]) -> Tuple[float, float]:
+        threshold, high = np.clip(histogram.quantiles(percentiles), self.min_threshold, self.max_threshold)
+        return float(threshold), float(max(high, threshold))
+
+    def _refresh(self, now: float):
+        percentiles = self._percentiles(now)
+        if self.global_scores.count(now) >= self.min_events:
+            self._global_cutoffs = self._cutoffs(self.global_scores, percentiles)
+        self._role_cutoffs = [
+            self._cutoffs(histogram, percentiles) if histogram.count(now) >= self.min_events else None
+            for histogram in self.role_scores
+        ]
+        self._since_refresh = 0
+
+    def _user_histogram(self, user_id: str) -> DecayedHistogram:
+        histogram = self._users.get(user_id)
+        if histogram is None:
+            histogram = self._users[user_id] = DecayedHistogram(self.user_bins, self.half_life, np.float32)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return histogram
+
+    def thresholds_for(self, user_id: str, role: str, now: Optional[float] = None) -> Tuple[float, float, str]:
+        """(threshold, high_threshold, scope) that currently apply to a user"""
+        now = now if now is not None else time.time()
+        user = self._users.get(user_id)
+        if user is not None and user.count(now) >= self.user_min_events:
+            return (*self._cutoffs(user, self._percentiles(now)), 'user')
+        role_cutoffs = self._role_cutoffs[ROLE_CODES[role]]
+        if role_cutoffs is not None:
+            return (*role_cutoffs, 'role')
+        return (*self._global_cutoffs, 'global')
+
+    def evaluate(self, user_id: str, role: str, score: float) -> Optional[str]:
+        """
+        Judge a final score against the current cutoffs, then fold it into the
+        distributions. Returns the alert severity, or None for no alert.
+        """
+        now = time.time()
+        threshold, high, _ = self.thresholds_for(user_id, role, now)
+        severity = None
+        if score > threshold:
+            severity = "high" if score > high else "medium"
+            self.alerts += 1
+
+        self.global_scores.add(score, now)
+        self.role_scores[ROLE_CODES[role]].add(score, now)
+        self._user_histogram(user_id).add(score, now)
+        self.evaluated += 1
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh_every:
+            self._refresh(now)
+        return severity
+
+    def _describe(self, histogram: DecayedHistogram, cutoffs: Optional[Tuple[float, float]],
+                  now: float) -> Dict[str, Any]:
+        return {
+            'events': histogram.count(now),
+            'events_per_hour': histogram.rate_per_hour(now),
+            'threshold': cutoffs[0] if cutoffs else None,
+            'high_threshold': cutoffs[1] if cutoffs else None,
+            'expected_alert_rate': histogram.fraction_above(cutoffs[0]) if cutoffs else None,
+            'quantiles': dict(zip(
+                (f"p{q * 100:g}" for q in REPORT_QUANTILES),
+                histogram.quantiles(REPORT_QUANTILES).tolist()
+            ))
+        }
+
+    def get_report(self) -> Dict[str, Any]:
+        """Targets, current cutoffs and score distributions for the global and role scopes"""
+        now = time.time()
+        percentile, high_percentile = self._percentiles(now)
+        warm = self.global_scores.count(now) >= self.min_events
+        return {
+            'target_percentile': self.target_percentile,
+            'target_alerts_per_hour': self.target_alerts_per_hour,
+            'effective_percentile': percentile,
+            'high_percentile': high_percentile,
+            'bounds': [self.min_threshold, self.max_threshold],
+            'half_life_seconds': self.half_life,
+            'evaluated': self.evaluated,
+            'alerts': self.alerts,
+            'tracked_users': len(self._users),
+            'global': {**self._describe(self.global_scores, self._global_cutoffs, now), 'warm': warm},
+            'roles': {
+                name: self._describe(self.role_scores[code], self._role_cutoffs[code], now)
+                for code, name in enumerate(ROLE_NAMES)
+            }
+        }
+
+    def get_user_report(self, user_id: str, role: str) -> Dict[str, Any]:
+        """Cutoffs that apply to one user and their own score distribution, if tracked"""
+        now = time.time()
+        threshold, high, scope = self.thresholds_for(user_id, role, now)
+        histogram = self._users.get(user_id)
+        return {
+            'user_id': user_id,
+            'scope': scope,
+            'threshold': threshold,
+            'high_threshold': high,
+            'distribution': self._describe(histogram, None, now) if histogram is not None else None
+        }
@@ -10,8 +10,17 @@ from typing import List, Dict, Any
 from fastapi import WebSocket
 from datetime import datetime
 
+from metrics import WS_SEND_SECONDS, WS_PENDING_SENDS, WS_SEND_FAILURES_TOTAL
+from log_pipeline import sampled_event
+
 logger = logging.getLogger(__name__)
 
+def _json_default(value: Any) -> Any:
+    """Serialize datetimes (and enums) that appear in model dicts"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return getattr(value, 'value', str(value))
+
 class ConnectionManager:
     """
     Manages WebSocket connections for real-time updates
@@ -52,7 +61,7 @@ class ConnectionManager:
         }
         
         await self._broadcast_message(message)
-        logger.info(f"Broadcasted alert to {len(self.active_connections)} clients")
+        logger.info("Broadcasted alert", extra=sampled_event(clients=len(self.active_connections)))
     
     async def broadcast_activity(self, activity_data: Dict[str, Any]):
         """Broadcast a new user activity to all connected clients"""
@@ -98,15 +107,23 @@ class ConnectionManager:
         if not self.active_connections:
             return
         
-        message_str = json.dumps(message)
+        message_str = json.dumps(message, default=_json_default)
+        message_type = message.get('type', 'unknown')
+        connections = list(self.active_connections)
         disconnected = []
         
-        for connection in self.active_connections:
+        # Clients are sent to one after another; the gauge shows how deep that queue is
+        WS_PENDING_SENDS.inc(len(connections))
+        for connection in connections:
             try:
-                await connection.send_text(message_str)
+                with WS_SEND_SECONDS.time(type=message_type):
+                    await connection.send_text(message_str)
             except Exception as e:
+                WS_SEND_FAILURES_TOTAL.inc()
                 logger.warning(f"Failed to send message to client: {e}")
                 disconnected.append(connection)
+            finally:
+                WS_PENDING_SENDS.dec()
         
         # Remove disconnected clients
         for connection in disconnected:
@@ -115,9 +132,11 @@ class ConnectionManager:
     async def send_to_client(self, websocket: WebSocket, message: Dict[str, Any]):
         """Send a message to a specific client"""
         try:
-            message_str = json.dumps(message)
-            await websocket.send_text(message_str)
+            message_str = json.dumps(message, default=_json_default)
+            with WS_SEND_SECONDS.time(type=message.get('type', 'unknown')):
+                await websocket.send_text(message_str)
         except Exception as e:
+            WS_SEND_FAILURES_TOTAL.inc()
             logger.warning(f"Failed to send message to specific client: {e}")
             self.disconnect(websocket)
     
@@ -163,6 +182,15 @@ class ConnectionManager:
             
             logger.info(f"Client subscribed to: {subscription_type}")
     
+    async def send_replay(self, websocket: WebSocket, alerts: List[Dict[str, Any]],
+                          activities: List[Dict[str, Any]]):
+        """Send a newly connected client the latest alerts and activities"""
+        await self.send_to_client(websocket, {
+            'type': 'replay',
+            'data': {'alerts': alerts, 'activities': activities},
+            'timestamp': datetime.now().isoformat()
+        })
+    
     def get_connection_count(self) -> int:
         """Get the number of active connections"""
         return len(self.active_connections)
@@ -194,7 +222,9 @@ class ConnectionManager:
         }
         
         await self._broadcast_message(message)
-        logger.info(f"Broadcasted custom event '{event_type}' to {len(self.active_connections)} clients")
+        logger.info("Broadcasted custom event", extra=sampled_event(
+            event_type=event_type, clients=len(self.active_connections)
+        ))
     
     async def start_heartbeat(self):
         """Start sending heartbeat messages to keep connections alive"""